@@ -0,0 +1,46 @@
+"""
+Requests/sec of NominatimWrapper against a local stand-in server, with a
+bare `requests.post` per address (previous behaviour) and with the pooled
+session owned by the geocoder.
+
+Usage: python benchmarks/bench_nominatim_session.py [n_calls]
+"""
+import os
+import sys
+import time
+
+import requests
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from geopy_nominatim_wrapper import NominatimWrapper
+from standin_server import StandInServer
+
+query = {"street": "Avenue Fonsny", "housenumber": "20", "postcode": "1060", "city": "Saint-Gilles"}
+
+
+def bench_bare_post(geocoder, n_calls):
+    url = geocoder._construct_url(geocoder.api, {"mode": "short"})
+    start = time.perf_counter()
+    for _ in range(n_calls):
+        requests.post(url, json=query, timeout=10).json()
+    return n_calls / (time.perf_counter() - start)
+
+
+def bench_session(geocoder, n_calls):
+    start = time.perf_counter()
+    for _ in range(n_calls):
+        geocoder.geocode(query)
+    return n_calls / (time.perf_counter() - start)
+
+
+if __name__ == "__main__":
+    n_calls = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+
+    server = StandInServer().start()
+    try:
+        with NominatimWrapper(domain=server.domain, timeout=10) as geocoder:
+            print(f"bare requests.post : {bench_bare_post(geocoder, n_calls):8.0f} req/s")
+            print(f"pooled session     : {bench_session(geocoder, n_calls):8.0f} req/s")
+    finally:
+        server.stop()
@@ -0,0 +1,200 @@
+"""
+Replay the Geocoder_Dataprep samples (best, kbo, rrn, rep, resto) against
+BestAddress, Pelias and NominatimWrapper, and report for each pair:
+
+- throughput (geocode calls/s and HTTP requests/s);
+- latency percentiles (p50, p95, p99) of the geocode calls;
+- retries and errors;
+- hit rate per precision level and depth of the BestAddress cascade;
+- client-side CPU time per call.
+
+By default, the geocoders call a local stand-in server (started in a child
+process, see standin_server.py) with a configurable latency; use --live
+to call the services configured in credentials.py instead.
+
+Results are printed and written as JSON (--output), and can be compared
+with the results of a previous run (--compare).
+
+Usage:
+    python benchmarks/run_benchmarks.py --limit 1000 --latency 0.02 --workers 4 --output bench.json
+    python benchmarks/run_benchmarks.py --compare bench.json
+"""
+import argparse
+import collections
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from geopy_bestaddress import BestAddress
+from geopy_nominatim_wrapper import NominatimWrapper
+from geopy_pelias import Pelias
+from geopy_ratelimit import AdaptiveRateLimiter
+from standin_server import StandInProcess
+
+DATASETS = ["best", "kbo", "rrn", "rep", "resto"]
+GEOCODERS = ["best", "pelias", "nominatim"]
+
+
+def make_geocoder(name, domain, limiter, args):
+    live = args.live
+    if name == "best":
+        if live:
+            from credentials import best_client_id, best_client_secret, best_hostname_gw, best_prefix_gw, belgov_trace_id
+            return BestAddress(scheme="https", domain=best_hostname_gw, prefix=best_prefix_gw,
+                               client_id=best_client_id, client_secret=best_client_secret,
+                               belgov_trace_id=belgov_trace_id, timeout=30, rate_limiter=limiter)
+        return BestAddress(scheme="http", domain=domain, client_id="standin", client_secret="standin",
+                           timeout=30, rate_limiter=limiter)
+    if name == "pelias":
+        if live:
+            domain = args.pelias_domain
+        return Pelias(domain, scheme="http", timeout=30, rate_limiter=limiter)
+    if name == "nominatim":
+        if live:
+            return NominatimWrapper(domain=args.nominatim_domain, timeout=30, rate_limiter=limiter)
+        return NominatimWrapper(domain=domain, scheme="http", timeout=30, rate_limiter=limiter)
+    raise ValueError(f"Unknown geocoder '{name}'")
+
+
+def load_queries(data_dir, dataset, sample_size, limit):
+    df = pd.read_csv(f"{data_dir}/{dataset}_{sample_size}.csv.gz", dtype=str).fillna("")
+    if limit:
+        df = df.iloc[:limit]
+    return df[["street", "housenumber", "postcode", "city"]].to_dict("records")
+
+
+def run_one(geocoder, limiter, queries, workers):
+    """
+    Geocode all queries with `workers` threads, and return the metrics.
+    """
+    def timed_geocode(query):
+        start = time.perf_counter()
+        try:
+            res, error = geocoder.geocode(query), None
+        except Exception as e:
+            res, error = None, e
+        return time.perf_counter() - start, res, error
+
+    cpu_start, wall_start = time.process_time(), time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = list(executor.map(timed_geocode, queries))
+    wall, cpu = time.perf_counter() - wall_start, time.process_time() - cpu_start
+
+    latencies = np.array([r[0] for r in results])
+    found = [r[1] for r in results if r[1] is not None]
+    precision = collections.Counter(loc.raw.get("precision", "found") if isinstance(loc.raw, dict) else "found"
+                                    for loc in found)
+    precision["not_found"] = sum(r[1] is None and r[2] is None for r in results)
+    levels = [loc.raw["cascade_level"] for loc in found if isinstance(loc.raw, dict) and "cascade_level" in loc.raw]
+    stats = limiter.stats()
+
+    return {"calls": len(queries),
+            "http_requests": stats["calls"],
+            "calls_per_s": len(queries) / wall,
+            "http_requests_per_s": stats["calls"] / wall,
+            "latency_ms": {"mean": latencies.mean() * 1000,
+                           "p50": np.percentile(latencies, 50) * 1000,
+                           "p95": np.percentile(latencies, 95) * 1000,
+                           "p99": np.percentile(latencies, 99) * 1000},
+            "retries": stats["retries"],
+            "errors": sum(r[2] is not None for r in results),
+            "precision": {k: v / len(queries) for k, v in sorted(precision.items())},
+            "cascade_depth": {"mean": float(np.mean(levels)) if levels else None,
+                              "hist": {int(k): v for k, v in sorted(collections.Counter(levels).items())}},
+            "cpu_ms_per_call": cpu / len(queries) * 1000}
+
+
+def git_version():
+    try:
+        return subprocess.run(["git", "describe", "--always", "--dirty"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        return None
+
+
+def print_results(results, previous=None):
+    previous = {(r["geocoder"], r["dataset"]): r for r in (previous or [])}
+    print(f"{'geocoder':10} {'dataset':6} {'calls/s':>8} {'http/s':>8} {'p50':>7} {'p95':>7} {'p99':>7} "
+          f"{'retries':>7} {'errors':>6} {'depth':>5} {'cpu ms':>6}  precision")
+    for r in results:
+        depth = r["cascade_depth"]["mean"]
+        line = (f"{r['geocoder']:10} {r['dataset']:6} {r['calls_per_s']:8.1f} {r['http_requests_per_s']:8.1f} "
+                f"{r['latency_ms']['p50']:7.1f} {r['latency_ms']['p95']:7.1f} {r['latency_ms']['p99']:7.1f} "
+                f"{r['retries']:7d} {r['errors']:6d} {depth if depth is not None else float('nan'):5.2f} "
+                f"{r['cpu_ms_per_call']:6.2f}  "
+                + ", ".join(f"{k}: {v:.0%}" for k, v in r["precision"].items()))
+        prev = previous.get((r["geocoder"], r["dataset"]))
+        if prev is not None:
+            line += (f"  [calls/s {r['calls_per_s'] / prev['calls_per_s'] - 1:+.0%}, "
+                     f"p95 {r['latency_ms']['p95'] / prev['latency_ms']['p95'] - 1:+.0%}]")
+        print(line)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--data-dir", default="data/geocoding")
+    parser.add_argument("--sample-size", type=int, default=10000)
+    parser.add_argument("--datasets", nargs="+", default=DATASETS, choices=DATASETS)
+    parser.add_argument("--geocoders", nargs="+", default=GEOCODERS, choices=GEOCODERS)
+    parser.add_argument("--limit", type=int, default=None, help="Number of queries per dataset")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--max-retries", type=int, default=3)
+    parser.add_argument("--latency", type=float, default=0.02, help="Stand-in latency, in seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Stand-in fraction of 503 answers")
+    parser.add_argument("--recordings", default=None, help="JSONL file of recorded answers for the stand-in")
+    parser.add_argument("--live", action="store_true", help="Call the real services (BeST: see credentials.py)")
+    parser.add_argument("--pelias-domain", default="localhost:4000", help="Pelias server, with --live")
+    parser.add_argument("--nominatim-domain", default=NominatimWrapper._DEFAULT_NOMINATIM_WRAPPER_DOMAIN,
+                        help="NominatimWrapper server, with --live")
+    parser.add_argument("--output", default=None, help="JSON file for the results")
+    parser.add_argument("--compare", default=None, help="JSON results of a previous run")
+    args = parser.parse_args(argv)
+
+    server = None
+    if not args.live:
+        # The stand-in speaks plain http, also for the BeST OAuth token
+        os.environ.setdefault("OAUTHLIB_INSECURE_TRANSPORT", "1")
+        server = StandInProcess(latency=args.latency, error_rate=args.error_rate, recordings=args.recordings)
+
+    results = []
+    try:
+        for geocoder_name in args.geocoders:
+            for dataset in args.datasets:
+                queries = load_queries(args.data_dir, dataset, args.sample_size, args.limit)
+                # Not limiting: only used to count HTTP requests and retry transient errors
+                limiter = AdaptiveRateLimiter(rate=1e6, concurrency=args.workers, min_concurrency=args.workers,
+                                              max_retries=args.max_retries, backoff=0.05)
+                # Closes the sessions (and BestAddress' speculative executor)
+                with make_geocoder(geocoder_name, server.domain if server else None, limiter, args) as geocoder:
+                    res = run_one(geocoder, limiter, queries, args.workers)
+                results.append({"geocoder": geocoder_name, "dataset": dataset, **res})
+    finally:
+        if server is not None:
+            server.stop()
+
+    previous = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            previous = json.load(f)["results"]
+    print_results(results, previous)
+
+    if args.output:
+        meta = {"version": git_version(),
+                "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "python": platform.python_version(),
+                "args": vars(args)}
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"meta": meta, "results": results}, f, indent=1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,237 @@
+"""
+Local stand-in for the geocoding web services, used by the benchmarks.
+
+It answers the BeST (OAuth token, addresses, postal infos,
+municipalities), Pelias (search, structured search, reverse) and
+NominatimWrapper (geocode) endpoints with small synthetic JSON payloads,
+after an optional artificial latency, and speaks HTTP/1.1 so that clients
+can keep their connections alive.
+
+Synthetic answers are deterministic: whether a query is "not found" only
+depends on the query, with a configurable miss rate per endpoint, so that
+the BestAddress fallback cascade is exercised the same way at every run.
+Recorded answers can be served instead, from a JSONL file with one
+``{"method": ..., "path": ..., "status": ..., "body": ...}`` object per
+line (``path`` includes the query string).
+"""
+import json
+import multiprocessing
+import random
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+NOMINATIM_WRAPPER_RESPONSE = {
+    "match": [{
+        "output": {"lat": "50.8358", "lon": "4.3376",
+                   "displayName": "Avenue Fonsny 20, 1060 Saint-Gilles"},
+    }]
+}
+
+# Fraction of the queries answered by an empty result, per endpoint
+DEFAULT_MISS_RATES = {
+    "best_address":      0.2,  # streetName + postCode + houseNumber
+    "best_street":       0.3,  # streetName + postCode
+    "best_postalinfo":   0.1,
+    "best_municipality": 0.1,
+    "pelias":            0.1,
+    "nominatim":         0.1,
+}
+
+
+def _missing(server, endpoint, key):
+    rate = server.miss_rates.get(endpoint, 0)
+    return zlib.crc32(f"{endpoint}|{key}".encode("utf-8")) % 1000 < rate * 1000
+
+
+def _first(params, name, default=""):
+    return params.get(name, [default])[0]
+
+
+def best_token(server, params, body):
+    return {"access_token": "standin", "expires_in": 3600, "token_type": "Bearer"}
+
+
+def best_addresses(server, params, body):
+    street, postcode = _first(params, "streetName", "Avenue Fonsny"), _first(params, "postCode", "1060")
+    housenumber = _first(params, "houseNumber", None)
+    endpoint = "best_address" if housenumber else "best_street"
+    if _missing(server, endpoint, sorted(params.items())):
+        return {"items": []}
+    return {"items": [{
+        "id": f"https://standin/id/address/{zlib.crc32(repr(sorted(params.items())).encode())}/1",
+        "houseNumber": housenumber or "1",
+        "hasStreetName": {"name": {"fr": street}},
+        "hasMunicipality": {"name": {"fr": "Commune"}},
+        "hasPostalInfo": {"postCode": postcode},
+        "addressPosition": {"wgs84": {"lat": 50.8358, "long": 4.3376}},
+    }]}
+
+
+def best_postalinfos(server, params, body):
+    if _missing(server, "best_postalinfo", sorted(params.items())):
+        return {"items": []}
+    return {"items": [{"postCode": _first(params, "postCode", "1060"),
+                       "name": {"fr": _first(params, "name", "Saint-Gilles")}}]}
+
+
+def best_municipalities(server, params, body):
+    if _missing(server, "best_municipality", sorted(params.items())):
+        return {"items": []}
+    return {"items": [{"name": {"fr": _first(params, "name", "Saint-Gilles")}}]}
+
+
+def pelias_search(server, params, body):
+    if _missing(server, "pelias", sorted(params.items())):
+        return {"features": []}
+    return {"features": [{"geometry": {"coordinates": [4.3376, 50.8358]},
+                          "properties": {"name": "Avenue Fonsny 20", "gid": "standin:address:1",
+                                         "layer": "address"}}]}
+
+
+def nominatim_geocode(server, params, body):
+    if _missing(server, "nominatim", body):
+        return None  # 204
+    return NOMINATIM_WRAPPER_RESPONSE
+
+
+# Path suffix -> synthetic answer
+ROUTES = [
+    ("/oauth2/token",                    best_token),
+    ("/belgianAddress/v2/addresses",     best_addresses),
+    ("/belgianAddress/v2/postalInfos",   best_postalinfos),
+    ("/belgianAddress/v2/municipalities", best_municipalities),
+    ("/v1/search",                       pelias_search),
+    ("/v1/search/structured",            pelias_search),
+    ("/v1/reverse",                      pelias_search),
+    ("/nominatimWrapper/v1/geocode",     nominatim_geocode),
+]
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def _respond(self, payload, status=200):
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        if payload is None:
+            self.send_response(204)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _route(self, method, body):
+        self.server.count_request()
+
+        recorded = self.server.recordings.get((method, self.path))
+        if recorded is not None:
+            return self._respond(recorded.get("body"), recorded.get("status", 200))
+
+        if self.server.error_rate and random.random() < self.server.error_rate:
+            return self._respond({"error": "Service unavailable (stand-in)"}, 503)
+
+        url = urlparse(self.path)
+        for suffix, answer in ROUTES:
+            if url.path.endswith(suffix):
+                return self._respond(answer(self.server, parse_qs(url.query), body))
+        return self._respond(NOMINATIM_WRAPPER_RESPONSE)
+
+    def do_GET(self):
+        self._route("GET", b"")
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        self._route("POST", self.rfile.read(length))
+
+
+def load_recordings(path):
+    """
+    Read recorded answers from a JSONL file (see the module docstring).
+    """
+    recordings = {}
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                rec = json.loads(line)
+                recordings[(rec.get("method", "GET"), rec["path"])] = rec
+    return recordings
+
+
+class StandInServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address=("127.0.0.1", 0), latency=0.0, error_rate=0.0, miss_rates=None,
+                 recordings=None):
+        """
+        :param float latency: Artificial latency of every answer, in seconds.
+
+        :param float error_rate: Fraction of the requests answered by a 503.
+
+        :param dict miss_rates: Fraction of empty answers per endpoint (see
+            DEFAULT_MISS_RATES).
+
+        :param recordings: Path of a JSONL file of recorded answers, or a
+            dict as returned by :func:`load_recordings`.
+        """
+        super().__init__(address, StandInHandler)
+        self.latency = latency
+        self.error_rate = error_rate
+        self.miss_rates = dict(DEFAULT_MISS_RATES, **(miss_rates or {}))
+        if isinstance(recordings, str):
+            recordings = load_recordings(recordings)
+        self.recordings = recordings or {}
+        self.requests = 0
+        self._lock = threading.Lock()
+
+    def count_request(self):
+        with self._lock:
+            self.requests += 1
+
+    @property
+    def domain(self):
+        return "%s:%s" % self.server_address[:2]
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+def _serve(conn, kwargs):
+    server = StandInServer(**kwargs)
+    conn.send(server.domain)
+    server.serve_forever()
+
+
+class StandInProcess:
+    """
+    A :class:`StandInServer` running in a child process, so that its CPU
+    time is not counted in the measures of the client.
+    """
+
+    def __init__(self, **kwargs):
+        parent_conn, child_conn = multiprocessing.Pipe()
+        self.process = multiprocessing.Process(target=_serve, args=(child_conn, kwargs), daemon=True)
+        self.process.start()
+        self.domain = parent_conn.recv()
+
+    def stop(self):
+        self.process.terminate()
+        self.process.join()
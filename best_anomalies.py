@@ -0,0 +1,306 @@
+"""
+Helpers of the BestAddressAnomalies notebook: vectorized versions of the
+steps building the addresses (one row per distinct address and point) and
+the per-street metrics.
+"""
+import numpy as np
+import pandas as pd
+
+__all__ = ("aggregate_addresses", "coordinate_keys", "compute_street_metrics", "consolidate_metrics")
+
+ADDRESS_COLUMNS = ["streetname", "house_number", "house_number_num", "postcode", "postname", "municipality",
+                   "municipality_id"]
+
+
+def _fill_na(values, fill_value="[na]"):
+    if pd.api.types.is_numeric_dtype(values.dtype):
+        return values
+    if isinstance(values.dtype, pd.CategoricalDtype) and fill_value not in values.cat.categories:
+        values = values.cat.add_categories([fill_value])
+    return values.fillna(fill_value)
+
+
+def coordinate_keys(geometry, resolution=None):
+    """
+    Integer keys of the x and y coordinates of points, equal for equal
+    points.
+
+    Parameters
+    ----------
+    geometry: geopandas.GeoSeries
+       points
+    resolution: float
+       if None, keys are the bit patterns of the coordinates (points are
+       equal if their coordinates are exactly equal, as their WKB). Otherwise,
+       coordinates are rounded to a multiple of `resolution` (in CRS units)
+
+    Returns
+    -------
+    tuple of two numpy.ndarray of int64
+    """
+    keys = []
+    for coord in (geometry.x.values, geometry.y.values):
+        coord = np.asarray(coord, dtype=np.float64)
+        if resolution is None:
+            keys.append((coord + 0.0).view(np.int64))  # + 0.0: -0.0 becomes 0.0
+        else:
+            keys.append(np.round(coord / resolution).astype(np.int64))
+    return tuple(keys)
+
+
+def aggregate_addresses(addresses, columns=None, list_column="address_id", resolution=None):
+    """
+    One row per distinct address (`columns`) and point, with the list of the
+    `list_column` values (address ids) of its rows: the boxes of a building
+    become one row.
+
+    Equivalent to grouping on `columns` and on the WKB of the geometry (with
+    missing values replaced by "[na]"), but vectorized: the columns are
+    factorized into integer codes, the points into integer coordinate keys
+    (see coordinate_keys), and the rows are sorted once on those keys and
+    split where they change.
+
+    Parameters
+    ----------
+    addresses: geopandas.GeoDataFrame
+       with point geometries
+    columns: list of str
+       address columns (default: streetname, house_number, house_number_num,
+       postcode, postname, municipality, municipality_id)
+    list_column: str
+       column aggregated into lists
+    resolution: float
+       see coordinate_keys
+
+    Returns
+    -------
+    geopandas.GeoDataFrame
+       columns, list_column (lists, in the order of the input rows) and
+       geometry, sorted by columns
+    """
+    import geopandas as gpd
+
+    if columns is None:
+        columns = ADDRESS_COLUMNS
+    n = len(addresses)
+
+    codes, uniques = [], []
+    for col in columns:
+        col_codes, col_uniques = pd.factorize(_fill_na(addresses[col]), sort=True, use_na_sentinel=False)
+        codes.append(col_codes)
+        uniques.append(col_uniques)
+    keys = codes + list(coordinate_keys(addresses.geometry, resolution))
+
+    # np.lexsort sorts on the last key first, and is stable
+    order = np.lexsort(keys[::-1])
+    is_start = np.zeros(n, dtype=bool)
+    is_start[:1] = True
+    for key in keys:
+        key = key[order]
+        is_start[1:] |= key[1:] != key[:-1]
+    starts = np.flatnonzero(is_start)
+    first = order[starts]
+
+    values = addresses[list_column].values[order]
+    lists = [group.tolist() for group in np.split(values, starts[1:])] if n else []
+
+    res = {col: col_uniques.take(col_codes[first]) for col, col_codes, col_uniques in zip(columns, codes, uniques)}
+    res[list_column] = lists
+    return gpd.GeoDataFrame(pd.DataFrame(res), geometry=addresses.geometry.values[first], crs=addresses.crs)
+
+
+def _ratio(length, straight):
+    # Sinuosity of a line: its length divided by the distance between its
+    # ends (0 for a line of length 0, inf for a closed line)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ratio = length / straight
+    return np.where(straight == 0, np.where(length == 0, 0.0, np.inf), ratio)
+
+
+def _segment_argmax(values, starts, sizes):
+    # Index of the first maximum of each segment, ignoring NaN (-1 if the
+    # segment only contains NaN)
+    filled = np.where(np.isnan(values), -np.inf, values)
+    group_max = np.maximum.reduceat(filled, starts)
+    group = np.repeat(np.arange(len(starts)), sizes)
+    positions = np.where(filled == group_max[group], np.arange(len(values)), len(values))
+    first = np.minimum.reduceat(positions, starts)
+    return np.where(np.isneginf(group_max), -1, first)
+
+
+def _segment_median(values, group, starts):
+    # Median of each segment, ignoring NaN (NaN if the segment only contains NaN)
+    order = np.lexsort((values, group))  # NaN last in each segment
+    sorted_values = values[order]
+    counts = np.add.reduceat(~np.isnan(values), starts)
+    low = starts + np.maximum(counts - 1, 0) // 2
+    high = starts + counts // 2
+    return np.where(counts > 0, (sorted_values[low] + sorted_values[high]) / 2, np.nan)
+
+
+def compute_street_metrics(region, window=5, points=False):
+    """
+    Metrics of the sides of the streets (addresses with the same streetname,
+    postcode and house number parity): sinuosity, sw_sinuosity, length,
+    dist_to_prev, delta_dist_to_prev and prev_to_prev2_ratio.
+
+    Same tables as the "Metrics" section of BestAddressAnomalies (with
+    bloc_sinuosity, sliding_sinuosity, bloc_length, and the distances to the
+    previous addresses), computed in one pass: the points are sorted once by
+    street, postcode, parity and house_number_num (ties keep the order of
+    `region`), and the metrics are computed on segment offsets with NumPy,
+    without building LineStrings.
+
+    Parameters
+    ----------
+    region: geopandas.GeoDataFrame
+       addresses (see aggregate_addresses), with an integer house_number_num
+    window: int
+       number of points of the sliding windows of sw_sinuosity
+    points: bool
+       if True, also return the addresses in street order, with their parity,
+       dist_to_prev, dist_to_prev2 and prev_to_prev2_ratio
+
+    Returns
+    -------
+    dict of pandas.DataFrame
+       one table per metric, sorted by decreasing metric: streetname,
+       postcode, parity, the metric, and for the metrics of one address its
+       house_number (and house_number_num for dist_to_prev)
+    """
+    parity = np.asarray(region.house_number_num) % 2
+    house_number_num = np.asarray(region.house_number_num)
+    street_codes, streets = pd.factorize(region.streetname, sort=True)
+    postcode_codes, postcodes = pd.factorize(region.postcode, sort=True)
+
+    order = np.lexsort((house_number_num, parity, postcode_codes, street_codes))
+    n = len(order)
+    x = np.asarray(region.geometry.x.values, dtype=np.float64)[order]
+    y = np.asarray(region.geometry.y.values, dtype=np.float64)[order]
+
+    # Street sides: offsets in the sorted points
+    is_start = np.zeros(n, dtype=bool)
+    is_start[:1] = True
+    for key in (street_codes, postcode_codes, parity):
+        key = key[order]
+        is_start[1:] |= key[1:] != key[:-1]
+    starts = np.flatnonzero(is_start)
+    sizes = np.diff(np.append(starts, n))
+    group = np.cumsum(is_start) - 1
+    ends = starts + sizes - 1
+    position = np.arange(n) - starts[group]  # Position of the point in its street side
+
+    # Distances to the previous points (of the same street side)
+    dist_to_prev = np.full(n, np.nan)
+    dist_to_prev[1:] = np.hypot(x[1:] - x[:-1], y[1:] - y[:-1])
+    dist_to_prev[position < 1] = np.nan
+    dist_to_prev2 = np.full(n, np.nan)
+    dist_to_prev2[2:] = np.hypot(x[2:] - x[:-2], y[2:] - y[:-2])
+    dist_to_prev2[position < 2] = np.nan
+    prev_to_prev2_ratio = dist_to_prev / np.maximum(dist_to_prev2, 10)  # NaN if dist_to_prev2 is NaN
+
+    # Cumulative length along each street side
+    cum_length = np.cumsum(np.nan_to_num(dist_to_prev))
+    length = cum_length[ends] - cum_length[starts]
+
+    # Number of distinct points of each street side
+    kx, ky = coordinate_keys(region.geometry, None)
+    kx, ky = kx[order], ky[order]
+    by_point = np.lexsort((ky, kx, group))
+    is_new_point = np.ones(n, dtype=bool)
+    is_new_point[1:] = ((group[by_point][1:] != group[by_point][:-1]) | (kx[by_point][1:] != kx[by_point][:-1])
+                        | (ky[by_point][1:] != ky[by_point][:-1]))
+    n_points = np.bincount(group[by_point], weights=is_new_point, minlength=len(starts))
+    # Lines of less than 3 distinct points have no sinuosity/length
+    has_line = n_points >= 3
+
+    sinuosity = _ratio(length, np.hypot(x[ends] - x[starts], y[ends] - y[starts]))
+
+    # Sliding windows of `window` points, starting at the first n-window
+    # points of the street side (one window of all the points if there are
+    # at most `window` points), as sliding_sinuosity
+    n_windows = np.where(sizes <= window, 1, sizes - window)
+    window_group = np.repeat(np.arange(len(starts)), n_windows)
+    window_start = starts[window_group] + np.arange(n_windows.sum()) - np.repeat(np.cumsum(n_windows) - n_windows,
+                                                                                 n_windows)
+    window_end = window_start + np.minimum(sizes, window)[window_group] - 1
+    window_sinuosity = _ratio(cum_length[window_end] - cum_length[window_start],
+                              np.hypot(x[window_end] - x[window_start], y[window_end] - y[window_start]))
+    sw_sinuosity = np.bincount(window_group, weights=window_sinuosity, minlength=len(starts)) / n_windows
+
+    first = order[starts]
+    sides = pd.DataFrame({"streetname": streets.take(street_codes[first]),
+                          "postcode": postcodes.take(postcode_codes[first]),
+                          "parity": parity[first]})
+    house_numbers = np.asarray(region.house_number)[order]
+
+    def ranked(name, values):
+        # Sorted by decreasing `name`, NaN last
+        return values.sort_values(name, ascending=False, kind="stable").reset_index(drop=True)
+
+    metrics = {}
+    sin = np.where(has_line, sinuosity, np.nan)
+    metrics["sinuosity"] = ranked("sinuosity", sides.assign(sinuosity=sin)[(sin < 10**10)]
+                                  [["streetname", "postcode", "sinuosity", "parity"]])
+    sw_sin = np.where(has_line, sw_sinuosity, np.nan)
+    metrics["sw_sinuosity"] = ranked("sw_sinuosity", sides.assign(sw_sinuosity=sw_sin)[(sw_sin < 10**10)]
+                                     [["streetname", "postcode", "sw_sinuosity", "parity"]])
+    metrics["length"] = ranked("length", sides.assign(length=np.where(has_line, length, np.nan))
+                               [["streetname", "postcode", "length", "parity"]])
+
+    # Address with the largest distance to the previous one
+    idx = _segment_argmax(dist_to_prev, starts, sizes)
+    found = idx >= 0
+    max_dist = np.where(found, dist_to_prev[idx], np.nan)
+    metrics["dist_to_prev"] = ranked("dist_to_prev", sides.assign(
+        dist_to_prev=max_dist, house_number=house_numbers[idx], house_number_num=house_number_num[order][idx])[found]
+        [["streetname", "postcode", "parity", "dist_to_prev", "house_number", "house_number_num"]])
+
+    # ... compared to the median distance (0 if at most 5 m)
+    median = _segment_median(dist_to_prev, group, starts)
+    median = np.where(median > 5, median, 0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        delta = max_dist / median
+    metrics["delta_dist_to_prev"] = ranked("delta_dist_to_prev", sides.assign(
+        delta_dist_to_prev=delta, house_number=house_numbers[idx])[found & ~np.isnan(delta) & (delta < np.inf)]
+        [["streetname", "postcode", "parity", "house_number", "delta_dist_to_prev"]])
+
+    idx = _segment_argmax(prev_to_prev2_ratio, starts, sizes)
+    found = idx >= 0
+    metrics["prev_to_prev2_ratio"] = ranked("prev_to_prev2_ratio", sides.assign(
+        prev_to_prev2_ratio=np.where(found, prev_to_prev2_ratio[idx], np.nan), house_number=house_numbers[idx])[found]
+        [["streetname", "postcode", "parity", "prev_to_prev2_ratio", "house_number"]])
+
+    # Order of the notebook tables
+    metrics = {name: metrics[name] for name in ["dist_to_prev", "delta_dist_to_prev", "sinuosity", "sw_sinuosity",
+                                                "length", "prev_to_prev2_ratio"]}
+    if not points:
+        return metrics
+    street_points = region.iloc[order].assign(parity=parity[order], dist_to_prev=dist_to_prev,
+                                              dist_to_prev2=dist_to_prev2, prev_to_prev2_ratio=prev_to_prev2_ratio)
+    return metrics, street_points
+
+
+def consolidate_metrics(metrics, keys=("streetname", "postcode", "parity")):
+    """
+    One row per street side with all the metrics: outer join of the metric
+    tables (with at most one row per street side) on `keys`, aligned on
+    their index rather than merged one after the other.
+
+    Parameters
+    ----------
+    metrics: dict of pandas.DataFrame
+       metric tables (see compute_street_metrics), with their own column
+       names besides `keys` (house_number renamed <metric>_house_number, as
+       in the notebook)
+    keys: tuple of str
+
+    Returns
+    -------
+    pandas.DataFrame
+       sorted by keys
+    """
+    keys = list(keys)
+    tables = [table.set_index(keys) for table in metrics.values()]
+    glob_metrics = pd.concat(tables, axis=1, join="outer")
+    return glob_metrics.sort_index().reset_index()
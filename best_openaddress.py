@@ -0,0 +1,303 @@
+"""
+Typed, partitioned Parquet copy of the BeST openaddress files
+(openaddress-be{bru,vlg,wal}.zip), used by the Geocoder_Dataprep and
+BestAddressAnomalies notebooks instead of re-parsing the CSV files.
+
+The dataset is converted once (convert_openaddress), then loaded by column
+and partition (load_openaddress), or read by chunks (iter_openaddress).
+Requires pyarrow.
+"""
+import glob
+import os
+
+import numpy as np
+import pandas as pd
+
+from geocoder_dataprep import _coalesce, best_region_columns, read_csv_chunks
+
+__all__ = ("convert_openaddress", "load_openaddress", "iter_openaddress", "openaddress_municipality_ids",
+           "openaddress_points")
+
+# Columns of the openaddress CSV files, and their name in the dataset
+_SOURCE_COLUMNS = {
+    "address_id": "address_id", "status": "status", "region_code": "region_code",
+    "municipality_id": "municipality_id", "street_id": "street_id",
+    "municipality_name_fr": "municipality_name_fr", "municipality_name_nl": "municipality_name_nl",
+    "municipality_name_de": "municipality_name_de",
+    "streetname_fr": "streetname_fr", "streetname_nl": "streetname_nl", "streetname_de": "streetname_de",
+    "postname_fr": "postname_fr", "postname_nl": "postname_nl", "postcode": "postcode",
+    "house_number": "house_number", "box_number": "box_number",
+    "EPSG:31370_x": "x", "EPSG:31370_y": "y", "EPSG:4326_lat": "lat", "EPSG:4326_lon": "lon",
+}
+
+# Columns added by the conversion: names in French, then Dutch and German
+# (streetname, municipality, postname), names in the language of the region
+# (street, city, see geocoder_dataprep.best_region_columns), and the leading
+# digits of the house number
+_DERIVED_COLUMNS = ["streetname", "municipality", "postname", "street", "city", "house_number_num"]
+
+_FLOAT_COLUMNS = ["x", "y", "lat", "lon"]
+
+# Partition columns, in directory order
+_PARTITIONS = ["region", "municipality_id"]
+
+# Unique (or nearly unique) string columns, not read as dictionaries
+_PLAIN_COLUMNS = ["address_id"]
+
+
+def _schema():
+    import pyarrow as pa
+
+    fields = []
+    for col in list(_SOURCE_COLUMNS.values()) + _DERIVED_COLUMNS + ["region"]:
+        if col in _FLOAT_COLUMNS:
+            fields.append((col, pa.float64()))
+        elif col == "house_number_num":
+            fields.append((col, pa.int32()))
+        else:
+            fields.append((col, pa.string()))
+    return pa.schema(fields)
+
+
+def _partitioning():
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+
+    return ds.partitioning(pa.schema([(col, pa.string()) for col in _PARTITIONS]), flavor="hive")
+
+
+def _typed_columns(df):
+    """
+    Typed and derived columns of a chunk of an openaddress file (read with
+    dtype=str).
+    """
+    df = df[list(_SOURCE_COLUMNS)].rename(columns=_SOURCE_COLUMNS)
+    df = best_region_columns(df)
+
+    house_number_num = df.house_number.str.extract("^([0-9]+)", expand=False)
+    df = df.assign(streetname=_coalesce(df, ["streetname_fr", "streetname_nl", "streetname_de"]),
+                   municipality=_coalesce(df, ["municipality_name_fr", "municipality_name_nl",
+                                               "municipality_name_de"]),
+                   postname=_coalesce(df, ["postname_fr", "postname_nl"]).fillna("[na]"),
+                   house_number_num=pd.to_numeric(house_number_num).astype("Int32"),
+                   region=df.region_code.str[3:].str.lower())
+    for col in _FLOAT_COLUMNS:
+        df[col] = pd.to_numeric(df[col])
+    return df
+
+
+def convert_openaddress(sources, dataset_dir, chunksize=500000, compression="zstd"):
+    """
+    Convert openaddress files into a Parquet dataset partitioned by region
+    ("bru", "vlg", "wal") and municipality_id (hive layout:
+    region=vlg/municipality_id=11001/...).
+
+    The files are read by chunks. Names are stored as strings (dictionary
+    encoded by Parquet, and read back as categories by load_openaddress),
+    coordinates as floats (x/y in EPSG:31370, lat/lon in EPSG:4326; 0 for
+    the addresses without coordinates), house_number_num (leading digits of
+    house_number, null if there are none) as an integer. The partitions of
+    a converted region are replaced.
+
+    Parameters
+    ----------
+    sources: str or list of str
+       openaddress files (zipped CSV)
+    dataset_dir: str
+       root directory of the dataset
+    chunksize: int
+       number of rows read at once
+    compression: str
+       Parquet compression
+
+    Returns
+    -------
+    int
+       number of rows written
+    """
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+
+    if isinstance(sources, str):
+        sources = [sources]
+    schema = _schema()
+    rows = 0
+    for source in sources:
+        def batches():
+            nonlocal rows
+            for chunk in read_csv_chunks(source, chunksize=chunksize, dtype=str, usecols=list(_SOURCE_COLUMNS)):
+                table = pa.Table.from_pandas(_typed_columns(chunk), schema=schema, preserve_index=False)
+                rows += table.num_rows
+                yield from table.to_batches()
+
+        name = os.path.splitext(os.path.basename(source))[0]
+        ds.write_dataset(batches(), dataset_dir, schema=schema, format="parquet",
+                         partitioning=_partitioning(),
+                         basename_template=f"{name}-{{i}}.parquet",
+                         existing_data_behavior="delete_matching",
+                         file_options=ds.ParquetFileFormat().make_write_options(compression=compression))
+    return rows
+
+
+def openaddress_municipality_ids(dataset_dir, regions=None, prefix=None):
+    """
+    Municipality ids (NIS codes) of the partitions of a dataset written by
+    convert_openaddress, from the directory names.
+
+    Parameters
+    ----------
+    dataset_dir: str
+    regions: list of str
+       e.g. ["bru", "wal"] (default: all)
+    prefix: str
+       only the ids starting with `prefix` (e.g. "25" for Walloon Brabant)
+
+    Returns
+    -------
+    list of str
+    """
+    ids = set()
+    for path in glob.glob(os.path.join(dataset_dir, "region=*", "municipality_id=*")):
+        region = os.path.basename(os.path.dirname(path)).split("=", 1)[1]
+        nis = os.path.basename(path).split("=", 1)[1]
+        if (regions is None or region in regions) and (prefix is None or nis.startswith(prefix)):
+            ids.add(nis)
+    return sorted(ids)
+
+
+def _open_dataset(dataset_dir, regions, municipality_ids, municipality_id_prefix, status, categorical):
+    # Dataset and filter expression shared by load_openaddress and iter_openaddress
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+
+    if isinstance(regions, str):
+        regions = [regions]
+    if municipality_id_prefix is not None:
+        prefixed = openaddress_municipality_ids(dataset_dir, regions, municipality_id_prefix)
+        municipality_ids = prefixed if municipality_ids is None else [m for m in municipality_ids if m in prefixed]
+
+    dictionary_columns = []
+    if categorical:
+        dictionary_columns = [f.name for f in _schema()
+                              if pa.types.is_string(f.type) and f.name not in _PLAIN_COLUMNS + _PARTITIONS]
+    fmt = ds.ParquetFileFormat(read_options=ds.ParquetReadOptions(dictionary_columns=dictionary_columns))
+    dataset = ds.dataset(dataset_dir, format=fmt, partitioning=_partitioning())
+
+    filters = []
+    if regions is not None:
+        filters.append(ds.field("region").isin(regions))
+    if municipality_ids is not None:
+        filters.append(ds.field("municipality_id").isin(list(municipality_ids)))
+    if status is not None:
+        filters.append(ds.field("status") == status)
+    expression = None
+    for f in filters:
+        expression = f if expression is None else expression & f
+    return dataset, expression
+
+
+def _to_pandas(data, categorical):
+    # data: pyarrow Table or RecordBatch
+    import pyarrow as pa
+
+    # Nullable integers: house_number_num is missing for house numbers without digits
+    df = data.to_pandas(types_mapper={pa.int32(): pd.Int32Dtype()}.get)
+    if categorical:
+        for col in set(_PARTITIONS) & set(df.columns):
+            df[col] = df[col].astype("category")
+    return df
+
+
+def load_openaddress(dataset_dir, columns=None, regions=None, municipality_ids=None, municipality_id_prefix=None,
+                     status=None, categorical=True):
+    """
+    Load (some columns and partitions of) a dataset written by
+    convert_openaddress. Only the selected partitions are read.
+
+    Parameters
+    ----------
+    dataset_dir: str
+    columns: list of str
+       columns to load (default: all). Besides the openaddress columns
+       (coordinates renamed x, y, lat, lon): streetname, municipality,
+       postname (French, then Dutch and German), street, city (language of
+       the region), house_number_num, region
+    regions: str or list of str
+       "bru", "vlg" and/or "wal" (default: all)
+    municipality_ids: list of str
+    municipality_id_prefix: str
+       only the municipalities whose id starts with this prefix
+    status: str
+       only the addresses with this status (e.g. "current")
+    categorical: bool
+       if True, string columns (except address_id) are loaded as pandas
+       categories, otherwise as strings
+
+    Returns
+    -------
+    pandas.DataFrame
+    """
+    dataset, expression = _open_dataset(dataset_dir, regions, municipality_ids, municipality_id_prefix, status,
+                                        categorical)
+    if columns is None:
+        columns = _schema().names
+    return _to_pandas(dataset.to_table(columns=list(columns), filter=expression), categorical)
+
+
+def iter_openaddress(dataset_dir, columns=None, regions=None, municipality_ids=None, municipality_id_prefix=None,
+                     status=None, categorical=False, batch_size=500000):
+    """
+    Iterate over (some columns and partitions of) a dataset written by
+    convert_openaddress, by chunks of at most `batch_size` rows, e.g. for
+    geocoder_dataprep.stream_sample: the whole selection is never loaded in
+    memory.
+
+    Parameters
+    ----------
+    dataset_dir: str
+    columns, regions, municipality_ids, municipality_id_prefix, status:
+       see load_openaddress
+    categorical: bool
+       if True, string columns (except address_id) are loaded as pandas
+       categories (their categories differ from one chunk to the other),
+       otherwise as strings
+    batch_size: int
+       maximum number of rows per chunk
+
+    Yields
+    ------
+    pandas.DataFrame
+    """
+    dataset, expression = _open_dataset(dataset_dir, regions, municipality_ids, municipality_id_prefix, status,
+                                        categorical)
+    if columns is None:
+        columns = _schema().names
+    for batch in dataset.to_batches(columns=list(columns), filter=expression, batch_size=batch_size):
+        if batch.num_rows:
+            yield _to_pandas(batch, categorical)
+
+
+def openaddress_points(df, crs=None):
+    """
+    GeoDataFrame of addresses loaded by load_openaddress, with their points
+    (from x/y, EPSG:31370), possibly converted to `crs`. Requires geopandas.
+
+    Parameters
+    ----------
+    df: pandas.DataFrame
+       with columns x and y
+    crs: str
+       target CRS (default: EPSG:31370)
+
+    Returns
+    -------
+    geopandas.GeoDataFrame
+       without the columns x and y
+    """
+    import geopandas as gpd
+
+    gdf = gpd.GeoDataFrame(df.drop(columns=["x", "y"]),
+                           geometry=gpd.points_from_xy(np.asarray(df.x), np.asarray(df.y)), crs="epsg:31370")
+    if crs is not None:
+        gdf = gdf.to_crs(crs)
+    return gdf
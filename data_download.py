@@ -0,0 +1,244 @@
+"""
+Download of the open data files used by the notebooks (BeST openaddress,
+KBO, statistical sectors, bPost shapefiles...).
+
+Files are streamed to "<filename>.part", resumed with an HTTP Range request
+after an interruption, checked (size announced by the server, and
+optionally expected size and SHA-256), then renamed to <filename>. The
+ETag/Last-Modified of the downloaded file are kept in
+"<filename>.meta.json", so that an unchanged upstream file is not
+downloaded again when checking for updates.
+"""
+import hashlib
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from geopy.util import logger
+
+__all__ = ("download_if_nexist", "download_many")
+
+
+class _Incomplete(OSError):
+    # The transfer stopped before the end of the file: resumed by the next attempt
+    pass
+
+
+def _meta_path(path):
+    return f"{path}.meta.json"
+
+
+def _read_meta(path):
+    try:
+        with open(_meta_path(path), encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def _write_meta(path, meta):
+    tmp_path = f"{_meta_path(path)}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(meta, f)
+    os.replace(tmp_path, _meta_path(path))
+
+
+def _remove(*paths):
+    for path in paths:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def _total_size(resp):
+    # Size of the whole file, from Content-Range (206) or Content-Length (200)
+    if resp.status_code == 206:
+        total = resp.headers.get("Content-Range", "").rpartition("/")[2]
+    else:
+        total = resp.headers.get("Content-Length", "")
+    return int(total) if total.isdigit() else None
+
+
+def _file_sha256(path, chunk_size):
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for data in iter(lambda: f.read(chunk_size), b""):
+            sha.update(data)
+    return sha
+
+
+def _download_once(url, filename, size, sha256, conditional, chunk_size, timeout, session):
+    part = f"{filename}.part"
+    # No transparent decompression: Range offsets and sizes are those of the file
+    headers = {"Accept-Encoding": "identity"}
+
+    offset = os.path.getsize(part) if os.path.isfile(part) else 0
+    part_meta = _read_meta(part)
+    # Resume only if the server can tell whether the file changed meanwhile
+    # (If-Range: the whole file is sent if it did). Weak ETags are not allowed
+    validator = part_meta.get("etag") or part_meta.get("last_modified")
+    if offset and validator and not validator.startswith("W/"):
+        headers["Range"] = f"bytes={offset}-"
+        headers["If-Range"] = validator
+
+    if conditional:
+        meta = _read_meta(filename)
+        if meta.get("etag"):
+            headers["If-None-Match"] = meta["etag"]
+        elif meta.get("last_modified"):
+            headers["If-Modified-Since"] = meta["last_modified"]
+
+    with session.get(url, headers=headers, stream=True, timeout=timeout) as resp:
+        if resp.status_code == 304:
+            logger.info("download_if_nexist: %s is up to date", filename)
+            _remove(part, _meta_path(part))
+            return False
+        if resp.status_code == 416:
+            # Range not satisfiable (file shorter than the part): start again
+            _remove(part, _meta_path(part))
+            raise _Incomplete(f"{url}: invalid partial download, restarting")
+        resp.raise_for_status()
+
+        if resp.status_code == 206 and resp.headers.get("Content-Range", "").startswith(f"bytes {offset}-"):
+            logger.info("download_if_nexist: resuming %s at byte %d", filename, offset)
+            sha = _file_sha256(part, chunk_size)
+            mode = "ab"
+        else:
+            if resp.status_code == 206:
+                raise _Incomplete(f"{url}: unexpected range {resp.headers.get('Content-Range')}")
+            offset, sha, mode = 0, hashlib.sha256(), "wb"
+            _write_meta(part, {"url": url, "etag": resp.headers.get("ETag"),
+                               "last_modified": resp.headers.get("Last-Modified")})
+        total = _total_size(resp)
+
+        with open(part, mode) as f:
+            for data in resp.iter_content(chunk_size):
+                f.write(data)
+                sha.update(data)
+
+    received = os.path.getsize(part)
+    if total is not None and received < total:
+        raise _Incomplete(f"{url}: {received} bytes received out of {total}")
+
+    error = None
+    if total is not None and received > total:
+        error = f"{received} bytes received, {total} announced"
+    elif size is not None and received != size:
+        error = f"{received} bytes received, {size} expected"
+    elif sha256 is not None and sha.hexdigest() != sha256.lower():
+        error = f"SHA-256 {sha.hexdigest()}, {sha256} expected"
+    if error is not None:
+        _remove(part, _meta_path(part))
+        raise OSError(f"Download of {url} failed: {error}")
+
+    meta = dict(_read_meta(part), size=received, sha256=sha.hexdigest())
+    os.replace(part, filename)
+    _write_meta(filename, meta)
+    _remove(_meta_path(part))
+    logger.info("download_if_nexist: %s downloaded (%d bytes)", filename, received)
+    return True
+
+
+def download_if_nexist(url, filename, size=None, sha256=None, check_updates=False, retries=3,
+                       chunk_size=1 << 16, timeout=60, session=None):
+    """
+    If the (local) file <filename> does not exist, download it from <url>.
+
+    The file is streamed to <filename>.part (never loaded in memory), and
+    only renamed to <filename> once complete and checked: a partial file is
+    never mistaken for a complete one. After an interruption (in this call,
+    up to `retries` times, or in a previous run), the download is resumed
+    where it stopped.
+
+    Parameters
+    ----------
+    url: str
+       url to fetch
+    filename: str
+       local file to save
+    size: int
+       expected size in bytes (optional)
+    sha256: str
+       expected SHA-256 (hexadecimal, optional)
+    check_updates: bool
+       if <filename> exists, download it again only if the upstream file
+       changed (according to the ETag or Last-Modified of the previous
+       download; always downloaded again without them)
+    retries: int
+       number of resumptions after a network error
+    chunk_size: int
+       bytes written at once
+    timeout: float
+       connect/read timeout in seconds
+    session: requests.Session
+       (default: module-level requests functions)
+
+    Returns
+    -------
+    bool
+       True if the file was downloaded, False if it was already there (or
+       unchanged)
+
+    Raises
+    ------
+    OSError
+       if the downloaded file does not have the expected size or checksum
+       (the partial file is removed)
+    """
+    if os.path.isfile(filename) and not check_updates:
+        return False
+    if session is None:
+        session = requests
+
+    for attempt in range(retries + 1):
+        try:
+            return _download_once(url, filename, size, sha256, os.path.isfile(filename), chunk_size, timeout,
+                                  session)
+        except (_Incomplete, requests.ConnectionError, requests.Timeout,
+                requests.exceptions.ChunkedEncodingError) as e:
+            if attempt == retries:
+                raise
+            logger.warning("download_if_nexist: download of %s interrupted (%s), retrying", url, e)
+
+
+def download_many(downloads, max_workers=4, return_exceptions=False, **kwargs):
+    """
+    Download several files in parallel (see download_if_nexist).
+
+    Parameters
+    ----------
+    downloads: dict
+       url by local file name, or dict of download_if_nexist arguments
+       (url, size, sha256...) by local file name
+    max_workers: int
+       number of concurrent downloads
+    return_exceptions: bool
+       if True, a failed download gives its exception instead of raising it
+       (after the other downloads finished)
+    kwargs:
+       passed to download_if_nexist (check_updates, timeout...)
+
+    Returns
+    -------
+    dict
+       result of download_if_nexist (or exception) by file name
+    """
+    def download(filename, spec):
+        if isinstance(spec, str):
+            spec = {"url": spec}
+        try:
+            return download_if_nexist(filename=filename, **{**kwargs, **spec})
+        except Exception as e:
+            return e
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {filename: executor.submit(download, filename, spec) for filename, spec in downloads.items()}
+        results = {filename: future.result() for filename, future in futures.items()}
+
+    if not return_exceptions:
+        for res in results.values():
+            if isinstance(res, Exception):
+                raise res
+    return results
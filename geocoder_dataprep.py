@@ -0,0 +1,436 @@
+"""
+Helpers of the Geocoder_Dataprep notebook: extraction of the address samples
+(BeST, KBO...) used to compare the geocoders.
+"""
+import hashlib
+import json
+import math
+import os
+import random
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from itertools import islice
+from zipfile import ZipFile
+
+import numpy as np
+import pandas as pd
+from geopy.util import logger
+
+from geopy_results import json_loads
+
+__all__ = ("read_csv_chunks", "stream_sample", "best_region_columns", "kbo_address_columns",
+           "zip_lines", "reservoir_sample", "decode_json_lines", "json_lines_to_parquet",
+           "parquet_reservoir_sample", "canonical_key", "harvest_distinct")
+
+
+def read_csv_chunks(sources, chunksize=500000, zip_member=None, **kwargs):
+    """
+    Read one or several CSV files (possibly zipped) chunk by chunk.
+
+    Parameters
+    ----------
+    sources: str or list of str
+       CSV files, or zip files containing one CSV file
+    chunksize: int
+       number of rows per chunk
+    zip_member: str
+       name of the CSV file to read in each zip file, if they contain several
+       files (e.g. "address.csv" in the KBO open data)
+    kwargs:
+       passed to pandas.read_csv (usecols, dtype...)
+
+    Yields
+    ------
+    pandas.DataFrame
+    """
+    if isinstance(sources, str):
+        sources = [sources]
+    for source in sources:
+        if zip_member is not None:
+            with ZipFile(source) as z, z.open(zip_member) as f:
+                yield from pd.read_csv(f, chunksize=chunksize, **kwargs)
+        else:
+            with pd.read_csv(source, chunksize=chunksize, **kwargs) as reader:
+                yield from reader
+
+
+def _hash_key(seed):
+    # pandas hashing key (16 characters) derived from the seed
+    return hashlib.md5(str(seed).encode("utf-8")).hexdigest()[:16]
+
+
+def stream_sample(chunks, sample_size, seed, key_columns=None, transform=None):
+    """
+    Uniform sample of the distinct rows of a stream of DataFrames, without
+    loading the whole stream in memory.
+
+    Each row gets a pseudo-random priority, a seeded hash of its key columns,
+    and the `sample_size` rows with the smallest priorities are kept
+    (bottom-k sampling, a reservoir sampling where the random numbers are
+    derived from the rows). As duplicated rows have the same priority, they
+    are kept at most once (the first occurrence), without keeping a set of
+    all the keys seen. Memory is proportional to `sample_size` plus one
+    chunk.
+
+    The sample only depends on `seed` and on the set of distinct keys: it
+    does not depend on the order of the rows or on the chunk size.
+
+    Parameters
+    ----------
+    chunks: iterable of pandas.DataFrame
+       e.g. from read_csv_chunks
+    sample_size: int
+       number of distinct rows to keep
+    seed: int
+       seed of the sample
+    key_columns: list of str
+       columns identifying duplicates (default: all columns, after transform)
+    transform: callable
+       applied to each chunk before sampling (filtering, computed columns...)
+
+    Returns
+    -------
+    pandas.DataFrame
+       at most `sample_size` rows, in random order, with a new index
+    """
+    hash_key = _hash_key(seed)
+    kept = None
+    threshold = None  # Largest priority in `kept`, once it is full
+
+    for chunk in chunks:
+        if transform is not None:
+            chunk = transform(chunk)
+        if len(chunk) == 0:
+            continue
+        keys = chunk if key_columns is None else chunk[key_columns]
+        priority = pd.util.hash_pandas_object(keys, index=False, hash_key=hash_key).values
+        if threshold is not None:
+            candidates = priority < threshold
+            if not candidates.any():
+                continue
+            chunk, priority = chunk[candidates], priority[candidates]
+
+        chunk = chunk.assign(_priority=priority)
+        kept = chunk if kept is None else pd.concat([kept, chunk])
+        # Stable sort: duplicates keep their first occurrence
+        kept = kept.drop_duplicates("_priority").sort_values("_priority", kind="stable").iloc[:sample_size]
+        if len(kept) == sample_size:
+            threshold = kept._priority.values[-1]
+
+    if kept is None:
+        return pd.DataFrame()
+    return kept.drop(columns="_priority").reset_index(drop=True)
+
+
+def _coalesce(df, columns):
+    res = df[columns[0]]
+    for col in columns[1:]:
+        res = res.fillna(df[col])
+    return res
+
+
+def best_region_columns(df):
+    """
+    Street and city names of BeST openaddress rows, in the language of the
+    region (nl, then fr and de in Flanders; fr, then de and nl in Wallonia;
+    fr, then nl and de in Brussels).
+
+    Parameters
+    ----------
+    df: pandas.DataFrame
+       with columns region_code, streetname_xx and municipality_name_xx
+
+    Returns
+    -------
+    pandas.DataFrame
+       df, with additional columns street and city
+    """
+    conditions = [df.region_code == "BE-VLG", df.region_code == "BE-WAL", df.region_code == "BE-BRU"]
+    orders = [["nl", "fr", "de"], ["fr", "de", "nl"], ["fr", "nl", "de"]]
+
+    def in_region_language(prefix):
+        return np.select(conditions, [_coalesce(df, [f"{prefix}_{lg}" for lg in order]) for order in orders],
+                         default=None)
+
+    return df.assign(street=in_region_language("streetname"), city=in_region_language("municipality_name"))
+
+
+def kbo_address_columns(df):
+    """
+    Columns street, housenumber, postcode, city of a sample of KBO addresses,
+    in the language of the postcode (French in Wallonia and Brussels, Dutch
+    elsewhere), with the other language as fallback.
+
+    Parameters
+    ----------
+    df: pandas.DataFrame
+       rows of address.csv of the KBO open data
+
+    Returns
+    -------
+    pandas.DataFrame
+    """
+    french = df.Zipcode.str[0].isin(["4", "5", "6", "7"]) | df.Zipcode.str[0:2].between("10", "14")
+
+    return pd.DataFrame({"street":      np.where(french, df.StreetFR.fillna(df.StreetNL), df.StreetNL.fillna(df.StreetFR)),
+                         "housenumber": df.HouseNumber,
+                         "postcode":    df.Zipcode,
+                         "city":        np.where(french, df.MunicipalityFR.fillna(df.MunicipalityNL),
+                                                 df.MunicipalityNL.fillna(df.MunicipalityFR))},
+                        index=df.index)
+
+
+def zip_lines(zip_path, members):
+    """
+    Lines (bytes) of some files of a zip archive, one after the other,
+    without extracting them.
+
+    Parameters
+    ----------
+    zip_path: str
+    members: list of str
+       names of the files in the archive
+
+    Yields
+    ------
+    bytes
+    """
+    with ZipFile(zip_path) as z:
+        for member in members:
+            with z.open(member) as f:
+                yield from f
+
+
+def _uniform(rng):
+    # Uniform in (0, 1)
+    u = rng.random()
+    while u == 0.0:
+        u = rng.random()
+    return u
+
+
+def reservoir_sample(items, k, seed):
+    """
+    Uniform sample of k items of an iterable of unknown length, in one pass
+    and O(k) memory (reservoir sampling, "Algorithm L": the number of items
+    to skip is drawn directly, so that most items are not even looked at).
+
+    The sample only depends on `seed` and on the number of items: sampling
+    range(n) selects the positions of the items sampled from any other
+    sequence of n items.
+
+    Parameters
+    ----------
+    items: iterable
+    k: int
+    seed: int
+
+    Returns
+    -------
+    list
+       k items (all of them if there are less than k)
+    """
+    rng = random.Random(seed)
+    items = iter(items)
+    reservoir = list(islice(items, k))
+    if len(reservoir) < k or k == 0:
+        return reservoir
+
+    w = math.exp(math.log(_uniform(rng)) / k)
+    while True:
+        skip = math.floor(math.log(_uniform(rng)) / math.log1p(-w)) if w < 1 else 0
+        nxt = next(islice(items, skip, None), _END)
+        if nxt is _END:
+            return reservoir
+        reservoir[rng.randrange(k)] = nxt
+        w *= math.exp(math.log(_uniform(rng)) / k)
+
+
+_END = object()
+
+
+def decode_json_lines(lines):
+    """
+    DataFrame of JSON lines (one object per line), decoded with orjson when
+    available.
+    """
+    return pd.DataFrame([json_loads(line) for line in lines])
+
+
+def _batches(items, size):
+    items = iter(items)
+    while True:
+        batch = list(islice(items, size))
+        if not batch:
+            return
+        yield batch
+
+
+def _decoded_batches(lines, batch_size, processes):
+    # Decode batches of lines in `processes` worker processes, keeping a
+    # bounded number of batches in flight, in order
+    batches = _batches(lines, batch_size)
+    if processes is None:
+        processes = os.cpu_count() or 1
+    if processes <= 1:
+        yield from map(decode_json_lines, batches)
+        return
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        window = 2 * processes
+        pending = [executor.submit(decode_json_lines, b) for b in islice(batches, window)]
+        while pending:
+            df = pending.pop(0).result()
+            for b in islice(batches, 1):
+                pending.append(executor.submit(decode_json_lines, b))
+            yield df
+
+
+def json_lines_to_parquet(lines, parquet_path, batch_size=200000, processes=None, compression="zstd"):
+    """
+    Convert a stream of JSON lines (e.g. zip_lines of the RRN mapping dump)
+    into a Parquet file, batch by batch, decoding the batches in a pool of
+    processes. Requires pyarrow.
+
+    All the columns are stored as strings. The columns are those of the
+    first batch: keys only found later are dropped (with a warning). The
+    file is written under a temporary name, then renamed.
+
+    Parameters
+    ----------
+    lines: iterable of bytes or str
+    parquet_path: str
+    batch_size: int
+       number of lines per batch (and Parquet row group)
+    processes: int
+       number of decoding processes (default: number of CPUs; 1: no pool)
+    compression: str
+
+    Returns
+    -------
+    int
+       number of rows written
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    tmp_path = f"{parquet_path}.{os.getpid()}.tmp"
+    writer, schema, rows = None, None, 0
+    try:
+        for df in _decoded_batches(lines, batch_size, processes):
+            if writer is None:
+                schema = pa.schema([(col, pa.string()) for col in df.columns])
+                writer = pq.ParquetWriter(tmp_path, schema, compression=compression)
+            extra = set(df.columns) - set(schema.names)
+            if extra:
+                logger.warning("json_lines_to_parquet: ignoring columns %s", sorted(extra))
+            df = df.reindex(columns=schema.names).astype("string")
+            writer.write_table(pa.Table.from_pandas(df, schema=schema, preserve_index=False))
+            rows += len(df)
+        if writer is not None:
+            writer.close()
+            writer = None
+            os.replace(tmp_path, parquet_path)
+    finally:
+        if writer is not None:
+            writer.close()
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return rows
+
+
+def parquet_reservoir_sample(parquet_path, k, seed, columns=None):
+    """
+    Rows of a Parquet file written by json_lines_to_parquet at the positions
+    reservoir_sample selects: the same sample as reservoir_sample on the
+    source lines, without scanning them. The file is memory-mapped and only
+    `columns` are read.
+
+    Returns
+    -------
+    pandas.DataFrame
+    """
+    import pyarrow.parquet as pq
+
+    table = pq.read_table(parquet_path, columns=columns, memory_map=True)
+    positions = reservoir_sample(range(table.num_rows), k, seed)
+    return table.take(positions).to_pandas()
+
+
+def canonical_key(record):
+    """
+    Compact key of a record (e.g. an address dict): 16 bytes of a hash of
+    its JSON form with sorted keys. Records have the same key if they are
+    equal (no normalization of the values: "Rue X" and "rue x" differ).
+    """
+    canonical = json.dumps(record, sort_keys=True, ensure_ascii=False)
+    return hashlib.blake2b(canonical.encode("utf-8"), digest_size=16).digest()
+
+
+def harvest_distinct(keys, fetch, extract, target, store=None, store_prefix="", max_workers=4, progress=None):
+    """
+    Fetch records for a sequence of keys (e.g. CBE numbers) concurrently,
+    until `target` distinct records are found.
+
+    Results are consumed in the order of `keys`, so that the result does not
+    depend on `max_workers`: it is the first `target` distinct records, as a
+    sequential loop would find them. At most 2 * max_workers fetches are in
+    flight; no new fetch is started once the target is reached.
+
+    Parameters
+    ----------
+    keys: iterable
+       keys to fetch, in order of preference
+    fetch: callable
+       fetch(key) -> JSON-serializable response (rate limiting is up to
+       fetch, e.g. with a geopy_ratelimit.AdaptiveRateLimiter)
+    extract: callable
+       extract(response) -> record (dict), or None if the response has none
+    target: int
+       number of distinct records to find
+    store: geopy_cache.ResultStore
+       if given, responses are stored there (key: store_prefix + str(key)),
+       and reused by later calls: reruns or larger targets only fetch new keys
+    store_prefix: str
+    max_workers: int
+       number of concurrent fetches
+    progress: callable
+       called with the number of new records after each new record (e.g.
+       tqdm's update)
+
+    Returns
+    -------
+    list
+       (key, record) tuples; distinct records (see canonical_key)
+    """
+    def cached_fetch(key):
+        if store is not None:
+            response = store.get(store_prefix + str(key), _END)
+            if response is not _END:
+                return response
+        response = fetch(key)
+        if store is not None:
+            store.set(store_prefix + str(key), response)
+        return response
+
+    seen = set()
+    records = []
+    keys = iter(keys)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending = [(key, executor.submit(cached_fetch, key)) for key in islice(keys, 2 * max_workers)]
+        try:
+            while pending and len(records) < target:
+                key, future = pending.pop(0)
+                record = extract(future.result())
+                if record is not None:
+                    h = canonical_key(record)
+                    if h not in seen:
+                        seen.add(h)
+                        records.append((key, record))
+                        if progress is not None:
+                            progress(1)
+                if len(records) < target:
+                    for next_key in islice(keys, 1):
+                        pending.append((next_key, executor.submit(cached_fetch, next_key)))
+        finally:
+            for _, future in pending:
+                future.cancel()
+    return records
@@ -0,0 +1,165 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from itertools import islice
+
+from geopy.adapters import BaseAsyncAdapter
+
+from geopy_results import ResultColumns
+
+__all__ = ("BatchGeocoder", )
+
+
+class BatchGeocoder:
+    """
+    Mixin adding batch geocoding to a geopy geocoder.
+
+    Queries are sent by a bounded pool of threads (or, with an async
+    adapter, by a bounded number of asyncio tasks). Results are streamed
+    back as soon as they are available, together with the index of the
+    query in the input, so that an input file can be geocoded without
+    keeping all results in memory.
+    """
+
+    # Maximum number of concurrent calls accepted by the server. None means
+    # no limit: `max_workers` given to `geocode_many` is used as is.
+    max_workers_cap = None
+
+    def _batch_workers(self, max_workers):
+        if self.max_workers_cap is not None:
+            max_workers = min(max_workers, self.max_workers_cap)
+        return max(1, max_workers)
+
+    def geocode_many(self, queries, *, max_workers=4, ordered=True, **kwargs):
+        """
+        Geocode an iterable of queries concurrently.
+
+        :param queries: Iterable of queries, as accepted by :meth:`geocode`.
+            It is consumed lazily.
+
+        :param int max_workers: Number of concurrent calls. Capped by
+            :attr:`max_workers_cap`.
+
+        :param bool ordered: If True, results are yielded in the input order.
+            Otherwise, they are yielded as soon as they are available.
+
+        :param kwargs: Passed to :meth:`geocode` for every query.
+
+        :return: A generator of ``(index, result, error)`` tuples. If the
+            geocoding of a query raised an exception, ``result`` is None and
+            ``error`` is the exception; one failing query does not abort the
+            batch. With an async adapter, an async generator.
+        """
+        max_workers = self._batch_workers(max_workers)
+        if isinstance(self.adapter, BaseAsyncAdapter):
+            return self._geocode_many_async(queries, max_workers, ordered, kwargs)
+        return self._geocode_many_sync(queries, max_workers, ordered, kwargs)
+
+    def geocode_columns(self, queries, *, max_workers=4, arrow=False, **kwargs):
+        """
+        Geocode a sequence of queries concurrently (see :meth:`geocode_many`)
+        into columns instead of Location objects.
+
+        Combined with ``lazy=True`` on the geocoder, address strings are
+        never built.
+
+        :param queries: Sequence of queries, as accepted by :meth:`geocode`.
+
+        :param bool arrow: If True, return a :class:`pyarrow.Table` (requires
+            pyarrow).
+
+        :param kwargs: Passed to :meth:`geocode`. ``exactly_one=False`` and
+            ``return_raw=True`` are not supported (one Location per query).
+
+        :return: A dict of NumPy arrays ``lat``, ``lon`` (NaN if not found),
+            ``precision``, ``id`` and ``error`` (None if not found or no
+            error), aligned with `queries` (or a pyarrow Table). With an
+            async adapter, a coroutine.
+        """
+        if not kwargs.get("exactly_one", True) or kwargs.get("return_raw", False):
+            raise ValueError("geocode_columns keeps one Location per query: exactly_one=False and return_raw=True "
+                             "are not supported")
+        queries = list(queries)
+        columns = ResultColumns(len(queries))
+        results = self.geocode_many(queries, max_workers=max_workers, ordered=False, **kwargs)
+        if isinstance(self.adapter, BaseAsyncAdapter):
+            return self._fill_columns_async(results, columns, arrow)
+        for index, location, error in results:
+            columns.set(index, location, error)
+        return columns.to_arrow() if arrow else columns.to_dict()
+
+    async def _fill_columns_async(self, results, columns, arrow):
+        async for index, location, error in results:
+            columns.set(index, location, error)
+        return columns.to_arrow() if arrow else columns.to_dict()
+
+    def _geocode_many_sync(self, queries, max_workers, ordered, kwargs):
+
+        def geocode_one(index, query):
+            try:
+                return index, self.geocode(query, **kwargs), None
+            except Exception as e:
+                return index, None, e
+
+        queries = enumerate(queries)
+        # Keep a bounded number of queries in flight (or waiting for their
+        # turn in ordered mode), so that a large input is never loaded in
+        # memory at once.
+        window = 2 * max_workers
+        # Not a `with` block: if the generator is closed early, do not wait
+        # for the queries still in flight
+        executor = ThreadPoolExecutor(max_workers=max_workers)
+        try:
+            pending = set()
+            done_results = {}
+            next_index = 0
+            while True:
+                for i, q in islice(queries, window - len(pending) - len(done_results)):
+                    pending.add(executor.submit(geocode_one, i, q))
+                if not pending:
+                    break
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    res = future.result()
+                    if ordered:
+                        done_results[res[0]] = res
+                    else:
+                        yield res
+                while next_index in done_results:
+                    yield done_results.pop(next_index)
+                    next_index += 1
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    async def _geocode_many_async(self, queries, max_workers, ordered, kwargs):
+
+        async def geocode_one(index, query):
+            try:
+                return index, await self.geocode(query, **kwargs), None
+            except Exception as e:
+                return index, None, e
+
+        queries = enumerate(queries)
+        window = 2 * max_workers
+        pending = set()
+        done_results = {}
+        next_index = 0
+        try:
+            while True:
+                for i, q in islice(queries, window - len(pending) - len(done_results)):
+                    pending.add(asyncio.ensure_future(geocode_one(i, q)))
+                if not pending:
+                    break
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    res = task.result()
+                    if ordered:
+                        done_results[res[0]] = res
+                    else:
+                        yield res
+                while next_index in done_results:
+                    yield done_results.pop(next_index)
+                    next_index += 1
+        finally:
+            # Consumer stopped early: do not leave tasks running
+            for task in pending:
+                task.cancel()
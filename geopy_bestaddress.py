@@ -1,20 +1,40 @@
+import asyncio
 import collections.abc
+import contextlib
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
 from functools import partial
 from urllib.parse import urlencode, quote_plus
 
+from geopy.adapters import BaseAsyncAdapter
 from geopy.exc import ConfigurationError, GeocoderQueryError, GeocoderAuthenticationFailure
 from geopy.geocoders.base import _DEFAULT_USER_AGENT, DEFAULT_SENTINEL, Geocoder
 from geopy.location import Location
 from geopy.util import logger
 
+from geopy_batch import BatchGeocoder
+from geopy_cache import LRUCache
+from geopy_instrumentation import NULL_OBSERVER, instrument_session, timed
+from geopy_ratelimit import limited_call
+from geopy_results import LazyLocation
+
 import urllib3
 import json
 
 from oauthlib.oauth2 import BackendApplicationClient
 from requests_oauthlib import OAuth2Session
 
+try:
+    import fcntl
+except ImportError: # Windows: no lock on the shared token cache
+    fcntl = None
+
 __all__ = ("BestAddress", )
 
+_MISSING = object()
+
 
 def coalesce(dct, keys):
     for k in keys:
@@ -22,15 +42,54 @@ def coalesce(dct, keys):
             return dct[k]
     return None
 
-def set_precision(res, precision):
+def set_precision(res, precision, cascade_level=None):
     if isinstance(res, list):
         for ar in res:
-            ar.raw["precision"] = precision
+            set_precision(ar, precision, cascade_level)
     else:
         res.raw["precision"] = precision
-        
-        
-class BestAddress(Geocoder):
+        if cascade_level is not None:
+            res.raw["cascade_level"] = cascade_level
+
+
+def place_address(place):
+    # Address string of a BeST resource (address, street, postal info, municipality).
+
+    street_name =    coalesce(place["hasStreetName"]["name"], ["fr", "nl", "de"]) if "hasStreetName" in place else None
+    housenumber =    place["houseNumber"] if "houseNumber" in place else None
+    city_name =      coalesce(place["hasMunicipality"]["name"], ["fr", "nl", "de"]) if "hasMunicipality" in place else None
+    part_city_name = coalesce(place["hasPartOfMunicipality"]["name"], ["fr", "nl", "de"]) if "hasPartOfMunicipality" in place and "name" in place["hasPartOfMunicipality"] else None
+    
+    postcode = place["hasPostalInfo"]["postCode"] if "hasPostalInfo" in place else  place["postCode"] if "postCode" in place else None
+    city_name = coalesce(place["name"], ["fr", "nl", "de"]) if "name" in place else city_name
+
+    return f"{street_name}, {housenumber if housenumber else ''}, {postcode} {city_name} {'('+part_city_name+')' if part_city_name else ''}"
+
+
+def place_point(place):
+    # (lat, lon) of a BeST resource; (0, 0) for resources without position.
+    if "addressPosition" in place:
+        coords = place["addressPosition"]["wgs84"]
+        return coords['lat'], coords['long']
+    return 0, 0
+
+
+def next_page_url(places):
+    # BeST API: link to the next page, as a string or as {"href": ...}
+    nxt = places.get("next")
+    if isinstance(nxt, dict):
+        nxt = nxt.get("href")
+    return nxt
+
+
+def parse_place(place, lazy=False):
+    # Parse a BeST resource (address, street, postal info, municipality) into a Location.
+    if lazy:
+        return LazyLocation(place, place_address, place_point)
+    return Location(place_address(place), place_point(place), place)
+
+
+class BestAddress(BatchGeocoder, Geocoder):
     
     _DEFAULT_BEST_DOMAIN  =None
 
@@ -48,6 +107,10 @@ class BestAddress(Geocoder):
 
     scope             = "BOSA"
 
+    # Threads of the speculative cascade, shared by the concurrent geocode
+    # calls of an instance (5 levels per call)
+    speculative_max_workers = 20
+
     
     def __init__(
             self,
@@ -64,7 +127,15 @@ class BestAddress(Geocoder):
             client_secret=None,
             token=None,
             belgov_trace_id=None,
-            verbose=False
+            verbose=False,
+            token_refresh_margin=60,
+            token_cache_path=None,
+            reference_tables=None,
+            local_index=None,
+            rate_limiter=None,
+            observer=None,
+            lazy=False,
+            id_cache=10000
             # Make sure to synchronize the changes of this signature in the
             # inheriting classes (e.g. PickPoint).
     ):
@@ -93,6 +164,42 @@ class BestAddress(Geocoder):
             See :attr:`geopy.geocoders.options.default_adapter_factory`.
 
             .. versionadded:: 2.0
+
+        :param float token_refresh_margin: The OAuth token is renewed this
+            number of seconds before its expiry (given by ``expires_in``),
+            instead of waiting for a call to be rejected.
+
+        :param str token_cache_path: File where the token is shared between
+            processes: a process reuses the valid token found there instead
+            of fetching its own, and only one process at a time fetches a
+            new one.
+
+        :param reference_tables: A
+            :class:`geopy_bestaddress_local.BestReferenceTables`. If given,
+            postal info and municipality searches (the three last levels of
+            the geocode cascade) are answered locally.
+
+        :param local_index: A
+            :class:`geopy_bestaddress_local.LocalBestAddress`. If given,
+            :meth:`reverse` is answered locally, with a KD-tree on the
+            address points.
+
+        :param rate_limiter: A :class:`geopy_ratelimit.AdaptiveRateLimiter`
+            controlling the rate and concurrency of the API calls (shared by
+            all the threads or tasks using this geocoder).
+
+        :param observer: A :class:`geopy_instrumentation.Observer`
+            receiving timings, counters and events of the calls.
+
+        :param bool lazy: If True, results are
+            :class:`geopy_results.LazyLocation` objects: address strings and
+            points are only decoded when accessed.
+
+        :param id_cache: Cache of the objects fetched by
+            :meth:`get_many_by_id`: maximum number of objects kept in memory
+            (0 or None: no cache), or a store with ``get(key, default)`` and
+            ``set(key, value)`` methods, such as a persistent
+            :class:`geopy_cache.ResultStore`.
         """
         
         super().__init__(
@@ -105,8 +212,14 @@ class BestAddress(Geocoder):
         )
         
         self.verbose = verbose
+        self.lazy = lazy
+        self._run_async = isinstance(self.adapter, BaseAsyncAdapter)
         self.client_id  = client_id
         self.client_secret = client_secret
+        self.token_refresh_margin = token_refresh_margin
+        self.token_cache_path = token_cache_path
+        self._token_lock = threading.Lock()
+        self._token_lock_async = None # Created in the event loop
         
         #print(f"domain: {domain}, : {self._DEFAULT_BEST_DOMAIN}")
         self.domain = domain.strip('/')
@@ -138,8 +251,174 @@ class BestAddress(Geocoder):
         self.authorization_url = "%s://%s%s%s" % (self.scheme, self.domain, self.prefix, self.authorization_path)
 
         self.belgov_trace_id = belgov_trace_id
+
+        self.reference_tables = reference_tables
+        self.local_index = local_index
+        self.rate_limiter = rate_limiter
+        self._endpoints = {self.api_address: "addresses", self.api_street: "streets",
+                           self.api_postalinfo: "postalInfos", self.api_municipality: "municipalities"}
+
+        self.observer = observer if observer is not None else NULL_OBSERVER
+        self._provider = type(self).__name__
+        if not self._run_async:
+            instrument_session(self.adapter.session, self.observer, provider=self._provider)
+
+        if isinstance(id_cache, int):
+            id_cache = LRUCache(id_cache) if id_cache > 0 else None
+        self.id_cache = id_cache
+        # get_many_by_id: cache key -> Future of the fetch in progress
+        self._inflight = {}
+        self._inflight_lock = threading.Lock()
+        self._inflight_async = {}
+
+        self._local_object_types = {self.api_postalinfo: "postalinfo",
+                                    self.api_municipality: "municipality"}
+
+        self._executor = None  # See speculative_max_workers
+        self._executor_lock = threading.Lock()
+
+    def _speculative_executor(self):
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.speculative_max_workers,
+                                                    thread_name_prefix=self._provider)
+            return self._executor
+
+    def close(self):
+        """
+        Stop the threads of the speculative cascade (sync mode).
+        """
+        with self._executor_lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        super().__exit__(exc_type, exc_val, exc_tb)
+        self.close()
     def renew_token(self):
-        
+        """
+        Fetch a new OAuth token (client credentials flow), unless another
+        thread or process just did it.
+
+        In async mode, returns a coroutine.
+        """
+        if self._run_async:
+            return self._refresh_token_async(self.token)
+        self._refresh_token(self.token)
+
+    def _token_is_valid(self):
+        if self.token is None:
+            return False
+        expires_at = self.token.get("expires_at")
+        return expires_at is None or time.time() < expires_at - self.token_refresh_margin
+
+    def _set_token(self, token):
+        if "expires_at" not in token and "expires_in" in token:
+            token["expires_at"] = time.time() + float(token["expires_in"])
+        self.token = token
+
+    def _ensure_token(self):
+        if not self._token_is_valid():
+            self._refresh_token(self.token)
+
+    def _refresh_token(self, stale_token):
+        # Single flight: threads waiting for the lock reuse the token
+        # fetched by the first one.
+        with self._token_lock:
+            if self.token is not stale_token and self._token_is_valid():
+                return
+            with self._shared_token_lock():
+                if self._load_shared_token(stale_token):
+                    return
+                with self.observer.span("geocoder.token_fetch", provider=self._provider):
+                    self._set_token(self._fetch_token())
+                self._store_shared_token()
+            self._token_renewed(stale_token)
+
+    async def _ensure_token_async(self):
+        if not self._token_is_valid():
+            await self._refresh_token_async(self.token)
+
+    async def _refresh_token_async(self, stale_token):
+        if self._token_lock_async is None:
+            self._token_lock_async = asyncio.Lock()
+        async with self._token_lock_async:
+            if self.token is not stale_token and self._token_is_valid():
+                return
+            async with self._shared_token_lock_async():
+                if self._load_shared_token(stale_token):
+                    return
+                with self.observer.span("geocoder.token_fetch", provider=self._provider):
+                    self._set_token(await self._fetch_token_async())
+                self._store_shared_token()
+            self._token_renewed(stale_token)
+
+    def _token_renewed(self, stale_token):
+        reason = "initial" if stale_token is None else "expired"
+        logger.info("%s: new token (%s)", self._provider, reason)
+        self.observer.event("token.renewal", provider=self._provider, reason=reason)
+
+    @contextlib.contextmanager
+    def _shared_token_lock(self):
+        if self.token_cache_path is None or fcntl is None:
+            yield
+            return
+        with open(self.token_cache_path + ".lock", "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    @contextlib.asynccontextmanager
+    async def _shared_token_lock_async(self, poll_interval=0.05):
+        # Same lock as _shared_token_lock, without blocking the event loop:
+        # the lock is polled (another coroutine of this loop, e.g. of another
+        # instance sharing the cache, may hold it while awaiting its token)
+        if self.token_cache_path is None or fcntl is None:
+            yield
+            return
+        with open(self.token_cache_path + ".lock", "a") as lock_file:
+            while True:
+                try:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    break
+                except BlockingIOError:
+                    await asyncio.sleep(poll_interval)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _load_shared_token(self, stale_token):
+        # Use the token shared by other processes, if it is still valid
+        if self.token_cache_path is None or not os.path.exists(self.token_cache_path):
+            return False
+        try:
+            with open(self.token_cache_path) as f:
+                token = json.load(f)
+        except ValueError:
+            return False
+        if stale_token is not None and token.get("access_token") == stale_token.get("access_token"):
+            return False
+        current_token = self.token
+        self.token = token
+        if self._token_is_valid():
+            return True
+        self.token = current_token
+        return False
+
+    def _store_shared_token(self):
+        if self.token_cache_path is None:
+            return
+        tmp_path = f"{self.token_cache_path}.{os.getpid()}.tmp"
+        with open(os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), "w") as f:
+            json.dump(self.token, f)
+        os.replace(tmp_path, self.token_cache_path)
+
+    def _fetch_token(self):
+
         client = BackendApplicationClient(client_id=self.client_id)
         oauth = OAuth2Session(client=client, scope=self.scope)
 
@@ -147,11 +426,42 @@ class BestAddress(Geocoder):
         if self.verbose:
             print(self.authorization_url, self.client_secret, self.client_id)
             
-        self.token = oauth.fetch_token(token_url=self.authorization_url, include_client_id=True, client_secret=self.client_secret)
+        token = oauth.fetch_token(token_url=self.authorization_url, include_client_id=True, client_secret=self.client_secret)
 
         if self.verbose:
-            print(self.token)
+            print(token)
+        return dict(token)
+
+    async def _fetch_token_async(self):
+        # Same request as OAuth2Session.fetch_token, sent through the
+        # aiohttp session of the adapter.
+        data = {
+            "grant_type": "client_credentials",
+            "scope": self.scope,
+            "client_id": self.client_id,
+            "client_secret": self.client_secret,
+        }
+        if self.verbose:
+            print(self.authorization_url, self.client_secret, self.client_id)
 
+        async with self.adapter.session.post(self.authorization_url, data=data, headers=self.headers,
+                                             timeout=self.timeout, ssl=self.ssl_context) as response:
+            if response.status >= 400:
+                raise GeocoderAuthenticationFailure(await response.text())
+            token = await response.json(content_type=None)
+
+        if "access_token" not in token:
+            raise GeocoderAuthenticationFailure(f"No access token in response: {token}")
+
+        if self.verbose:
+            print(token)
+        return token
+
+    def _auth_headers(self, token):
+        headers = {"Authorization": f"Bearer {token['access_token']}"}
+        if self.belgov_trace_id is not None: # requests skips None headers, aiohttp does not
+            headers["BelGov-Trace-Id"] = self.belgov_trace_id
+        return headers
         
     def _construct_url(self, base_api, params):
         """
@@ -166,33 +476,85 @@ class BestAddress(Geocoder):
 
         :return: string URL.
         """
+        if not params: # e.g. get_by_id, or "next" links which already contain their parameters
+            return base_api
         return "?".join((base_api, urlencode(params)))
 
-    def _call_api(self, api_base, params, timeout, exactly_one=True, return_raw=False):
+    def _call_api(self, api_base, params, timeout, exactly_one=True, return_raw=False, endpoint=None):
         
-        if self.token is None:
-            self.renew_token()
-            
-        headers= {
-            "BelGov-Trace-Id": self.belgov_trace_id,
-            "Authorization": f"Bearer {self.token['access_token']}"  
-        }
+        if self.reference_tables is not None and api_base in self._local_object_types:
+            places = self.reference_tables.search(self._local_object_types[api_base], params)
+            if places is not None:
+                res = self._parse_json(places, exactly_one=exactly_one, return_raw=return_raw)
+                return self._as_coroutine(res) if self._run_async else res
+
+        if self._run_async:
+            return self._call_api_async(api_base, params, timeout, exactly_one=exactly_one, return_raw=return_raw,
+                                        endpoint=endpoint)
+
+        self._ensure_token()
+        token = self.token
+        headers = self._auth_headers(token)
         
         url = self._construct_url(api_base, params)
         logger.debug("%s.geocode: %s", self.__class__.__name__, url)
         
 #         print(f"street url : {street_url}")
-        callback = partial(self._parse_json, exactly_one=exactly_one, return_raw=return_raw)
+        callback = timed(self.observer, "geocoder.parse",
+                         partial(self._parse_json, exactly_one=exactly_one, return_raw=return_raw), provider=self._provider)
+        if endpoint is None:
+            endpoint = self._endpoints.get(api_base, "by_id")
         try :
-            return self._call_geocoder(url, callback, headers=headers, timeout=timeout)
+            return limited_call(self.rate_limiter, False, self._http, endpoint, url, callback, headers=headers,
+                                timeout=timeout)
         except GeocoderAuthenticationFailure:
-            print("Renew token...")
-            self.renew_token()
-            headers["Authorization"] =  f"Bearer {self.token['access_token']}"  
+            self._token_rejected()
+            self._refresh_token(token)
+            headers = self._auth_headers(self.token)
         
-            return self._call_geocoder(url, callback, headers=headers, timeout=timeout)
-            
+            return limited_call(self.rate_limiter, False, self._http, endpoint, url, callback, headers=headers,
+                                timeout=timeout)
             
+    def _http(self, endpoint, url, callback, **kwargs):
+        # One call to the service, inside the rate limiter: the span does
+        # not include the wait for a slot
+        with self.observer.span("geocoder.http", provider=self._provider, endpoint=endpoint):
+            return self._call_geocoder(url, callback, **kwargs)
+
+    async def _http_async(self, endpoint, url, callback, **kwargs):
+        with self.observer.span("geocoder.http", provider=self._provider, endpoint=endpoint):
+            return await self._call_geocoder(url, callback, **kwargs)
+
+    async def _as_coroutine(self, res):
+        return res
+
+    def _token_rejected(self):
+        logger.info("%s: token rejected, renewing it", self._provider)
+        self.observer.event("token.rejected", provider=self._provider)
+
+    async def _call_api_async(self, api_base, params, timeout, exactly_one=True, return_raw=False, endpoint=None):
+
+        await self._ensure_token_async()
+        token = self.token
+        headers = self._auth_headers(token)
+
+        url = self._construct_url(api_base, params)
+        logger.debug("%s.geocode: %s", self.__class__.__name__, url)
+
+        callback = timed(self.observer, "geocoder.parse",
+                         partial(self._parse_json, exactly_one=exactly_one, return_raw=return_raw), provider=self._provider)
+        if endpoint is None:
+            endpoint = self._endpoints.get(api_base, "by_id")
+        try :
+            return await limited_call(self.rate_limiter, True, self._http_async, endpoint, url, callback, headers=headers,
+                                      timeout=timeout)
+        except GeocoderAuthenticationFailure:
+            self._token_rejected()
+            await self._refresh_token_async(token)
+            headers = self._auth_headers(self.token)
+
+            return await limited_call(self.rate_limiter, True, self._http_async, endpoint, url, callback, headers=headers,
+                                      timeout=timeout)
         
     def geocode(
             self,
@@ -211,7 +573,9 @@ class BestAddress(Geocoder):
             featuretype=None,
             namedetails=False,
             skip_house_number=False,
-            return_raw=False
+            return_raw=False,
+            speculative=False,
+            wave_size=None
         
     ):
         """
@@ -284,52 +648,132 @@ class BestAddress(Geocoder):
             namedetails, set it to True. This will be a list of alternative names,
             including language variants, etc.
 
+        :param bool speculative: If True, the levels of the fallback cascade
+            (address, street, postal info by code, postal info by name,
+            municipality) are called concurrently instead of one after the
+            other. The most precise non-empty answer is returned as soon as
+            all more precise levels are known to be empty; calls still
+            outstanding are then cancelled.
+
+        :param int wave_size: In speculative mode, number of cascade levels
+            called at once. Next wave is only sent if the current one has
+            no answer. Default: all levels in one wave.
+
         :rtype: ``None``, :class:`geopy.location.Location` or a list of them, if
-            ``exactly_one=False``.
+            ``exactly_one=False``. The level of the cascade which answered is
+            given in ``raw["cascade_level"]`` (0 for the address level), next
+            to ``raw["precision"]``.
 
         """
 
-        sequence = [(self.api_address,       {"streetName":  query["street"], "postCode": query["postcode"], "houseNumber": query["housenumber"]}, "building"),
-                    (self.api_address,       {"streetName":  query["street"], "postCode": query["postcode"]}, "street"),
-                    (self.api_postalinfo,    {"postCode":  query["postcode"]}, "city"),
-                    (self.api_postalinfo,    {"name":      query["city"]},     "city"),
-                    (self.api_municipality,  {"name":      query["city"]},     "city")
-                   ]
+        sequence = self._cascade(query)
+
+        if self._run_async:
+            if speculative:
+                return self._geocode_speculative_async(sequence, timeout, exactly_one, return_raw, wave_size)
+            return self._geocode_async(sequence, timeout, exactly_one, return_raw)
 
+        if speculative:
+            return self._geocode_speculative(sequence, timeout, exactly_one, return_raw, wave_size)
 
-        for (api_base, params, precision) in sequence:
+        for level, (api_base, params, precision) in enumerate(sequence):
             addr_res= self._call_api(api_base, params, timeout, exactly_one=exactly_one, return_raw=return_raw)
 
             # print(addr_res)
-            if addr_res is not None and ("items" in addr_res and len(addr_res["items"])>0):
-                if not return_raw: 
-                    set_precision(addr_res, precision)
-                return addr_res
-
+            if self._is_found(addr_res, return_raw):
+                return self._found(addr_res, precision, level, return_raw)
+
+        return self._not_found()
+
+    async def _geocode_async(self, sequence, timeout, exactly_one, return_raw):
+
+        for level, (api_base, params, precision) in enumerate(sequence):
+            addr_res= await self._call_api(api_base, params, timeout, exactly_one=exactly_one, return_raw=return_raw)
+
+            if self._is_found(addr_res, return_raw):
+                return self._found(addr_res, precision, level, return_raw)
+
+        return self._not_found()
+
+    def _waves(self, sequence, wave_size):
+        levels = list(enumerate(sequence))
+        wave_size = wave_size or len(levels)
+        return [levels[i:i+wave_size] for i in range(0, len(levels), wave_size)]
+
+    def _geocode_speculative(self, sequence, timeout, exactly_one, return_raw, wave_size):
+
+        self._ensure_token() # Before the threads are started
+
+        executor = self._speculative_executor()
+        for wave in self._waves(sequence, wave_size):
+            futures = [(level, precision, executor.submit(self._call_api, api_base, params, timeout, 
+                                                          exactly_one=exactly_one, return_raw=return_raw))
+                       for level, (api_base, params, precision) in wave]
+            try:
+                # Check answers in precision order: a less precise answer
+                # arriving first has to wait for the more precise ones.
+                for level, precision, future in futures:
+                    addr_res = future.result()
+                    if self._is_found(addr_res, return_raw):
+                        return self._found(addr_res, precision, level, return_raw)
+            finally:
+                # Requests already sent cannot be interrupted, but their
+                # answer is not waited for; those still queued are dropped.
+                for _, _, future in futures:
+                    future.cancel()
+
+        return self._not_found()
+
+    async def _geocode_speculative_async(self, sequence, timeout, exactly_one, return_raw, wave_size):
+
+        await self._ensure_token_async()
+
+        for wave in self._waves(sequence, wave_size):
+            tasks = [(level, precision, asyncio.ensure_future(self._call_api(api_base, params, timeout, 
+                                                                               exactly_one=exactly_one, return_raw=return_raw)))
+                     for level, (api_base, params, precision) in wave]
+            try:
+                for level, precision, task in tasks:
+                    addr_res = await task
+                    if self._is_found(addr_res, return_raw):
+                        return self._found(addr_res, precision, level, return_raw)
+            finally:
+                for _, _, task in tasks:
+                    task.cancel()
+
+        return self._not_found()
+
+    def _found(self, addr_res, precision, level, return_raw):
+        if not return_raw: 
+            set_precision(addr_res, precision, level)
+        self.observer.count("geocoder.cascade", provider=self._provider, level=level, precision=precision)
+        return addr_res
+
+    def _not_found(self):
+        self.observer.count("geocoder.cascade", provider=self._provider, level="none", precision="none")
         return None
 
+    def _cascade(self, query):
+        # Fallback sequence used by geocode: from the most to the least precise
+        return [(self.api_address,       {"streetName":  query["street"], "postCode": query["postcode"], "houseNumber": query["housenumber"]}, "building"),
+                (self.api_address,       {"streetName":  query["street"], "postCode": query["postcode"]}, "street"),
+                (self.api_postalinfo,    {"postCode":  query["postcode"]}, "city"),
+                (self.api_postalinfo,    {"name":      query["city"]},     "city"),
+                (self.api_municipality,  {"name":      query["city"]},     "city")
+               ]
+
+    def _is_found(self, addr_res, return_raw):
+        if addr_res is None:
+            return False
+        if return_raw:
+            return "items" in addr_res and len(addr_res["items"])>0
+        # _parse_json already returns None when there is no item
+        return not isinstance(addr_res, list) or len(addr_res)>0
+
 
     def _parse_code(self, place):
         # Parse each resource.
-        
-        street_name =    coalesce(place["hasStreetName"]["name"], ["fr", "nl", "de"]) if "hasStreetName" in place else None
-        housenumber =    place["houseNumber"] if "houseNumber" in place else None
-        city_name =      coalesce(place["hasMunicipality"]["name"], ["fr", "nl", "de"]) if "hasMunicipality" in place else None
-        part_city_name = coalesce(place["hasPartOfMunicipality"]["name"], ["fr", "nl", "de"]) if "hasPartOfMunicipality" in place and "name" in place["hasPartOfMunicipality"] else None
-        
-        postcode = place["hasPostalInfo"]["postCode"] if "hasPostalInfo" in place else  place["postCode"] if "postCode" in place else None
-        city_name = coalesce(place["name"], ["fr", "nl", "de"]) if "name" in place else city_name
-        
-        if "addressPosition" in place:
-            coords = place["addressPosition"]["wgs84"]
-        else: 
-            coords = {'lat':0, 'long':0}
-                
-        return Location(f"{street_name}, {housenumber if housenumber else ''}, {postcode} {city_name} {'('+part_city_name+')' if part_city_name else ''}", 
-                            (coords['lat'], coords['long']), 
-                            #None,
-                            place) 
-        
+        return parse_place(place, self.lazy)
 
     def _parse_json(self, places, exactly_one, return_raw):
 
@@ -378,14 +822,263 @@ class BestAddress(Geocoder):
         return self._call_api(url, {}, timeout, exactly_one=False, return_raw=True)
         
     
+    def iter_addresses(self, *, page_size=100, raw=False, timeout=DEFAULT_SENTINEL, **params):
+        """
+        Iterate over all the addresses matching a search, page by page.
+
+        Example: ``geocoder.iter_addresses(streetName="Avenue Fonsny",
+        postCode="1060")``.
+
+        :param int page_size: Number of items per API call.
+
+        :param bool raw: If True, yield the BeST items (dicts) instead of
+            Location objects.
+
+        :param params: Search parameters of the BeST API (``streetName``,
+            ``postCode``, ``houseNumber``, ``municipalityName``...).
+
+        :return: A generator (an async generator with an async adapter).
+            The next page is requested while the current one is consumed;
+            at most two pages are kept in memory.
+        """
+        return self._iter_pages(self.api_address, params, page_size, raw, timeout)
+
+    def iter_streets(self, *, page_size=100, raw=False, timeout=DEFAULT_SENTINEL, **params):
+        """
+        Iterate over all the streets matching a search (e.g.
+        ``postCode="1060"``). See :meth:`iter_addresses`.
+        """
+        return self._iter_pages(self.api_street, params, page_size, raw, timeout)
+
+    def iter_postalinfos(self, *, page_size=100, raw=False, timeout=DEFAULT_SENTINEL, **params):
+        """
+        Iterate over all the postal infos matching a search (all of them
+        without parameters). Always answered by the API, even with
+        ``reference_tables``. See :meth:`iter_addresses`.
+        """
+        return self._iter_pages(self.api_postalinfo, params, page_size, raw, timeout)
+
+    def iter_municipalities(self, *, page_size=100, raw=False, timeout=DEFAULT_SENTINEL, **params):
+        """
+        Iterate over all the municipalities matching a search (all of them
+        without parameters). See :meth:`iter_postalinfos`.
+        """
+        return self._iter_pages(self.api_municipality, params, page_size, raw, timeout)
+
+    def _iter_pages(self, api_base, params, page_size, raw, timeout):
+        timeout = timeout if timeout is not DEFAULT_SENTINEL else self.timeout
+        endpoint = self._endpoints[api_base]
+        # Full URL: bypasses the reference tables, which do not paginate
+        url = self._construct_url(api_base, dict(params, pageSize=page_size))
+        if self._run_async:
+            return self._iter_pages_async(url, endpoint, raw, timeout)
+        return self._iter_pages_sync(url, endpoint, raw, timeout)
+
+    def _fetch_page(self, url, endpoint, timeout):
+        return self._call_api(url, {}, timeout, exactly_one=False, return_raw=True, endpoint=endpoint)
+
+    def _page_items(self, places, raw):
+        if raw:
+            return places["items"]
+        return [parse_place(place, self.lazy) for place in places["items"]]
+
+    def _iter_pages_sync(self, url, endpoint, raw, timeout):
+        # One thread prefetches the next page while the caller consumes the
+        # current one
+        executor = ThreadPoolExecutor(max_workers=1)
+        try:
+            future = executor.submit(self._fetch_page, url, endpoint, timeout)
+            while future is not None:
+                places = future.result()
+                if not places or not places.get("items"):
+                    break
+                url = next_page_url(places)
+                future = executor.submit(self._fetch_page, url, endpoint, timeout) if url else None
+                yield from self._page_items(places, raw)
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    async def _iter_pages_async(self, url, endpoint, raw, timeout):
+        task = asyncio.ensure_future(self._fetch_page(url, endpoint, timeout))
+        try:
+            while task is not None:
+                places = await task
+                task = None
+                if not places or not places.get("items"):
+                    break
+                url = next_page_url(places)
+                if url:
+                    task = asyncio.ensure_future(self._fetch_page(url, endpoint, timeout))
+                for item in self._page_items(places, raw):
+                    yield item
+        finally:
+            if task is not None:
+                task.cancel()
+
+    def _id_cache_key(self, id, object_type):
+        return f"{self.domain}|{object_type}|{id}"
+
+    def _id_cache_get(self, key):
+        if self.id_cache is None:
+            return _MISSING
+        return self.id_cache.get(key, _MISSING)
+
+    def get_many_by_id(self, ids, object_type="address", *, max_workers=8, timeout=DEFAULT_SENTINEL,
+                       return_exceptions=False):
+        """
+        Fetch many BeST objects by id (see :meth:`get_by_id`), each distinct
+        id only once.
+
+        Objects are served from :attr:`id_cache` when possible. An id being
+        fetched by another thread (or task) is not fetched again: its result
+        is shared. The other ids are fetched concurrently.
+
+        :param ids: Iterable of BeST ids (may contain duplicates).
+
+        :param str object_type: "address", "street", "postalinfo" or
+            "municipality".
+
+        :param int max_workers: Number of concurrent calls.
+
+        :param bool return_exceptions: If True, the exception raised for an
+            id is returned as its value; otherwise, it is raised (after all
+            the fetches completed).
+
+        :return: Dict from each distinct id to its raw BeST object, in the
+            order of `ids` (a coroutine with an async adapter).
+        """
+        if object_type not in ("address", "street", "postalinfo", "municipality"):
+            raise ValueError(f"Unknown object_type value '{object_type}'. Valid values are 'address', "
+                             "'street', 'postalinfo' and 'municipality'")
+        ids = list(dict.fromkeys(ids))
+        if self._run_async:
+            return self._get_many_by_id_async(ids, object_type, max_workers, timeout, return_exceptions)
+
+        results, owned, shared = self._split_ids(ids, object_type, self._inflight, Future)
+
+        if owned:
+            with ThreadPoolExecutor(max_workers=min(max_workers, len(owned))) as executor:
+                for id, future in owned.items():
+                    executor.submit(self._resolve_id, id, object_type, timeout, future)
+
+        for id, future in {**owned, **shared}.items():
+            try:
+                results[id] = future.result()
+            except Exception as e:
+                results[id] = e
+        return self._many_by_id_results(ids, results, return_exceptions)
+
+    def _split_ids(self, ids, object_type, inflight, future_class):
+        # Cached ids -> results, ids fetched by this call -> new futures, ids
+        # fetched by another caller -> their futures
+        results, owned, shared = {}, {}, {}
+        for id in ids:
+            key = self._id_cache_key(id, object_type)
+            res = self._id_cache_get(key)
+            if res is not _MISSING:
+                results[id] = res
+                continue
+            with self._inflight_lock:
+                future = inflight.get(key)
+                if future is None:
+                    owned[id] = inflight[key] = future_class()
+                else:
+                    shared[id] = future
+        self.observer.count("geocoder.id_cache", len(results), result="hit", provider=self._provider)
+        self.observer.count("geocoder.id_cache", len(shared), result="shared", provider=self._provider)
+        self.observer.count("geocoder.id_cache", len(owned), result="miss", provider=self._provider)
+        return results, owned, shared
+
+    def _id_resolved(self, key, future, res, error):
+        if error is not None:
+            future.set_exception(error)
+        else:
+            # Not found (None) is not cached: the object may be created later
+            if self.id_cache is not None and res is not None:
+                self.id_cache.set(key, res)
+            future.set_result(res)
+
+    def _resolve_id(self, id, object_type, timeout, future):
+        key = self._id_cache_key(id, object_type)
+        try:
+            try:
+                res, error = self.get_by_id(id, object_type, timeout), None
+            except Exception as e:
+                res, error = None, e
+            self._id_resolved(key, future, res, error)
+        finally:
+            # Interrupted: the callers sharing the future must not wait for it forever
+            if not future.done():
+                future.cancel()
+            with self._inflight_lock:
+                self._inflight.pop(key, None)
+
+    async def _resolve_id_async(self, id, object_type, timeout, future, semaphore):
+        key = self._id_cache_key(id, object_type)
+        try:
+            try:
+                async with semaphore:
+                    res, error = await self.get_by_id(id, object_type, timeout), None
+            except Exception as e:
+                res, error = None, e
+            self._id_resolved(key, future, res, error)
+        finally:
+            # Cancelled (CancelledError is not an Exception): the tasks
+            # sharing the future fetch the id again (see _get_many_by_id_async)
+            if not future.done():
+                future.cancel()
+            self._inflight_async.pop(key, None)
+
+    async def _get_many_by_id_async(self, ids, object_type, max_workers, timeout, return_exceptions):
+        loop = asyncio.get_running_loop()
+        results, owned, shared = self._split_ids(ids, object_type, self._inflight_async, loop.create_future)
+
+        semaphore = asyncio.Semaphore(max_workers)
+        await asyncio.gather(*(self._resolve_id_async(id, object_type, timeout, future, semaphore)
+                               for id, future in owned.items()))
+        abandoned = []
+        for id, future in {**owned, **shared}.items():
+            try:
+                # Shielded: cancelling this task must not cancel a future shared with other tasks
+                results[id] = await asyncio.shield(future)
+            except asyncio.CancelledError:
+                if not future.cancelled():
+                    raise
+                abandoned.append(id)  # The task fetching it was cancelled
+            except Exception as e:
+                results[id] = e
+        if abandoned:
+            results.update(await self._get_many_by_id_async(abandoned, object_type, max_workers, timeout, True))
+        return self._many_by_id_results(ids, results, return_exceptions)
+
+    def _many_by_id_results(self, ids, results, return_exceptions):
+        if not return_exceptions:
+            for id in ids:
+                if isinstance(results[id], Exception):
+                    raise results[id]
+        return {id: results[id] for id in ids}
+
     def reverse(
             self,
             query,
             *,
             exactly_one=True,
             timeout=DEFAULT_SENTINEL,
-            radius=15
+            radius=15,
+            k=None
     ):
+        """
+        Return the addresses within `radius` meters of a point.
+
+        With a `local_index`, the `k` nearest addresses within `radius`
+        can be requested as well (all of them if `k` is None).
+        """
+        if self.local_index is not None:
+            res = self.local_index.reverse(query, exactly_one=exactly_one, radius=radius, k=k)
+            return self._as_coroutine(res) if self._run_async else res
+        if k is not None:
+            raise ValueError("k is only supported with a local_index")
+
         try:
             lat, lon = self._coerce_point_to_string(query).split(',')
         except ValueError:
@@ -0,0 +1,720 @@
+import gzip
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+import unicodedata
+
+import numpy as np
+
+from geopy.point import Point
+from geopy.util import logger
+
+from geopy_batch import BatchGeocoder
+from geopy_bestaddress import parse_place, set_precision
+
+__all__ = ("BestReferenceTables", "LocalBestAddress")
+
+
+_COMBINING = re.compile("[\u0300-\u036f]")
+_SEPARATORS = re.compile("[\\s\\-]+")
+
+
+def normalize_name(name):
+    """
+    Normalize a street, municipality or postal name for lookups: case,
+    accents, hyphens and extra spaces are ignored.
+    """
+    if name is None:
+        return None
+    name = _COMBINING.sub("", unicodedata.normalize("NFKD", str(name).casefold()))
+    return _SEPARATORS.sub(" ", name).strip()
+
+
+def normalize_names(names):
+    """
+    Vectorized :func:`normalize_name`, on a pandas Series of strings.
+    """
+    names = names.astype(str).str.casefold().str.normalize("NFKD")
+    names = names.str.replace(_COMBINING, "", regex=True)
+    return names.str.replace(_SEPARATORS, " ", regex=True).str.strip()
+
+
+class BestReferenceTables:
+    """
+    Local copy of the BeST postal infos and municipalities.
+
+    Used by :class:`geopy_bestaddress.BestAddress` (``reference_tables``
+    parameter) to answer the postal info and municipality searches of the
+    geocode fallback cascade without calling the API. Searches return the
+    same ``{"items": [...]}`` structure as the API.
+
+    Usage::
+
+        tables = BestReferenceTables.load("data/best_reference.json.gz",
+                                          max_age=30*24*3600,
+                                          refresh=lambda: BestReferenceTables.from_api(ba))
+        ba = BestAddress(..., reference_tables=tables)
+    """
+
+    def __init__(self, postalinfos, municipalities, created=None):
+        """
+        :param list postalinfos: Postal info items, as returned by the API.
+
+        :param list municipalities: Municipality items, as returned by the API.
+
+        :param float created: Creation time (epoch) of the tables.
+        """
+        self.postalinfos = postalinfos
+        self.municipalities = municipalities
+        self.created = created if created is not None else time.time()
+
+        self._postalinfo_by_postcode = {}
+        self._postalinfo_by_name = {}
+        for item in postalinfos:
+            self._postalinfo_by_postcode.setdefault(str(item.get("postCode")), []).append(item)
+            for name in set(map(normalize_name, item.get("name", {}).values())):
+                self._postalinfo_by_name.setdefault(name, []).append(item)
+
+        self._municipality_by_name = {}
+        self._municipality_by_niscode = {}
+        for item in municipalities:
+            if "nisCode" in item:
+                self._municipality_by_niscode.setdefault(str(item["nisCode"]), []).append(item)
+            for name in set(map(normalize_name, item.get("name", {}).values())):
+                self._municipality_by_name.setdefault(name, []).append(item)
+
+    def search(self, object_type, params):
+        """
+        Search postal infos or municipalities, as the API would.
+
+        :param str object_type: "postalinfo" or "municipality".
+
+        :param dict params: Search parameters: "postCode" or "name" for
+            postal infos, "name" or "nisCode" for municipalities.
+
+        :return: ``{"items": [...]}``, or None if `params` can not be
+            answered locally.
+        """
+        if len(params) != 1:
+            return None
+        (key, value), = params.items()
+
+        if object_type == "postalinfo" and key == "postCode":
+            items = self._postalinfo_by_postcode.get(str(value), [])
+        elif object_type == "postalinfo" and key == "name":
+            items = self._postalinfo_by_name.get(normalize_name(value), [])
+        elif object_type == "municipality" and key == "name":
+            items = self._municipality_by_name.get(normalize_name(value), [])
+        elif object_type == "municipality" and key == "nisCode":
+            items = self._municipality_by_niscode.get(str(value), [])
+        else:
+            return None
+        return {"items": items}
+
+    @classmethod
+    def from_api(cls, geocoder, page_size=100):
+        """
+        Download all postal infos and municipalities from the BeST API, by
+        following its pagination links.
+
+        :param geocoder: A (synchronous) BestAddress geocoder.
+        """
+        return cls(list(geocoder.iter_postalinfos(page_size=page_size, raw=True)),
+                   list(geocoder.iter_municipalities(page_size=page_size, raw=True)))
+
+    @classmethod
+    def from_openaddress(cls, filenames):
+        """
+        Build the tables from BOSA openaddress-be*.zip dumps. Items only
+        contain codes and names (no API identifiers).
+
+        :param list filenames: Paths of openaddress-bevlg/bewal/bebru.zip.
+        """
+        import pandas as pd
+
+        columns = ["postcode", "postname_fr", "postname_nl",
+                   "municipality_id", "municipality_name_fr", "municipality_name_nl", "municipality_name_de"]
+        names = pd.concat([pd.read_csv(fn, usecols=columns, dtype=str).drop_duplicates()
+                           for fn in filenames]).drop_duplicates()
+
+        def lang_names(row, prefix, languages):
+            return {lg: row[f"{prefix}_{lg}"] for lg in languages if pd.notnull(row[f"{prefix}_{lg}"])}
+
+        postalinfos = [{"postCode": row.postcode, "name": lang_names(row, "postname", ["fr", "nl"])}
+                       for _, row in names[["postcode", "postname_fr", "postname_nl"]].drop_duplicates().iterrows()]
+
+        municipalities = [{"nisCode": row.municipality_id,
+                           "name": lang_names(row, "municipality_name", ["fr", "nl", "de"])}
+                          for _, row in names.drop(columns=["postcode", "postname_fr", "postname_nl"])
+                                             .drop_duplicates("municipality_id").iterrows()]
+
+        return cls(postalinfos, municipalities)
+
+    def save(self, path):
+        with gzip.open(path, "wt", encoding="utf-8") as f:
+            json.dump({"created": self.created,
+                       "postalinfos": self.postalinfos,
+                       "municipalities": self.municipalities}, f)
+
+    @classmethod
+    def load(cls, path, max_age=None, refresh=None):
+        """
+        Load tables saved by :meth:`save`.
+
+        :param str path: File written by :meth:`save`.
+
+        :param float max_age: Maximum age, in seconds, of the tables. Older
+            (or missing) tables are rebuilt with `refresh` and saved.
+
+        :param callable refresh: Function without arguments returning new
+            tables, e.g. ``lambda: BestReferenceTables.from_api(ba)``.
+        """
+        tables = None
+        if os.path.exists(path):
+            with gzip.open(path, "rt", encoding="utf-8") as f:
+                data = json.load(f)
+            tables = cls(data["postalinfos"], data["municipalities"], created=data["created"])
+
+        if tables is None or (max_age is not None and tables.created < time.time() - max_age):
+            if refresh is not None:
+                tables = refresh()
+                tables.save(path)
+            elif tables is None:
+                raise FileNotFoundError(path)
+            else:
+                logger.warning("%s is older than max_age, but no refresh function is given", path)
+        return tables
+
+
+def _hash_key(key):
+    # 64 bits hash of a key string (the same at build and lookup time)
+    return np.uint64(int.from_bytes(hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest(), "little"))
+
+
+def _hash_keys(keys):
+    # _hash_key of an iterable of key strings
+    return np.frombuffer(b"".join(hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest() for key in keys),
+                         dtype="<u8").astype(np.uint64)
+
+
+def _building_keys(postcode, street, housenumber, box):
+    return postcode + "|" + street + "|" + housenumber + "|" + box
+
+
+def _normalize_number(numbers):
+    # House and box numbers: "20 A" -> "20a"
+    return numbers.fillna("").astype(str).str.casefold().str.replace(r"\s+", "", regex=True)
+
+
+def _is_missing(value):
+    return value is None or (isinstance(value, float) and value != value)
+
+
+def _normalize_scalar_number(number):
+    # _normalize_number of one value
+    return "" if _is_missing(number) else "".join(str(number).casefold().split())
+
+
+class _Dictionary:
+    # Incremental categorical encoding of string values, chunk after chunk
+    def __init__(self):
+        self.values = []
+        self._codes = {}
+
+    def encode(self, series):
+        import pandas as pd
+        codes, uniques = pd.factorize(series, use_na_sentinel=False)
+        mapping = np.empty(len(uniques), dtype=np.int32)
+        for i, value in enumerate(uniques):
+            value = "" if pd.isnull(value) else value
+            if value not in self._codes:
+                self._codes[value] = len(self.values)
+                self.values.append(value)
+            mapping[i] = self._codes[value]
+        return mapping[codes]
+
+
+class LocalBestAddress(BatchGeocoder):
+    """
+    Offline BeST geocoder, built from the BOSA openaddress-be*.zip dumps.
+
+    Same ``geocode``/``reverse``/``get_by_id`` surface and ``precision``
+    semantics as :class:`geopy_bestaddress.BestAddress`, but answered from
+    an on-disk index. The index is a directory of numpy arrays, memory-mapped
+    at load time:
+
+    - address columns, dictionary-encoded (street, municipality, postal
+      names, house and box numbers) or as plain arrays (coordinates);
+    - sorted 64 bits hashes of (postcode, normalized street name in
+      fr/nl/de, house number, box number), and of (postcode, street name)
+      for the street level;
+    - sorted hashes of address ids, for ``get_by_id``;
+    - Lambert 72 (EPSG:31370) coordinates, from which a KD-tree is built at
+      the first ``reverse`` call (requires scipy and pyproj).
+
+    The city-level cascade levels use :class:`BestReferenceTables` built
+    from the same dumps.
+
+    Usage::
+
+        LocalBestAddress.build(["openaddress-bevlg.zip", ...], "data/best_index")
+        geocoder = LocalBestAddress("data/best_index")
+        geocoder.geocode({"street": ..., "housenumber": ..., "postcode": ..., "city": ...})
+        geocoder.geocode_batch(df)
+        geocoder.reverse((50.84, 4.36))
+        ids, distances = geocoder.reverse_many(lat_array, lon_array)
+    """
+
+    # Not a geopy Geocoder: no HTTP adapter (used by BatchGeocoder)
+    adapter = None
+
+    index_version = 3
+
+    _columns = ["address_id", "postcode", "house_number", "box_number",
+                "streetname_fr", "streetname_nl", "streetname_de",
+                "municipality_id", "municipality_name_fr", "municipality_name_nl", "municipality_name_de",
+                "postname_fr", "postname_nl",
+                "EPSG:4326_lat", "EPSG:4326_lon", "EPSG:31370_x", "EPSG:31370_y", "status"]
+
+    _dictionaries = ["postcode", "house_number", "box_number", "street", "municipality", "postname"]
+
+    def __init__(self, index_dir):
+        """
+        :param str index_dir: Directory written by :meth:`build`.
+        """
+        self.index_dir = index_dir
+        with open(os.path.join(index_dir, "meta.json"), encoding="utf-8") as f:
+            meta = json.load(f)
+        if meta["version"] != self.index_version:
+            raise ValueError(f"Index version {meta['version']} is not supported, rebuild {index_dir}")
+
+        self.dictionaries = meta["dictionaries"]
+        self.arrays = {name: np.load(os.path.join(index_dir, f"{name}.npy"), mmap_mode="r")
+                       for name in meta["arrays"]}
+        self.reference_tables = BestReferenceTables.load(os.path.join(index_dir, "reference.json.gz"))
+
+        self._tree = None
+        self._tree_lock = threading.Lock()
+        self._transformer = None
+        self._normalized = None
+
+    @classmethod
+    def build(cls, filenames, index_dir, statuses=("current", ), chunksize=500000):
+        """
+        Build the index from openaddress dumps.
+
+        :param list filenames: Paths of openaddress-bevlg/bewal/bebru.zip.
+
+        :param str index_dir: Output directory.
+
+        :param statuses: Address statuses to keep.
+
+        :param int chunksize: Number of rows read at once.
+        """
+        import pandas as pd
+
+        os.makedirs(index_dir, exist_ok=True)
+
+        dictionaries = {name: _Dictionary() for name in cls._dictionaries}
+        columns = {name: [] for name in ["lat", "lon", "x", "y", "address_id_len"] + [f"{name}_code" for name in cls._dictionaries]}
+        address_ids = []
+        building_keys, building_rows, building_priority = [], [], []
+        street_keys, street_rows, street_priority = [], [], []
+
+        n_rows = 0
+        for fn in filenames:
+            for chunk in pd.read_csv(fn, usecols=cls._columns, dtype=str, chunksize=chunksize):
+                chunk = chunk[chunk.status.isin(statuses)]
+                rows = np.arange(n_rows, n_rows + chunk.shape[0], dtype=np.int64)
+                n_rows += chunk.shape[0]
+
+                columns["lat"].append(chunk["EPSG:4326_lat"].astype(float).values)
+                columns["lon"].append(chunk["EPSG:4326_lon"].astype(float).values)
+                columns["x"].append(chunk["EPSG:31370_x"].astype(float).values)
+                columns["y"].append(chunk["EPSG:31370_y"].astype(float).values)
+
+                ids = chunk.address_id.fillna("").str.encode("utf-8")
+                columns["address_id_len"].append(ids.str.len().values)
+                address_ids.append(np.frombuffer(b"".join(ids), dtype=np.uint8))
+
+                joined = {"street":       ["streetname_fr", "streetname_nl", "streetname_de"],
+                          "municipality": ["municipality_name_fr", "municipality_name_nl", "municipality_name_de", "municipality_id"],
+                          "postname":     ["postname_fr", "postname_nl"]}
+                for name in cls._dictionaries:
+                    if name in joined:
+                        values = chunk[joined[name]].fillna("").agg("\x1f".join, axis=1)
+                    else:
+                        values = chunk[name]
+                    columns[f"{name}_code"].append(dictionaries[name].encode(values))
+
+                postcode = chunk.postcode.fillna("")
+                housenumber = _normalize_number(chunk.house_number)
+                box = _normalize_number(chunk.box_number)
+                house_number_num = pd.to_numeric(chunk.house_number.str.extract("^([0-9]+)", expand=False),
+                                                 errors="coerce").fillna(10**9).astype(np.int64).values
+
+                for lg in ["fr", "nl", "de"]:
+                    has_name = chunk[f"streetname_{lg}"].notnull().values
+                    street = normalize_names(chunk[f"streetname_{lg}"].fillna(""))
+                    # Exact box, and "no box" pointing to the address without box, or else to any box
+                    for key_box, priority in [(box, 0), ("", (box != "").astype(int).values)]:
+                        building_keys.append(_hash_keys(_building_keys(postcode, street, housenumber, key_box))[has_name])
+                        building_rows.append(rows[has_name])
+                        building_priority.append(np.broadcast_to(priority, rows.shape)[has_name])
+                    # Street level: first house number of the street
+                    street_keys.append(_hash_keys(_building_keys(postcode, street, "", ""))[has_name])
+                    street_rows.append(rows[has_name])
+                    street_priority.append(house_number_num[has_name])
+
+        def sorted_index(keys, rows, priority):
+            keys, rows, priority = np.concatenate(keys), np.concatenate(rows), np.concatenate(priority)
+            order = np.lexsort((rows, priority, keys))
+            keys, rows = keys[order], rows[order]
+            first = np.ones(keys.shape[0], dtype=bool)
+            first[1:] = keys[1:] != keys[:-1]
+            return keys[first], rows[first]
+
+        arrays = {name: np.concatenate(values) for name, values in columns.items()}
+        arrays["address_id_data"] = np.concatenate(address_ids)
+        arrays["address_id_offsets"] = np.concatenate([[0], np.cumsum(arrays.pop("address_id_len"))]).astype(np.int64)
+        arrays["building_keys"], arrays["building_rows"] = sorted_index(building_keys, building_rows, building_priority)
+        arrays["street_keys"], arrays["street_rows"] = sorted_index(street_keys, street_rows, street_priority)
+
+        id_data, id_offsets = arrays["address_id_data"], arrays["address_id_offsets"]
+        id_hashes = _hash_keys([bytes(id_data[id_offsets[i]:id_offsets[i+1]]).decode("utf-8") for i in range(n_rows)])
+        order = np.argsort(id_hashes, kind="stable")
+        arrays["id_keys"], arrays["id_rows"] = id_hashes[order], order.astype(np.int64)
+
+        for name, values in arrays.items():
+            np.save(os.path.join(index_dir, f"{name}.npy"), values)
+
+        BestReferenceTables.from_openaddress(filenames).save(os.path.join(index_dir, "reference.json.gz"))
+
+        with open(os.path.join(index_dir, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump({"version": cls.index_version,
+                       "rows": n_rows,
+                       "arrays": sorted(arrays),
+                       "dictionaries": {name: d.values for name, d in dictionaries.items()}}, f)
+
+    def __len__(self):
+        return self.arrays["lat"].shape[0]
+
+    def _lookup(self, index, hashes):
+        # Row of each hash in a sorted index (-1 if missing)
+        keys = self.arrays[f"{index}_keys"]
+        pos = np.searchsorted(keys, hashes)
+        pos_ok = np.minimum(pos, len(keys) - 1)
+        found = (pos < len(keys)) & (keys[pos_ok] == hashes)
+        return np.where(found, self.arrays[f"{index}_rows"][pos_ok], -1)
+
+    def _lookup_one(self, index, key):
+        # _lookup of one key string, without array overhead
+        keys = self.arrays[f"{index}_keys"]
+        h = _hash_key(key)
+        pos = int(keys.searchsorted(h))
+        if pos < len(keys) and keys[pos] == h:
+            return int(self.arrays[f"{index}_rows"][pos])
+        return -1
+
+    def _normalized_dictionaries(self):
+        # Dictionary values as in the index keys, to check the rows found
+        # by hash: postcodes, house and box numbers, and street names (one
+        # array per language)
+        if self._normalized is None:
+            import pandas as pd
+            street_names = [(names.split("\x1f") + ["", "", ""])[:3] for names in self.dictionaries["street"]]
+            self._normalized = {
+                "postcode": np.array(self.dictionaries["postcode"], dtype=object),
+                "house_number": _normalize_number(pd.Series(self.dictionaries["house_number"], dtype=object))
+                .to_numpy(dtype=object),
+                "box_number": _normalize_number(pd.Series(self.dictionaries["box_number"], dtype=object))
+                .to_numpy(dtype=object),
+                "street": [np.array([normalize_name(names[i]) if names[i] else None for names in street_names],
+                                    dtype=object) for i in range(3)],
+            }
+        return self._normalized
+
+    def _check_rows(self, rows, postcode, street, housenumber=None, box=None):
+        # Rows found by hash whose fields are those of the key (a 64 bits
+        # hash may collide); -1 for the others. With a box "", any box
+        # matches (see build)
+        normalized = self._normalized_dictionaries()
+        found = rows >= 0
+        r = np.where(found, rows, 0)
+        ok = found & (normalized["postcode"][self.arrays["postcode_code"][r]] == postcode)
+        street_codes = self.arrays["street_code"][r]
+        ok &= np.logical_or.reduce([names[street_codes] == street for names in normalized["street"]])
+        if housenumber is not None:
+            ok &= normalized["house_number"][self.arrays["house_number_code"][r]] == housenumber
+            ok &= (box == "") | (normalized["box_number"][self.arrays["box_number_code"][r]] == box)
+        return np.where(ok, rows, -1)
+
+    def _address_id(self, row):
+        offsets = self.arrays["address_id_offsets"]
+        return bytes(self.arrays["address_id_data"][offsets[row]:offsets[row+1]]).decode("utf-8")
+
+    def _names(self, dictionary, row, languages):
+        values = self.dictionaries[dictionary][self.arrays[f"{dictionary}_code"][row]].split("\x1f")
+        return {lg: v for lg, v in zip(languages, values) if v}
+
+    def _place(self, row):
+        # Address resource, in the structure of the BeST API
+        place = {"id": self._address_id(row),
+                 "houseNumber": self.dictionaries["house_number"][self.arrays["house_number_code"][row]],
+                 "hasStreetName": {"name": self._names("street", row, ["fr", "nl", "de"])},
+                 "hasMunicipality": {"name": self._names("municipality", row, ["fr", "nl", "de"])},
+                 "hasPostalInfo": {"postCode": self.dictionaries["postcode"][self.arrays["postcode_code"][row]],
+                                   "name": self._names("postname", row, ["fr", "nl"])},
+                 "addressPosition": {"wgs84": {"lat": float(self.arrays["lat"][row]),
+                                               "long": float(self.arrays["lon"][row])}}}
+        box = self.dictionaries["box_number"][self.arrays["box_number_code"][row]]
+        if box:
+            place["boxNumber"] = box
+        return place
+
+    def _query_frame(self, df, street, housenumber, postcode, box):
+        import pandas as pd
+        street = normalize_names(df[street].fillna(""))
+        postcode = df[postcode].fillna("").astype(str).str.strip()
+        housenumber = _normalize_number(df[housenumber])
+        box = _normalize_number(df[box]) if box in df else pd.Series("", index=df.index)
+        return postcode.to_numpy(dtype=object), street.to_numpy(dtype=object), \
+            housenumber.to_numpy(dtype=object), box.to_numpy(dtype=object)
+
+    def _rows(self, df, street, housenumber, postcode, box="box"):
+        postcode, street, housenumber, box = self._query_frame(df, street, housenumber, postcode, box)
+        building_rows = self._lookup("building", _hash_keys(_building_keys(postcode, street, housenumber, box)))
+        street_rows = self._lookup("street", _hash_keys(_building_keys(postcode, street, "", "")))
+        return (self._check_rows(building_rows, postcode, street, housenumber, box),
+                self._check_rows(street_rows, postcode, street))
+
+    def _rows_one(self, query):
+        # _rows of one structured query
+        postcode = query.get("postcode")
+        postcode = "" if _is_missing(postcode) else str(postcode).strip()
+        street = query.get("street")
+        street = "" if _is_missing(street) else normalize_name(street)
+        housenumber = _normalize_scalar_number(query.get("housenumber"))
+        box = _normalize_scalar_number(query.get("box"))
+
+        rows = []
+        for index, key, fields in [("building", _building_keys(postcode, street, housenumber, box), (housenumber, box)),
+                                   ("street", _building_keys(postcode, street, "", ""), ())]:
+            row = self._lookup_one(index, key)
+            if row >= 0 and not self._row_matches(row, postcode, street, *fields):
+                row = -1
+            rows.append(row)
+        return rows
+
+    def _row_matches(self, row, postcode, street, housenumber=None, box=None):
+        # _check_rows of one row
+        normalized = self._normalized_dictionaries()
+        if normalized["postcode"][self.arrays["postcode_code"][row]] != postcode:
+            return False
+        street_code = self.arrays["street_code"][row]
+        if not any(names[street_code] == street for names in normalized["street"]):
+            return False
+        if housenumber is None:
+            return True
+        return (normalized["house_number"][self.arrays["house_number_code"][row]] == housenumber
+                and (box == "" or normalized["box_number"][self.arrays["box_number_code"][row]] == box))
+
+    def geocode(self, query, *, exactly_one=True, return_raw=False, **kwargs):
+        """
+        Return a location point by address, with the fallback cascade of
+        :meth:`geopy_bestaddress.BestAddress.geocode`.
+
+        A single query is looked up directly in the memory-mapped index
+        (no DataFrame); use :meth:`geocode_batch` for many queries at once.
+
+        :param dict query: Structured query with keys `street`,
+            `housenumber`, `postcode` and `city` (and optionally `box`).
+
+        :param bool exactly_one: Return one result or a list of results.
+            Address and street levels give a single result.
+
+        :param bool return_raw: Return the ``{"items": [...]}`` structure
+            of the API instead of Location objects.
+        """
+        building_row, street_row = self._rows_one(query)
+
+        for level, (row, precision) in enumerate([(building_row, "building"), (street_row, "street")]):
+            if row >= 0:
+                places = {"items": [self._place(row)]}
+                return self._result(places, precision, level, exactly_one, return_raw)
+
+        for level, (object_type, params) in enumerate([("postalinfo", {"postCode": query["postcode"]}),
+                                                       ("postalinfo", {"name": query["city"]}),
+                                                       ("municipality", {"name": query["city"]})], start=2):
+            places = self.reference_tables.search(object_type, params)
+            if places["items"]:
+                return self._result(places, "city", level, exactly_one, return_raw)
+        return None
+
+    def _result(self, places, precision, level, exactly_one, return_raw):
+        if return_raw:
+            return places
+        if exactly_one:
+            res = parse_place(places["items"][0])
+        else:
+            res = [parse_place(place) for place in places["items"]]
+        set_precision(res, precision, level)
+        return res
+
+    def get_by_id(self, id, object_type="address"):
+        if object_type != "address":
+            return {"error": f"Unknown object_type value '{object_type}'. Only 'address' is available locally"}
+        row = self._lookup_one("id", id)
+        if row < 0 or self._address_id(row) != id:
+            return None
+        return self._place(row)
+
+    def geocode_batch(self, df, street="street", housenumber="housenumber", postcode="postcode", city="city", box="box"):
+        """
+        Geocode all rows of a DataFrame at once (vectorized).
+
+        :param df: :class:`pandas.DataFrame` with one address per row.
+
+        :param str street, housenumber, postcode, city, box: Column names.
+            `box` is optional.
+
+        :return: DataFrame with the same index as `df`, and columns `lat`,
+            `lon`, `precision`, `cascade_level`, `address_id` and `address`
+            (None above the street level).
+        """
+        import pandas as pd
+        building_rows, street_rows = self._rows(df, street, housenumber, postcode, box)
+
+        rows = np.where(building_rows >= 0, building_rows, street_rows)
+        level = np.where(building_rows >= 0, 0, np.where(street_rows >= 0, 1, -1))
+        found = rows >= 0
+
+        lat = np.full(len(df), np.nan)
+        lon = np.full(len(df), np.nan)
+        lat[found] = self.arrays["lat"][rows[found]]
+        lon[found] = self.arrays["lon"][rows[found]]
+        address_id = np.full(len(df), None, dtype=object)
+        address_id[found] = [self._address_id(r) for r in rows[found]]
+        address = np.full(len(df), None, dtype=object)
+        address[found] = [parse_place(self._place(r)).address for r in rows[found]]
+
+        # City level: one lookup per distinct (postcode, city)
+        missing = df.loc[~found, [postcode, city]]
+        for (pc, cty), idx in missing.groupby([postcode, city], dropna=False).indices.items():
+            for city_level, (object_type, params) in enumerate([("postalinfo", {"postCode": pc}),
+                                                                ("postalinfo", {"name": cty}),
+                                                                ("municipality", {"name": cty})], start=2):
+                if self.reference_tables.search(object_type, params)["items"]:
+                    positions = np.flatnonzero(~found)[idx]
+                    level[positions] = city_level
+                    lat[positions] = 0
+                    lon[positions] = 0
+                    break
+
+        precision = np.array([None, "building", "street", "city", "city", "city"], dtype=object)[level + 1]
+        return pd.DataFrame({"lat": lat, "lon": lon, "precision": precision,
+                             "cascade_level": np.where(level >= 0, level, np.nan),
+                             "address_id": address_id, "address": address}, index=df.index)
+
+    def _spatial_index(self):
+        # KD-tree on Lambert 72 coordinates, built once (a few seconds for
+        # the whole country)
+        with self._tree_lock:
+            if self._tree is None:
+                from scipy.spatial import cKDTree
+                from pyproj import Transformer
+                points = np.column_stack([self.arrays["x"], self.arrays["y"]])
+                self._tree = cKDTree(points)
+                self._transformer = Transformer.from_crs("EPSG:4326", "EPSG:31370", always_xy=True)
+        return self._tree
+
+    def _project(self, lat, lon):
+        self._spatial_index()
+        return self._transformer.transform(np.asarray(lon, dtype=float), np.asarray(lat, dtype=float))
+
+    def reverse(self, query, *, exactly_one=True, radius=15, k=None, return_raw=False, **kwargs):
+        """
+        Return the addresses around a point, closest first.
+
+        :param query: The coordinates, as accepted by
+            :meth:`geopy_bestaddress.BestAddress.reverse`.
+
+        :param bool exactly_one: Return the closest address, or a list.
+
+        :param float radius: Search radius, in meters. None means no limit
+            (only with `k`).
+
+        :param int k: If given, at most the `k` nearest addresses within
+            `radius`. Otherwise, all addresses within `radius`.
+
+        :param bool return_raw: Return the ``{"items": [...]}`` structure of
+            the API instead of Location objects.
+        """
+        if radius is None and k is None:
+            raise ValueError("At least one of radius and k must be given")
+        point = Point(query)
+        x, y = self._project(point.latitude, point.longitude)
+        tree = self._spatial_index()
+
+        if k is None:
+            rows = np.asarray(tree.query_ball_point([x, y], r=radius), dtype=np.int64)
+            distances = np.hypot(self.arrays["x"][rows] - x, self.arrays["y"][rows] - y)
+            rows = rows[np.argsort(distances, kind="stable")]
+        else:
+            distances, rows = tree.query([x, y], k=[i+1 for i in range(k)],
+                                         distance_upper_bound=np.inf if radius is None else radius)
+            rows = rows[np.isfinite(distances)]
+
+        if len(rows) == 0:
+            return None
+        places = {"items": [self._place(row) for row in rows]}
+        if return_raw:
+            return places
+        if exactly_one:
+            return parse_place(places["items"][0])
+        return [parse_place(place) for place in places["items"]]
+
+    def reverse_many(self, lat, lon, radius=None, k=1):
+        """
+        Vectorized reverse geocoding of arrays of points.
+
+        :param lat, lon: Arrays of WGS84 coordinates.
+
+        :param float radius: Maximum distance, in meters. None means no
+            limit.
+
+        :param int k: Number of neighbours per point.
+
+        :return: ``(address_ids, distances)``, arrays of shape ``(n, )``
+            if ``k == 1``, ``(n, k)`` otherwise. Where no address is found,
+            the id is None and the distance is inf.
+        """
+        x, y = self._project(lat, lon)
+        tree = self._spatial_index()
+        distances, rows = tree.query(np.column_stack([np.atleast_1d(x), np.atleast_1d(y)]), k=k,
+                                     distance_upper_bound=np.inf if radius is None else radius,
+                                     workers=-1)
+        found = np.isfinite(distances)
+        address_ids = np.full(rows.shape, None, dtype=object)
+        address_ids[found] = [self._address_id(row) for row in rows[found]]
+        return address_ids, distances
+
+    def street_aliases(self):
+        """
+        Mapping from ``"<postcode>|<normalized street name>"``, for every
+        language variant of a street name, to the normalized name of the
+        street in its first language (fr, then nl, then de). Used to
+        collapse fr/nl variants of the same address (see
+        :func:`geopy_dataframe.geocode_dataframe`).
+        """
+        pairs = np.unique(np.column_stack([self.arrays["postcode_code"], self.arrays["street_code"]]), axis=0)
+        aliases = {}
+        for postcode_code, street_code in pairs:
+            postcode = self.dictionaries["postcode"][postcode_code]
+            names = [normalize_name(name) for name in self.dictionaries["street"][street_code].split("\x1f") if name]
+            for name in names:
+                aliases[f"{postcode}|{name}"] = names[0]
+        return aliases
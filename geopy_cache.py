@@ -0,0 +1,331 @@
+import collections
+import hashlib
+import inspect
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from geopy.adapters import BaseAsyncAdapter
+from geopy.location import Location
+
+from geopy_batch import BatchGeocoder
+
+__all__ = ("ResultStore", "LRUCache", "CachedGeocoder")
+
+
+_MISSING = object()
+
+
+class ResultStore:
+    """
+    Persistent key/value store of JSON values, backed by SQLite.
+
+    Entries older than ``ttl`` seconds are ignored and purged; when the
+    store holds more than ``max_entries`` entries, the oldest ones are
+    evicted. The database is opened in WAL mode with one connection per
+    thread, so that several threads and worker processes can share it.
+    """
+
+    # Eviction is checked every `evict_every` writes of this process
+    evict_every = 1000
+
+    def __init__(self, path, *, ttl=None, max_entries=None, timeout=30):
+        """
+        :param str path: SQLite database file. Created if needed.
+
+        :param float ttl: Time to live of an entry, in seconds. None means
+            no expiry.
+
+        :param int max_entries: Maximum number of entries kept. None means
+            no limit.
+
+        :param float timeout: Time, in seconds, to wait for a lock held by
+            another process.
+        """
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.timeout = timeout
+
+        self._local = threading.local()
+        self._writes = 0
+        self._writes_lock = threading.Lock()
+
+        dirname = os.path.dirname(path)
+        if dirname:
+            os.makedirs(dirname, exist_ok=True)
+
+        with self._connection() as conn:
+            conn.execute("""CREATE TABLE IF NOT EXISTS results (
+                                key     TEXT PRIMARY KEY,
+                                value   TEXT,
+                                created REAL)""")
+            conn.execute("CREATE INDEX IF NOT EXISTS results_created ON results(created)")
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        # A connection must not be shared with a forked worker process
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=self.timeout)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def get(self, key, default=None):
+        """
+        Return the value stored for `key`, or `default` if there is no
+        (valid) entry.
+        """
+        row = self._connection().execute("SELECT value, created FROM results WHERE key=?", (key, )).fetchone()
+        if row is None:
+            return default
+        value, created = row
+        if self.ttl is not None and created < time.time() - self.ttl:
+            return default
+        return json.loads(value)
+
+    def set(self, key, value):
+        with self._connection() as conn:
+            conn.execute("INSERT OR REPLACE INTO results(key, value, created) VALUES (?, ?, ?)",
+                         (key, json.dumps(value), time.time()))
+        with self._writes_lock:
+            self._writes += 1
+            evict = self._writes % self.evict_every == 0
+        if evict:
+            self.evict()
+
+    def evict(self):
+        """
+        Remove expired entries, and the oldest ones above `max_entries`.
+        """
+        with self._connection() as conn:
+            if self.ttl is not None:
+                conn.execute("DELETE FROM results WHERE created < ?", (time.time() - self.ttl, ))
+            if self.max_entries is not None:
+                conn.execute("""DELETE FROM results WHERE key IN (
+                                    SELECT key FROM results ORDER BY created DESC LIMIT -1 OFFSET ?)""",
+                             (self.max_entries, ))
+
+    def __len__(self):
+        return self._connection().execute("SELECT COUNT(*) FROM results").fetchone()[0]
+
+    def close(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+class LRUCache:
+    """
+    In-memory key/value store with the interface of :class:`ResultStore`,
+    keeping the `maxsize` most recently used entries.
+    """
+
+    def __init__(self, maxsize=10000):
+        self.maxsize = maxsize
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                self._entries.move_to_end(key)
+            except KeyError:
+                return default
+            return self._entries[key]
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            if len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def close(self):
+        pass
+
+
+def _normalize_value(value):
+    if value is None:
+        return None
+    return " ".join(str(value).split()).casefold()
+
+
+def normalize_query(query):
+    """
+    Normalized form of a query (string or structured): values are
+    converted to strings, case-folded and whitespace is collapsed.
+    """
+    if isinstance(query, dict):
+        return {k: _normalize_value(v) for k, v in sorted(query.items())}
+    if isinstance(query, (list, tuple)): # Coordinates
+        return [str(v) for v in query]
+    return _normalize_value(query)
+
+
+def _dump_result(res):
+    if res is None:
+        return None
+    if isinstance(res, Location):
+        return {"address": res.address, "point": list(res.point), "raw": res.raw}
+    if isinstance(res, list):
+        return [_dump_result(r) for r in res]
+    return {"raw_response": res}  # return_raw=True
+
+
+def _load_result(dump):
+    if dump is None:
+        return None
+    if isinstance(dump, list):
+        return [_load_result(d) for d in dump]
+    if "raw_response" in dump:
+        return dump["raw_response"]
+    return Location(dump["address"], dump["point"], dump["raw"])
+
+
+class CachedGeocoder(BatchGeocoder):
+    """
+    Wrap a geocoder (BestAddress, Pelias, NominatimWrapper...) with a
+    persistent cache of its results.
+
+    Results (including empty ones) are stored as JSON in a
+    :class:`ResultStore`, keyed on the provider, its parameters, the method,
+    the normalized query and the call arguments (those left to their
+    default value are ignored). Other attributes and methods are delegated
+    to the wrapped geocoder.
+
+    Usage::
+
+        geocoder = CachedGeocoder(BestAddress(...), path="cache/best.sqlite")
+        geocoder.geocode({"street": ..., "housenumber": ..., ...})
+        geocoder.stats()
+    """
+
+    # Attributes of the wrapped geocoders which change their results
+    provider_params = ("scheme", "domain", "prefix", "withExtraHouseNumber", "with_localities")
+
+    # Call arguments which don't change the result
+    ignored_kwargs = ("timeout", )
+
+    def __init__(self, geocoder, store=None, *, path=None, ttl=None, max_entries=None, negative_ttl=None):
+        """
+        :param geocoder: Geocoder to wrap.
+
+        :param store: A :class:`ResultStore`. If None, one is created from
+            `path`, `ttl` and `max_entries`.
+
+        :param float negative_ttl: Time to live, in seconds, of the empty
+            results (an address may be added to the reference later). None
+            means the same expiry as the other results.
+        """
+        self.geocoder = geocoder
+        self.store = store if store is not None else ResultStore(path, ttl=ttl, max_entries=max_entries)
+        self.negative_ttl = negative_ttl
+        self._defaults = {}
+
+        self.provider = {"provider": type(geocoder).__name__}
+        for param in self.provider_params:
+            if hasattr(geocoder, param):
+                self.provider[param] = getattr(geocoder, param)
+
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name):
+        return getattr(self.geocoder, name)
+
+    @property
+    def max_workers_cap(self):
+        return getattr(self.geocoder, "max_workers_cap", None)
+
+    def _method_defaults(self, method):
+        # Default values of the keyword arguments of a method of the geocoder
+        defaults = self._defaults.get(method)
+        if defaults is None:
+            try:
+                parameters = inspect.signature(getattr(self.geocoder, method)).parameters.values()
+            except (TypeError, ValueError):
+                parameters = []
+            defaults = {p.name: p.default for p in parameters if p.default is not inspect.Parameter.empty}
+            self._defaults[method] = defaults
+        return defaults
+
+    def _key(self, method, query, kwargs):
+        # geocode(q) and geocode(q, exactly_one=True) share the same entry
+        defaults = self._method_defaults(method)
+        kwargs = {k: v for k, v in kwargs.items()
+                  if k not in self.ignored_kwargs and not (k in defaults and defaults[k] == v)}
+        key = json.dumps([self.provider, method, normalize_query(query), kwargs], sort_keys=True, default=str)
+        return hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+    def _count(self, hit):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def _dump(self, res):
+        # Empty results are stored with their creation time, checked against
+        # negative_ttl
+        if res is None or (isinstance(res, list) and not res):
+            return {"negative": _dump_result(res), "created": time.time()}
+        return _dump_result(res)
+
+    def _get(self, key):
+        dump = self.store.get(key, _MISSING)
+        if isinstance(dump, dict) and "negative" in dump:
+            if self.negative_ttl is not None and dump["created"] < time.time() - self.negative_ttl:
+                return _MISSING
+            return dump["negative"]
+        return dump
+
+    def _cached_call(self, method, query, kwargs):
+        key = self._key(method, query, kwargs)
+        dump = self._get(key)
+        if dump is not _MISSING:
+            self._count(True)
+            res = _load_result(dump)
+            if isinstance(self.geocoder.adapter, BaseAsyncAdapter):
+                return self._as_coroutine(res)
+            return res
+
+        self._count(False)
+        res = getattr(self.geocoder, method)(query, **kwargs)
+        if inspect.isawaitable(res):
+            return self._store_async(key, res)
+        self.store.set(key, self._dump(res))
+        return res
+
+    async def _as_coroutine(self, res):
+        return res
+
+    async def _store_async(self, key, res):
+        res = await res
+        self.store.set(key, self._dump(res))
+        return res
+
+    def geocode(self, query, **kwargs):
+        return self._cached_call("geocode", query, kwargs)
+
+    def reverse(self, query, **kwargs):
+        return self._cached_call("reverse", query, kwargs)
+
+    def stats(self):
+        """
+        Cache hit/miss counters of this instance.
+        """
+        calls = self.hits + self.misses
+        return {"hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / calls if calls else None,
+                "entries": len(self.store)}
@@ -0,0 +1,182 @@
+import re
+
+import numpy as np
+import pandas as pd
+from geopy.util import logger
+
+from geopy_bestaddress_local import normalize_names
+from geopy_results import result_id, result_precision
+
+__all__ = ("geocode_dataframe", "normalize_streets", "query_keys")
+
+
+# Usual abbreviations of street types, expanded before comparing and sending
+# queries
+ABBREVIATIONS = [
+    (r"^r\.?\s+",                   "rue "),
+    (r"^av(e|\.)?\.?\s+",           "avenue "),
+    (r"^(bd|boul|bvd)\.?\s+",       "boulevard "),
+    (r"^(chée|chee|chss?)\.?\s+",   "chaussée "),  # not "ch.", also used for "chemin"
+    (r"^pl\.?\s+",                  "place "),
+    (r"^sq\.?\s+",                  "square "),
+    (r"^imp\.?\s+",                 "impasse "),
+    (r"str\.?$",                    "straat"),
+    (r"(stwg|stwg\.|steenw\.?)$",   "steenweg"),
+    (r"\bln\.?$",                   "laan"),
+    (r"\bpln\.?$",                  "plein"),
+]
+_ABBREVIATIONS = [(re.compile(pattern, re.IGNORECASE), repl) for pattern, repl in ABBREVIATIONS]
+
+_SPACES = re.compile(r"\s+")
+
+DEFAULT_COLUMNS = {"street": "street", "housenumber": "housenumber", "postcode": "postcode", "city": "city"}
+
+
+def _clean(values):
+    # Strings with collapsed spaces; missing values become ""
+    return values.astype("string").fillna("").str.replace(_SPACES, " ", regex=True).str.strip().astype(object)
+
+
+def normalize_streets(streets):
+    """
+    Expand the usual abbreviations of street types ("R." -> "rue",
+    "Av." -> "avenue", "Kerkstr." -> "Kerkstraat"...) in a Series of street
+    names, and collapse extra spaces. Case is kept.
+    """
+    streets = _clean(streets)
+    for pattern, repl in _ABBREVIATIONS:
+        streets = streets.str.replace(pattern, repl, regex=True)
+    return streets
+
+
+def query_keys(df, columns=None, aliases=None):
+    """
+    Canonical key of the query in each row of `df`: two rows with the same
+    key are the same address up to case, accents, spacing, abbreviations
+    and (with `aliases`) the language of the street name.
+
+    :param df: :class:`pandas.DataFrame`.
+
+    :param dict columns: Mapping from the query keys (street, housenumber,
+        postcode, city) to the columns of `df`.
+
+    :param dict aliases: Mapping from ``"<postcode>|<normalized street>"``
+        to a canonical street name, as built by
+        :meth:`geopy_bestaddress_local.LocalBestAddress.street_aliases`.
+
+    :return: Series of strings, with the index of `df`.
+    """
+    columns = DEFAULT_COLUMNS if columns is None else columns
+    parts = {}
+    for key, col in columns.items():
+        values = normalize_streets(df[col]) if key == "street" else _clean(df[col])
+        parts[key] = normalize_names(values)
+
+    if aliases is not None and "street" in parts and "postcode" in parts:
+        canonical = (parts["postcode"] + "|" + parts["street"]).map(aliases)
+        parts["street"] = canonical.fillna(parts["street"])
+
+    if "housenumber" in parts:
+        parts["housenumber"] = parts["housenumber"].str.replace(" ", "", regex=False)
+
+    keys = None
+    for key in columns:
+        keys = parts[key] if keys is None else keys + "\x1f" + parts[key]
+    return keys
+
+
+def _geocode_each(geocoder, queries, kwargs):
+    # Sequential version of BatchGeocoder.geocode_many
+    for i, query in enumerate(queries):
+        try:
+            yield i, geocoder.geocode(query, **kwargs), None
+        except Exception as e:
+            yield i, None, e
+
+
+def geocode_dataframe(df, geocoder, columns=None, *, max_workers=1, aliases=None, **kwargs):
+    """
+    Geocode the addresses of a DataFrame, calling the geocoder only once per
+    distinct address.
+
+    Rows are normalized into a canonical key (see :func:`query_keys`); each
+    distinct key is geocoded once, with the (abbreviation-expanded) values
+    of its first row, and the results are broadcast back to all rows.
+
+    If the geocoder has a ``geocode_batch`` method
+    (:class:`geopy_bestaddress_local.LocalBestAddress`), all distinct
+    queries are sent to it at once.
+
+    :param df: :class:`pandas.DataFrame` with one address per row.
+
+    :param geocoder: A geocoder with structured queries (BestAddress,
+        Pelias, NominatimWrapper, LocalBestAddress, CachedGeocoder...).
+
+    :param dict columns: Mapping from the query keys (street, housenumber,
+        postcode, city) to the columns of `df`.
+
+    :param int max_workers: Number of concurrent calls (through
+        ``geocode_many``).
+
+    :param dict aliases: See :func:`query_keys`.
+
+    :param kwargs: Passed to ``geocode`` for every query (or to
+        ``geocode_batch``). ``exactly_one=False`` is not supported: there is
+        one result per row.
+
+    :return: A copy of `df`, with additional columns `lat`, `lon`,
+        `precision`, `matched_address`, `provider_id` and `error` (NaN/None
+        if not found or failed).
+    """
+    columns = DEFAULT_COLUMNS if columns is None else columns
+    if not kwargs.get("exactly_one", True):
+        raise ValueError("geocode_dataframe keeps one result per row: exactly_one=False is not supported")
+
+    codes, uniques = pd.factorize(query_keys(df, columns, aliases))
+    _, first_rows = np.unique(codes, return_index=True)
+    logger.info("geocode_dataframe: %d rows, %d distinct queries", len(df), len(uniques))
+
+    queries = pd.DataFrame({key: (normalize_streets(df[col]) if key == "street" else _clean(df[col])).values[first_rows]
+                            for key, col in columns.items()})
+
+    lat = np.full(len(uniques), np.nan)
+    lon = np.full(len(uniques), np.nan)
+    precision = np.full(len(uniques), None, dtype=object)
+    matched_address = np.full(len(uniques), None, dtype=object)
+    provider_id = np.full(len(uniques), None, dtype=object)
+    error = np.full(len(uniques), None, dtype=object)
+
+    if hasattr(geocoder, "geocode_batch"):
+        res = geocoder.geocode_batch(queries, **{key: key for key in columns}, **kwargs)
+        lat, lon = res.lat.values, res.lon.values
+        precision = res.precision.values
+        matched_address = res.address.values
+        provider_id = res.address_id.values
+    else:
+        # Rows without any address value are not sent
+        todo = np.flatnonzero(pd.Index(uniques).str.replace("\x1f", "", regex=False) != "")
+        records = queries.iloc[todo].to_dict("records")
+        if max_workers > 1:
+            results = geocoder.geocode_many(records, max_workers=max_workers, ordered=False, **kwargs)
+        else:
+            results = _geocode_each(geocoder, records, kwargs)
+
+        for j, location, err in results:
+            i = todo[j]
+            if err is not None:
+                error[i] = repr(err)
+                continue
+            if location is None:
+                continue
+            lat[i], lon[i] = location.latitude, location.longitude
+            precision[i] = result_precision(location.raw)
+            matched_address[i] = location.address
+            provider_id[i] = result_id(location.raw)
+
+        n_errors = sum(e is not None for e in error)
+        if n_errors:
+            logger.warning("geocode_dataframe: %d queries failed", n_errors)
+
+    return df.assign(lat=lat[codes], lon=lon[codes], precision=precision[codes],
+                     matched_address=matched_address[codes], provider_id=provider_id[codes],
+                     error=error[codes])
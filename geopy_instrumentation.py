@@ -0,0 +1,284 @@
+import os
+import threading
+import time
+from contextlib import nullcontext
+
+__all__ = ("Observer", "NULL_OBSERVER", "CallbackObserver", "PrometheusObserver", "OpenTelemetryObserver",
+           "instrument_session", "timed")
+
+
+class Observer:
+    """
+    Receives the instrumentation of the geocoders: timing spans, counters
+    and events. Subclasses override :meth:`on_span`, :meth:`on_count` and
+    :meth:`on_event`; the default implementations do nothing.
+
+    Spans, counters and events emitted by BestAddress, Pelias and
+    NominatimWrapper (all with a ``provider`` attribute):
+
+    - ``geocoder.http`` span: one call to the service, by ``endpoint``
+      (for BestAddress and Pelias, it includes JSON decoding and the
+      ``geocoder.parse`` span). Each retry of the rate limiter is a span;
+      the wait for the limiter is not included;
+    - ``geocoder.decode`` span: JSON decoding (NominatimWrapper);
+    - ``geocoder.parse`` span: conversion of the answer into Location
+      objects;
+    - ``geocoder.token_fetch`` span: OAuth token request (BestAddress);
+    - ``geocoder.http_responses`` counter, by ``status``;
+    - ``geocoder.http_response_bytes`` counter;
+    - ``geocoder.cascade`` counter, by ``level`` and ``precision``
+      (BestAddress geocode; ``level="none"`` when nothing is found);
+    - ``geocoder.id_cache`` counter, by ``result`` ("hit", "shared" with a
+      concurrent fetch, "miss"; BestAddress get_many_by_id);
+    - ``token.renewal`` event, with ``reason`` ("initial", "expired") and
+      ``token.rejected`` event (401 answer, BestAddress).
+
+    A span interrupted by an exception gets an ``error`` attribute (the
+    exception class). HTTP statuses and sizes are observed on the requests
+    sessions (sync mode); in async mode, only NominatimWrapper reports
+    them.
+    """
+
+    enabled = True
+
+    def span(self, name, **attributes):
+        """
+        Context manager timing a block of code.
+        """
+        return _Span(self, name, attributes)
+
+    def count(self, name, value=1, **attributes):
+        self.on_count(name, value, attributes)
+
+    def event(self, name, **attributes):
+        self.on_event(name, attributes)
+
+    def on_span(self, name, duration, attributes, error):
+        pass
+
+    def on_count(self, name, value, attributes):
+        pass
+
+    def on_event(self, name, attributes):
+        pass
+
+
+class _Span:
+    __slots__ = ("observer", "name", "attributes", "start")
+
+    def __init__(self, observer, name, attributes):
+        self.observer = observer
+        self.name = name
+        self.attributes = attributes
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.observer.on_span(self.name, time.perf_counter() - self.start, self.attributes,
+                              exc_type.__name__ if exc_type is not None else None)
+        return False
+
+
+_NULL_SPAN = nullcontext()
+
+
+class _NullObserver(Observer):
+    # Used when no observer is given: every hook is a no-op
+    enabled = False
+
+    def span(self, name, **attributes):
+        return _NULL_SPAN
+
+    def count(self, name, value=1, **attributes):
+        pass
+
+    def event(self, name, **attributes):
+        pass
+
+
+NULL_OBSERVER = _NullObserver()
+
+
+def timed(observer, name, func, **attributes):
+    """
+    Wrap `func` in a span of `observer` (`func` itself if the observer is
+    disabled).
+    """
+    if not observer.enabled:
+        return func
+
+    def wrapper(*args, **kwargs):
+        with observer.span(name, **attributes):
+            return func(*args, **kwargs)
+    return wrapper
+
+
+def instrument_session(session, observer, **attributes):
+    """
+    Count the HTTP statuses and payload sizes of the responses received by
+    a :class:`requests.Session`.
+    """
+    if not observer.enabled:
+        return
+
+    def on_response(response, *args, **kwargs):
+        observer.count("geocoder.http_responses", status=response.status_code, **attributes)
+        observer.count("geocoder.http_response_bytes", len(response.content), **attributes)
+
+    session.hooks["response"].append(on_response)
+
+
+class CallbackObserver(Observer):
+    """
+    Forward everything to a callback ``callback(kind, name, value,
+    attributes)``, where `kind` is "span" (value: duration in seconds),
+    "count" or "event" (value: None).
+    """
+
+    def __init__(self, callback):
+        self.callback = callback
+
+    def on_span(self, name, duration, attributes, error):
+        if error is not None:
+            attributes = dict(attributes, error=error)
+        self.callback("span", name, duration, attributes)
+
+    def on_count(self, name, value, attributes):
+        self.callback("count", name, value, attributes)
+
+    def on_event(self, name, attributes):
+        self.callback("event", name, None, attributes)
+
+
+class PrometheusObserver(Observer):
+    """
+    Aggregate spans (as histograms), counters and events (as counters) in
+    memory, and render them in the Prometheus text exposition format, e.g.
+    for the node_exporter textfile collector::
+
+        observer = PrometheusObserver()
+        geocoder = BestAddress(..., observer=observer)
+        ...
+        observer.write("/var/lib/node_exporter/geocoding.prom")
+    """
+
+    buckets = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+    def __init__(self, prefix="", buckets=None):
+        self.prefix = prefix
+        if buckets is not None:
+            self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+
+    @staticmethod
+    def _key(name, attributes):
+        return name, tuple(sorted((k, str(v)) for k, v in attributes.items()))
+
+    def on_span(self, name, duration, attributes, error):
+        key = self._key(name, dict(attributes, error=error) if error is not None else attributes)
+        with self._lock:
+            hist = self._histograms.get(key)
+            if hist is None:
+                hist = self._histograms[key] = {"buckets": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            for i, bound in enumerate(self.buckets):
+                if duration <= bound:
+                    hist["buckets"][i] += 1
+            hist["sum"] += duration
+            hist["count"] += 1
+
+    def on_count(self, name, value, attributes):
+        key = self._key(name, attributes)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def on_event(self, name, attributes):
+        self.on_count(name, 1, attributes)
+
+    def _metric_name(self, name):
+        return self.prefix + name.replace(".", "_")
+
+    @staticmethod
+    def _labels(labels):
+        if not labels:
+            return ""
+        values = ",".join('%s="%s"' % (k, v.replace("\\", "\\\\").replace('"', '\\"')) for k, v in labels)
+        return "{" + values + "}"
+
+    def render(self):
+        """
+        Current values, in the Prometheus text format.
+        """
+        lines = []
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted((k, dict(v, buckets=list(v["buckets"]))) for k, v in self._histograms.items())
+
+        typed = set()
+        for (name, labels), value in counters:
+            metric = self._metric_name(name) + "_total"
+            if metric not in typed:
+                typed.add(metric)
+                lines.append(f"# TYPE {metric} counter")
+            lines.append(f"{metric}{self._labels(labels)} {value}")
+
+        for (name, labels), hist in histograms:
+            metric = self._metric_name(name) + "_seconds"
+            if metric not in typed:
+                typed.add(metric)
+                lines.append(f"# TYPE {metric} histogram")
+            for bound, count in zip(self.buckets, hist["buckets"]):
+                lines.append(f"{metric}_bucket{self._labels(labels + (('le', str(bound)), ))} {count}")
+            lines.append(f"{metric}_bucket{self._labels(labels + (('le', '+Inf'), ))} {hist['count']}")
+            lines.append(f"{metric}_sum{self._labels(labels)} {hist['sum']}")
+            lines.append(f"{metric}_count{self._labels(labels)} {hist['count']}")
+        return "\n".join(lines) + "\n"
+
+    def write(self, path):
+        """
+        Write :meth:`render` atomically into `path`.
+        """
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(self.render())
+        os.replace(tmp_path, path)
+
+
+class OpenTelemetryObserver(Observer):
+    """
+    Export spans as OpenTelemetry spans, and counters and events as
+    OpenTelemetry counters. Requires the ``opentelemetry-api`` package; the
+    SDK and exporters are configured by the application.
+    """
+
+    def __init__(self, tracer=None, meter=None):
+        try:
+            from opentelemetry import metrics, trace
+        except ImportError as e:
+            raise ImportError("OpenTelemetryObserver requires the opentelemetry-api package") from e
+        self.tracer = tracer if tracer is not None else trace.get_tracer("gisanalytics.geocoders")
+        self.meter = meter if meter is not None else metrics.get_meter("gisanalytics.geocoders")
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def span(self, name, **attributes):
+        return self.tracer.start_as_current_span(name, attributes={k: str(v) for k, v in attributes.items()})
+
+    def _counter(self, name):
+        with self._lock:
+            counter = self._counters.get(name)
+            if counter is None:
+                counter = self._counters[name] = self.meter.create_counter(name)
+        return counter
+
+    def on_count(self, name, value, attributes):
+        self._counter(name).add(value, {k: str(v) for k, v in attributes.items()})
+
+    def on_event(self, name, attributes):
+        from opentelemetry import trace
+        attributes = {k: str(v) for k, v in attributes.items()}
+        trace.get_current_span().add_event(name, attributes)
+        self._counter(name).add(1, attributes)
@@ -0,0 +1,373 @@
+import contextlib
+import glob
+import itertools
+import json
+import multiprocessing
+import os
+import socket
+import threading
+import time
+
+import pandas as pd
+from geopy.util import logger
+
+from geopy_dataframe import geocode_dataframe
+
+try:
+    import fcntl
+except ImportError: # Windows: takeovers are not serialized
+    fcntl = None
+
+__all__ = ("GeocodingJob", )
+
+
+def _write_atomic(path, write):
+    # Write into a temporary file of the same directory, then rename: a
+    # reader (or a resumed job) never sees a partial file
+    tmp_path = f"{path}.{socket.gethostname()}.{os.getpid()}.tmp"
+    try:
+        write(tmp_path)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+class GeocodingJob:
+    """
+    Geocode a (large) CSV file chunk by chunk, writing the results of each
+    chunk in its own part file, so that a job can be interrupted and
+    resumed, and shared by several processes (possibly on several machines
+    with a shared file system).
+
+    The input follows the layout of the Geocoder_Dataprep samples (columns
+    street, housenumber, postcode, city, possibly gzipped); all its columns
+    are kept in the output, with the columns added by
+    :func:`geopy_dataframe.geocode_dataframe` (lat, lon, precision,
+    matched_address, provider_id, error) and ``row``, the offset of the row
+    in the input.
+
+    Layout of `output_dir`:
+
+    - ``part-00000.csv.gz`` (or ``.parquet``): results of chunk 0 (rows
+      0 to chunksize-1), written to a temporary file and renamed;
+    - ``_done/chunk-00000.json``: checkpoint of chunk 0 (offsets, counts,
+      duration), written after its part file. A chunk with a checkpoint is
+      never geocoded again;
+    - ``_claims/chunk-00000.claim``: chunk 0 is being processed (created
+      with O_EXCL, so only one process gets it). A claim which has not been
+      refreshed for `stale_after` seconds (crashed process) is taken over,
+      by one process at a time (``_claims/chunk-00000.lock``).
+
+    Usage::
+
+        job = GeocodingJob("data/geocoding/kbo.csv.gz", "data/geocoding/kbo_best",
+                           partial(BestAddress, client_id=..., client_secret=...),
+                           chunksize=10000, max_workers=8)
+        job.run(processes=4)   # or job.run() in several terminals
+        job.status()
+        df = job.results()
+    """
+
+    def __init__(self, input_path, output_dir, geocoder_factory, *, columns=None, chunksize=10000,
+                 output_format="csv", max_workers=4, aliases=None, max_error_rate=0.5, stale_after=600,
+                 read_csv_kwargs=None, geocode_kwargs=None):
+        """
+        :param str input_path: CSV file to geocode.
+
+        :param str output_dir: Directory of the part files and checkpoints.
+
+        :param callable geocoder_factory: Called without argument, once per
+            process, to create the geocoder. Must be picklable for
+            ``run(processes=...)`` (a module-level function or a
+            :func:`functools.partial` of a geocoder class).
+
+        :param dict columns: See :func:`geopy_dataframe.geocode_dataframe`.
+
+        :param int chunksize: Number of input rows per chunk (and part file).
+
+        :param str output_format: "csv" (gzipped) or "parquet" (requires
+            pyarrow).
+
+        :param int max_workers: Concurrent calls per process.
+
+        :param aliases: See :func:`geopy_dataframe.query_keys`.
+
+        :param float max_error_rate: If a larger fraction of the queries
+            of a chunk fail (e.g. expired credentials, service down), the
+            chunk is not checkpointed and the job stops with an error: the
+            chunk is geocoded again when the job is resumed.
+
+        :param float stale_after: Seconds after which the claim of a
+            process that stopped refreshing it is taken over.
+
+        :param dict read_csv_kwargs: Passed to :func:`pandas.read_csv`.
+
+        :param dict geocode_kwargs: Passed to ``geocode`` for every query.
+        """
+        if output_format not in ("csv", "parquet"):
+            raise ValueError(f"Unknown output format '{output_format}'. Valid values are 'csv' and 'parquet'")
+        self.input_path = input_path
+        self.output_dir = output_dir
+        self.geocoder_factory = geocoder_factory
+        self.columns = columns
+        self.chunksize = chunksize
+        self.output_format = output_format
+        self.max_workers = max_workers
+        self.aliases = aliases
+        self.max_error_rate = max_error_rate
+        self.stale_after = stale_after
+        self.read_csv_kwargs = read_csv_kwargs or {}
+        self.geocode_kwargs = geocode_kwargs or {}
+
+        self._done_dir = os.path.join(output_dir, "_done")
+        self._claims_dir = os.path.join(output_dir, "_claims")
+        os.makedirs(self._done_dir, exist_ok=True)
+        os.makedirs(self._claims_dir, exist_ok=True)
+
+    def _part_path(self, chunk):
+        ext = "csv.gz" if self.output_format == "csv" else "parquet"
+        return os.path.join(self.output_dir, f"part-{chunk:05d}.{ext}")
+
+    def _done_path(self, chunk):
+        return os.path.join(self._done_dir, f"chunk-{chunk:05d}.json")
+
+    def _claim_path(self, chunk):
+        return os.path.join(self._claims_dir, f"chunk-{chunk:05d}.claim")
+
+    def is_done(self, chunk):
+        return os.path.exists(self._done_path(chunk))
+
+    def _claim(self, chunk):
+        """
+        Try to claim `chunk` for this process. Return True on success.
+        """
+        path = self._claim_path(chunk)
+        for _ in range(2):
+            try:
+                fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                taken_over = self._take_over(chunk)
+                if taken_over is None: # Released meanwhile
+                    continue
+                return taken_over
+            return self._claimed(chunk, fd)
+        return False
+
+    def _claimed(self, chunk, fd):
+        owner = json.dumps({"host": socket.gethostname(), "pid": os.getpid(), "time": time.time()})
+        with os.fdopen(fd, "w") as f:
+            f.write(owner)
+        # The chunk may have been completed between the check and the claim
+        if self.is_done(chunk):
+            self._release(chunk)
+            return False
+        return True
+
+    def _take_over(self, chunk):
+        """
+        Take over the claim of `chunk` if it is stale (crashed process).
+        Return True if it was taken over, False if it is not stale (or
+        another process took it over first), None if it no longer exists.
+
+        Takeovers are serialized by a lock file per chunk (when fcntl is
+        available), and the claim is re-inspected under the lock: a process
+        which saw the same stale claim as another one finds a fresh claim
+        and gives up. The stale claim is moved away and checked to be the
+        inspected file before being removed, in case its owner released it
+        and another process claimed the chunk meanwhile.
+        """
+        path = self._claim_path(chunk)
+        with self._takeover_lock(chunk):
+            try:
+                inspected = os.stat(path)
+            except FileNotFoundError:
+                return None
+            if time.time() - inspected.st_mtime < self.stale_after:
+                return False
+            moved_path = f"{path}.{socket.gethostname()}.{os.getpid()}.stale"
+            try:
+                os.rename(path, moved_path)
+            except FileNotFoundError:
+                return None
+            moved = os.stat(moved_path)
+            if (moved.st_ino, moved.st_mtime_ns) != (inspected.st_ino, inspected.st_mtime_ns):
+                # Not the inspected claim, but a fresh one: put it back (without
+                # replacing a claim created meanwhile)
+                try:
+                    os.link(moved_path, path)
+                except FileExistsError:
+                    pass
+                os.remove(moved_path)
+                return False
+            os.remove(moved_path)
+            logger.warning("GeocodingJob: taking over stale claim of chunk %d", chunk)
+            try:
+                fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError: # Claimed (normally) meanwhile
+                return False
+            return self._claimed(chunk, fd)
+
+    @contextlib.contextmanager
+    def _takeover_lock(self, chunk):
+        if fcntl is None:
+            yield
+            return
+        with open(os.path.join(self._claims_dir, f"chunk-{chunk:05d}.lock"), "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _release(self, chunk):
+        try:
+            os.remove(self._claim_path(chunk))
+        except FileNotFoundError:
+            pass
+
+    def _heartbeat(self, chunk, stop):
+        # Refresh the claim while the chunk is processed
+        while not stop.wait(self.stale_after / 3):
+            try:
+                os.utime(self._claim_path(chunk))
+            except FileNotFoundError:
+                return
+
+    def _done_chunks(self):
+        return {int(os.path.basename(path)[len("chunk-"):-len(".json")])
+                for path in glob.glob(os.path.join(self._done_dir, "chunk-*.json"))}
+
+    def _chunks(self):
+        # The rows of the chunks already done are skipped by the parser (not
+        # converted into DataFrames): the reader then yields the other chunks
+        # in order, all of `chunksize` rows but the last one.
+        done = self._done_chunks()
+        skiprows = None
+        if done:
+            skiprows = lambda i: i > 0 and (i - 1) // self.chunksize in done
+        reader = pd.read_csv(self.input_path, dtype=str, chunksize=self.chunksize, skiprows=skiprows,
+                             **self.read_csv_kwargs)
+        pending = (chunk for chunk in itertools.count() if chunk not in done)
+        yield from zip(pending, reader)
+
+    def _process(self, geocoder, chunk, df):
+        start_row = chunk * self.chunksize
+        df.index = pd.RangeIndex(start_row, start_row + len(df), name="row")
+        start = time.time()
+        res = geocode_dataframe(df, geocoder, self.columns, max_workers=self.max_workers,
+                                aliases=self.aliases, **self.geocode_kwargs)
+        n_errors = int(res.error.notnull().sum())
+        if len(res) and n_errors / len(res) > self.max_error_rate:
+            raise RuntimeError(f"GeocodingJob: {n_errors} errors out of {len(res)} rows in chunk {chunk} "
+                               f"(first one: {res.error.dropna().iloc[0]})")
+
+        res = res.reset_index()
+        if self.output_format == "csv":
+            _write_atomic(self._part_path(chunk), lambda p: res.to_csv(p, index=False, compression="gzip"))
+        else:
+            _write_atomic(self._part_path(chunk), lambda p: res.to_parquet(p, index=False))
+
+        checkpoint = {"chunk": chunk, "start_row": start_row, "end_row": start_row + len(res),
+                      "found": int(res.lat.notnull().sum()), "errors": n_errors,
+                      "seconds": time.time() - start, "host": socket.gethostname(), "pid": os.getpid(),
+                      "part": os.path.basename(self._part_path(chunk))}
+
+        def write_checkpoint(path):
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump(checkpoint, f)
+        _write_atomic(self._done_path(chunk), write_checkpoint)
+        return checkpoint
+
+    def work(self):
+        """
+        Process all the chunks which are neither done nor claimed by another
+        process, in this process. Return the number of processed chunks.
+        """
+        geocoder = None
+        processed = 0
+        try:
+            for chunk, df in self._chunks():
+                if self.is_done(chunk) or not self._claim(chunk):
+                    continue
+                stop = threading.Event()
+                heartbeat = threading.Thread(target=self._heartbeat, args=(chunk, stop), daemon=True)
+                heartbeat.start()
+                try:
+                    if geocoder is None:
+                        geocoder = self.geocoder_factory()
+                    checkpoint = self._process(geocoder, chunk, df)
+                finally:
+                    stop.set()
+                    self._release(chunk)
+                processed += 1
+                logger.info("GeocodingJob: chunk %d done (rows %d-%d, %d found, %d errors, %.1fs)", chunk,
+                            checkpoint["start_row"], checkpoint["end_row"] - 1, checkpoint["found"],
+                            checkpoint["errors"], checkpoint["seconds"])
+        finally:
+            if geocoder is not None:
+                _close_geocoder(geocoder)
+        return processed
+
+    def run(self, processes=1):
+        """
+        Run (or resume) the job with `processes` worker processes. Return
+        :meth:`status`.
+        """
+        if processes <= 1:
+            self.work()
+        else:
+            ctx = multiprocessing.get_context("spawn")
+            with ctx.Pool(processes) as pool:
+                pool.map(_work, [self] * processes)
+        return self.status()
+
+    def checkpoints(self):
+        """
+        Checkpoints of the completed chunks, by chunk number.
+        """
+        checkpoints = {}
+        for path in glob.glob(os.path.join(self._done_dir, "chunk-*.json")):
+            with open(path, encoding="utf-8") as f:
+                checkpoint = json.load(f)
+            checkpoints[checkpoint["chunk"]] = checkpoint
+        return dict(sorted(checkpoints.items()))
+
+    def status(self):
+        """
+        Progress of the job: completed chunks and rows, found results,
+        errors, and chunks currently claimed.
+        """
+        checkpoints = self.checkpoints()
+        claimed = glob.glob(os.path.join(self._claims_dir, "chunk-*.claim"))
+        return {"chunks_done": len(checkpoints),
+                "rows_done": sum(c["end_row"] - c["start_row"] for c in checkpoints.values()),
+                "found": sum(c["found"] for c in checkpoints.values()),
+                "errors": sum(c["errors"] for c in checkpoints.values()),
+                "chunks_claimed": len(claimed)}
+
+    def results(self):
+        """
+        Concatenation of the completed part files, in input order.
+        """
+        parts = [os.path.join(self.output_dir, c["part"]) for c in self.checkpoints().values()]
+        if not parts:
+            return None
+        if self.output_format == "csv":
+            return pd.concat([pd.read_csv(p, dtype=str, keep_default_na=False, na_values=[""])
+                              .astype({"row": int, "lat": float, "lon": float}) for p in parts], ignore_index=True)
+        return pd.concat([pd.read_parquet(p) for p in parts], ignore_index=True)
+
+
+def _close_geocoder(geocoder):
+    # geopy geocoders close their connections on exit; other objects
+    # (CachedGeocoder...) may have a close method
+    if hasattr(type(geocoder), "__exit__"):
+        geocoder.__exit__(None, None, None)
+    elif hasattr(geocoder, "close"):
+        geocoder.close()
+
+
+def _work(job):
+    # Entry point of the worker processes of GeocodingJob.run
+    return job.work()
@@ -1,19 +1,50 @@
+import asyncio
 import collections.abc
 from functools import partial
-from urllib.parse import urlencode
+from urllib.parse import urlencode, urlparse
 
 
-import  json
 import requests
+from requests.adapters import HTTPAdapter
 
-from geopy.exc import ConfigurationError, GeocoderQueryError
-from geopy.geocoders.base import _DEFAULT_USER_AGENT, DEFAULT_SENTINEL, Geocoder
+from geopy.adapters import BaseAsyncAdapter, RequestsHTTPWithSSLContextAdapter, get_retry_after
+from geopy.exc import (ConfigurationError, GeocoderQueryError, GeocoderRateLimited, GeocoderServiceError,
+                       GeocoderTimedOut, GeocoderUnavailable)
+from geopy.geocoders.base import _DEFAULT_USER_AGENT, DEFAULT_SENTINEL, ERROR_CODE_MAP, Geocoder
 from geopy.location import Location
 from geopy.util import logger
 
+try:
+    from aiohttp import ClientConnectionError
+except ImportError:  # aiohttp is only required in async mode
+    ClientConnectionError = OSError
+
+from geopy_batch import BatchGeocoder
+from geopy_instrumentation import NULL_OBSERVER, instrument_session
+from geopy_ratelimit import limited_call
+from geopy_results import LazyLocation, json_loads
+
 __all__ = ("NominatimWrapper", )
 
-class NominatimWrapper(Geocoder):
+def _text(body):
+    return body.decode("utf-8", "replace") if isinstance(body, bytes) else body
+
+
+def match_point(match):
+    # (lat, lon) of a NominatimWrapper match
+    latitude = match["output"].get('lat', None)
+    longitude = match["output"].get('lon', None)
+    if latitude is not None and longitude is not None:
+        latitude = float(latitude)
+        longitude = float(longitude)
+    return latitude, longitude
+
+
+def match_name(match):
+    return match["output"].get('displayName', None)
+
+
+class NominatimWrapper(BatchGeocoder, Geocoder):
     
     _DEFAULT_NOMINATIM_WRAPPER_DOMAIN  ="nominatimwrapper.smalsrech.be"
     structured_query_params = {
@@ -35,7 +66,15 @@ class NominatimWrapper(Geocoder):
             user_agent=None,
             ssl_context=DEFAULT_SENTINEL,
             adapter_factory=None,
-            withExtraHouseNumber=True
+            withExtraHouseNumber=True,
+            pool_connections=10,
+            pool_maxsize=10,
+            pool_block=False,
+            max_retries=0,
+            session=None,
+            rate_limiter=None,
+            observer=None,
+            lazy=False
             # Make sure to synchronize the changes of this signature in the
             # inheriting classes (e.g. PickPoint).
     ):
@@ -64,6 +103,33 @@ class NominatimWrapper(Geocoder):
             See :attr:`geopy.geocoders.options.default_adapter_factory`.
 
             .. versionadded:: 2.0
+
+        :param int pool_connections: Number of per-host connection pools
+            kept by the HTTP session (sync mode; in async mode the aiohttp
+            session of the adapter is used).
+
+        :param int pool_maxsize: Maximum number of keep-alive connections
+            kept open to a single host. Should be at least the number of
+            threads sharing this geocoder.
+
+        :param bool pool_block: If True, never open more than
+            ``pool_maxsize`` connections to a host: extra threads wait for
+            a free connection instead of opening a throw-away one.
+
+        :param int max_retries: Number of retries on connection errors.
+
+        :param session: An existing :class:`requests.Session` to use instead
+            of building one. It is then owned (and closed) by the geocoder.
+
+        :param rate_limiter: A :class:`geopy_ratelimit.AdaptiveRateLimiter`
+            controlling the rate and concurrency of the calls.
+
+        :param observer: A :class:`geopy_instrumentation.Observer`
+            receiving timings, counters and events of the calls.
+
+        :param bool lazy: If True, results are
+            :class:`geopy_results.LazyLocation` objects, decoded when
+            accessed.
         """
         super().__init__(
             scheme=scheme,
@@ -76,10 +142,60 @@ class NominatimWrapper(Geocoder):
 
         self.domain = domain.strip('/')
         self.withExtraHouseNumber = withExtraHouseNumber
+        self._run_async = isinstance(self.adapter, BaseAsyncAdapter)
+        self.rate_limiter = rate_limiter
+        self.lazy = lazy
         
 
         self.api = "%s://%s%s" % (self.scheme, self.domain, self.geocode_path)
 
+        if session is None:
+            session = self._build_session(pool_connections, pool_maxsize, pool_block, max_retries)
+        self.session = session
+
+        self.observer = observer if observer is not None else NULL_OBSERVER
+        self._provider = type(self).__name__
+        instrument_session(self.session, self.observer, provider=self._provider)
+
+    def _build_session(self, pool_connections, pool_maxsize, pool_block, max_retries):
+        """
+        Build the HTTP session shared by all calls (and threads) of this
+        geocoder: connections are kept alive and pooled per host, instead
+        of opening a new TCP connection (and DNS lookup) per address.
+        """
+        session = requests.Session()
+        session.trust_env = False  # same as geopy adapters: proxies come from `proxies`
+        session.proxies = self.proxies or {}
+        session.headers.update(self.headers)
+        session.headers.update({
+            "Accept-Encoding": "gzip, deflate",
+            "Connection": "keep-alive",
+        })
+        session.mount("http://", HTTPAdapter(pool_connections=pool_connections,
+                                             pool_maxsize=pool_maxsize,
+                                             pool_block=pool_block,
+                                             max_retries=max_retries))
+        session.mount("https://", RequestsHTTPWithSSLContextAdapter(ssl_context=self.ssl_context,
+                                                                    pool_connections=pool_connections,
+                                                                    pool_maxsize=pool_maxsize,
+                                                                    pool_block=pool_block,
+                                                                    max_retries=max_retries))
+        return session
+
+    def close(self):
+        """
+        Close all pooled connections.
+        """
+        self.session.close()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        super().__exit__(exc_type, exc_val, exc_tb)
+        self.close()
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await super().__aexit__(exc_type, exc_val, exc_tb)
+        self.close()
+
     def _construct_url(self, base_api, params):
         """
         Construct geocoding request url.
@@ -231,51 +347,82 @@ class NominatimWrapper(Geocoder):
         timeout = (timeout if timeout is not DEFAULT_SENTINEL
                    else self.timeout)
         
+        if self._run_async:
+            return limited_call(self.rate_limiter, True, self._call_geocoder_async, url, callback, addr_data, timeout)
+        return limited_call(self.rate_limiter, False, self._post, url, callback, addr_data, timeout)
+
+    def _post(self, url, callback, addr_data, timeout):
+
         data = addr_data#{"address": addr_data}
 
+        result = None
         try: 
-            
-            result = requests.post(
-                url,
-                json=data, timeout=timeout)
+            with self.observer.span("geocoder.http", provider=self._provider, endpoint="geocode"):
+                try:
+                    result = self.session.post(
+                        url,
+                        json=data, timeout=timeout)
+                except requests.Timeout:
+                    raise GeocoderTimedOut("Service timed out")
+                except requests.ConnectionError as e:
+                    raise GeocoderUnavailable(str(e))
             #print(result)
             
-            if result.status_code == 204:
-                #print("No result!")
-                #print(addr_data)
-                #print(result.text)
-                return
-            elif result.status_code == 400:
-                print("Argument error")
-                print(result.text)
-                print(addr_data)
-            
-            #print(type(result.text))
-            return callback(json.loads(result.text))
+            return self._process_response(result.status_code, result.content, callback, addr_data, result.headers)
         except Exception as e:
-            print("Exception !")
-            print(addr_data)
-            print(e)
-            print(result.text)
-            print(url)
+            logger.warning("%s: call to %s failed for %s: %r (response: %s)", self._provider, url, addr_data, e,
+                           result.text if result is not None else None)
             raise e
 
+    async def _call_geocoder_async(self, url, callback, addr_data, timeout):
+        # The geopy adapters only send GET requests: POST through the
+        # aiohttp session of the adapter, closed with `async with`.
+        proxy = self.proxies.get(urlparse(url).scheme) if self.proxies else None
+        try:
+            with self.observer.span("geocoder.http", provider=self._provider, endpoint="geocode"):
+                async with self.adapter.session.post(url, json=addr_data, headers=self.headers,
+                                                     timeout=timeout, proxy=proxy,
+                                                     ssl=self.ssl_context) as result:
+                    status, body, headers = result.status, await result.read(), result.headers
+        except asyncio.TimeoutError:
+            raise GeocoderTimedOut("Service timed out")
+        except (OSError, ClientConnectionError) as e:
+            raise GeocoderUnavailable(str(e))
+        self.observer.count("geocoder.http_responses", status=status, provider=self._provider)
+        self.observer.count("geocoder.http_response_bytes", len(body), provider=self._provider)
+
+        return self._process_response(status, body, callback, addr_data, headers)
+
+    def _process_response(self, status_code, body, callback, addr_data, headers=None):
+        # body: raw bytes of the answer, only decoded to text for error messages
+
+        if status_code == 204:
+            #print("No result!")
+            #print(addr_data)
+            #print(result.text)
+            return
+        elif status_code == 400:
+            logger.warning("%s: argument error for %s: %s", self._provider, addr_data, _text(body))
+        elif status_code == 429:
+            raise GeocoderRateLimited(_text(body), retry_after=get_retry_after(headers or {}))
+        elif status_code >= 500:
+            raise ERROR_CODE_MAP.get(status_code, GeocoderServiceError)(_text(body))
+
+        #print(type(result.text))
+        with self.observer.span("geocoder.decode", provider=self._provider):
+            places = json_loads(body)
+        with self.observer.span("geocoder.parse", provider=self._provider):
+            return callback(places)
+
     def _parse_code(self, place):
         # Parse each resource.
         # print(place)
         if "match" not in place: 
             return None
         match = place["match"][0]
-        
-        latitude = match["output"].get('lat', None)
-        longitude = match["output"].get('lon', None)
-        placename = match["output"].get('displayName', None)
-        if latitude is not None and longitude is not None:
-            latitude = float(latitude)
-            longitude = float(longitude)
-            
-        # print("placename: ", placename)
-        return Location(placename, (latitude, longitude), match)
+        if self.lazy:
+            return LazyLocation(match, match_name, match_point)
+        return Location(match_name(match), match_point(match), match)
 
     def _parse_json(self, places, exactly_one):
         
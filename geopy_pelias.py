@@ -1,14 +1,38 @@
 from functools import partial
 from urllib.parse import urlencode
 
+from geopy.adapters import BaseAsyncAdapter
 from geopy.geocoders.base import DEFAULT_SENTINEL, Geocoder
 from geopy.location import Location
 from geopy.util import logger
 
+from geopy_batch import BatchGeocoder
+from geopy_instrumentation import NULL_OBSERVER, instrument_session, timed
+from geopy_ratelimit import limited_call
+from geopy_results import LazyLocation
+
 __all__ = ("Pelias", )
 
 
-class Pelias(Geocoder):
+def feature_point(feature):
+    # (lat, lon) of a Pelias feature
+    latitude = feature.get('geometry', {}).get('coordinates', [])[1]
+    longitude = feature.get('geometry', {}).get('coordinates', [])[0]
+    
+    if 49.29333 < latitude < 49.29335 and 2.30668 < longitude < 2.3067: # corresponds to 0,0 in Lambert
+        latitude = 0
+        longitude= 0
+    return latitude, longitude
+
+
+def feature_name(feature):
+    placename = feature.get('properties', {}).get('name')
+    if placename is None:
+        placename = "[missing name]"
+    return placename
+
+
+class Pelias(BatchGeocoder, Geocoder):
     """Pelias geocoder.
 
     update from geopy to accept structured queries
@@ -35,7 +59,10 @@ class Pelias(Geocoder):
             scheme=None,
             ssl_context=DEFAULT_SENTINEL,
             adapter_factory=None,
-            with_localities=True
+            with_localities=True,
+            rate_limiter=None,
+            observer=None,
+            lazy=False
             # Make sure to synchronize the changes of this signature in the
             # inheriting classes (e.g. GeocodeEarth).
     ):
@@ -65,6 +92,16 @@ class Pelias(Geocoder):
 
             .. versionadded:: 2.0
 
+        :param rate_limiter: A :class:`geopy_ratelimit.AdaptiveRateLimiter`
+            controlling the rate and concurrency of the calls.
+
+        :param observer: A :class:`geopy_instrumentation.Observer`
+            receiving timings, counters and events of the calls.
+
+        :param bool lazy: If True, results are
+            :class:`geopy_results.LazyLocation` objects, decoded when
+            accessed.
+
         """
         super().__init__(
             scheme=scheme,
@@ -79,6 +116,14 @@ class Pelias(Geocoder):
         self.domain = domain.strip('/')
         
         self.with_localities = with_localities
+        self.rate_limiter = rate_limiter
+        self.lazy = lazy
+        self._run_async = isinstance(self.adapter, BaseAsyncAdapter)
+
+        self.observer = observer if observer is not None else NULL_OBSERVER
+        self._provider = type(self).__name__
+        if not self._run_async:
+            instrument_session(self.adapter.session, self.observer, provider=self._provider)
         
         self.geocode_api = (
             '%s://%s%s' % (self.scheme, self.domain, self.geocode_path)
@@ -240,19 +285,32 @@ class Pelias(Geocoder):
         callback = partial(self._parse_json, exactly_one=exactly_one)
         return self._call_geocoder(url, callback, timeout=timeout)
 
+    def _call_geocoder(self, url, callback, *, timeout=DEFAULT_SENTINEL, is_json=True, headers=None):
+        callback = timed(self.observer, "geocoder.parse", callback, provider=self._provider)
+        endpoint = "reverse" if url.startswith(self.reverse_api) else "search"
+        if self._run_async:
+            return self._call_geocoder_async(url, callback, endpoint, timeout=timeout, is_json=is_json, headers=headers)
+        return limited_call(self.rate_limiter, False, self._http, endpoint,
+                            url, callback, timeout=timeout, is_json=is_json, headers=headers)
+
+    async def _call_geocoder_async(self, url, callback, endpoint, **kwargs):
+        return await limited_call(self.rate_limiter, True, self._http_async, endpoint, url, callback, **kwargs)
+
+    def _http(self, endpoint, url, callback, **kwargs):
+        # One call to the service, inside the rate limiter: the span does
+        # not include the wait for a slot
+        with self.observer.span("geocoder.http", provider=self._provider, endpoint=endpoint):
+            return super()._call_geocoder(url, callback, **kwargs)
+
+    async def _http_async(self, endpoint, url, callback, **kwargs):
+        with self.observer.span("geocoder.http", provider=self._provider, endpoint=endpoint):
+            return await super()._call_geocoder(url, callback, **kwargs)
+
     def _parse_code(self, feature):
         # Parse each resource.
-        latitude = feature.get('geometry', {}).get('coordinates', [])[1]
-        longitude = feature.get('geometry', {}).get('coordinates', [])[0]
-        
-        if 49.29333 < latitude < 49.29335 and 2.30668 < longitude < 2.3067: # corresponds to 0,0 in Lambert
-            latitude = 0
-            longitude= 0
-            
-        placename = feature.get('properties', {}).get('name')
-        if placename is None:
-            placename = "[missing name]"
-        return Location(placename, (latitude, longitude), feature)
+        if self.lazy:
+            return LazyLocation(feature, feature_name, feature_point)
+        return Location(feature_name(feature), feature_point(feature), feature)
 
     def _parse_json(self, response, exactly_one):
         if response is None:
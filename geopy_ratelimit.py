@@ -0,0 +1,339 @@
+import asyncio
+import random
+import threading
+import time
+
+import requests
+from geopy.adapters import get_retry_after
+from geopy.exc import (GeocoderRateLimited, GeocoderServiceError, GeocoderTimedOut,
+                       GeocoderUnavailable)
+from geopy.util import logger
+
+__all__ = ("AdaptiveRateLimiter", "limited_call")
+
+
+class AdaptiveRateLimiter:
+    """
+    Client-side rate and concurrency control for calls to a web service.
+
+    Calls are admitted by a token bucket (at most ``rate`` calls per second)
+    and a concurrency limit. Both limits adapt with AIMD: they grow
+    additively while calls succeed (and are faster than
+    ``target_latency``), and are halved when the service shows signs of
+    overload (429, 5xx, timeouts, slow answers). A ``Retry-After`` sent by
+    the service pauses all callers.
+
+    Failed calls which may succeed later are retried with jittered
+    exponential backoff.
+
+    One limiter is meant to be shared by all the threads (or tasks) calling
+    the same service::
+
+        limiter = AdaptiveRateLimiter(rate=20, concurrency=4)
+        geocoder = BestAddress(..., rate_limiter=limiter)
+        limiter.call(requests.get, url)
+        limiter.stats()
+    """
+
+    def __init__(self, rate=10, *, burst=None, min_rate=0.5, max_rate=None, rate_step=0.1,
+                 concurrency=4, min_concurrency=1, max_concurrency=32,
+                 target_latency=None, decrease_factor=0.5, cooldown=1.0,
+                 max_retries=3, backoff=0.5, max_backoff=30):
+        """
+        :param float rate: Initial number of calls per second.
+
+        :param float burst: Capacity of the token bucket. Defaults to
+            ``max(1, rate)``.
+
+        :param float min_rate, max_rate: Bounds of the adaptive rate. None
+            means no upper bound.
+
+        :param float rate_step: Rate increase after each success.
+
+        :param int concurrency: Initial number of concurrent calls.
+
+        :param int min_concurrency, max_concurrency: Bounds of the adaptive
+            concurrency.
+
+        :param float target_latency: If given, calls slower than this (in
+            seconds) are considered as a sign of overload.
+
+        :param float decrease_factor: Factor applied to rate and concurrency
+            on overload.
+
+        :param float cooldown: Minimum time, in seconds, between two
+            decreases (the calls in flight at that time are likely to fail
+            as well).
+
+        :param int max_retries: Number of retries of a failing call.
+
+        :param float backoff, max_backoff: Base and maximum delay between
+            retries, in seconds.
+        """
+        self._rate = float(rate)
+        self.burst = burst
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.rate_step = rate_step
+
+        self._concurrency = float(concurrency)
+        self.min_concurrency = min_concurrency
+        self.max_concurrency = max_concurrency
+
+        self.target_latency = target_latency
+        self.decrease_factor = decrease_factor
+        self.cooldown = cooldown
+
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+
+        self._cond = threading.Condition()
+        self._tokens = self._capacity()
+        self._last_refill = time.monotonic()
+        self._blocked_until = 0
+        self._last_decrease = 0
+        self._in_flight = 0
+        self._waiting = 0
+        self._async_waiters = set()  # (loop, asyncio.Event) of the tasks in acquire_async
+
+        self.calls = 0
+        self.retries = 0
+        self.throttled = 0
+        self.errors = 0
+
+    # Monitoring
+
+    @property
+    def rate(self):
+        """Current number of calls per second."""
+        return self._rate
+
+    @property
+    def concurrency(self):
+        """Current maximum number of concurrent calls."""
+        return int(self._concurrency)
+
+    @property
+    def in_flight(self):
+        return self._in_flight
+
+    @property
+    def queue_depth(self):
+        """Number of callers waiting for their turn."""
+        return self._waiting
+
+    def stats(self):
+        with self._cond:
+            return {"rate": self._rate,
+                    "concurrency": int(self._concurrency),
+                    "in_flight": self._in_flight,
+                    "queue_depth": self._waiting,
+                    "calls": self.calls,
+                    "retries": self.retries,
+                    "throttled": self.throttled,
+                    "errors": self.errors}
+
+    # Admission
+
+    def _capacity(self):
+        return self.burst if self.burst is not None else max(1.0, self._rate)
+
+    def _try_acquire(self):
+        # Take a slot if possible (returns 0). Otherwise, return the time to
+        # wait before trying again, or None to wait for a release. Called
+        # with self._cond held.
+        now = time.monotonic()
+        self._tokens = min(self._capacity(), self._tokens + (now - self._last_refill) * self._rate)
+        self._last_refill = now
+
+        if now < self._blocked_until:
+            return self._blocked_until - now
+        if self._in_flight >= int(self._concurrency):
+            return None
+        if self._tokens < 1:
+            return (1 - self._tokens) / self._rate
+
+        self._tokens -= 1
+        self._in_flight += 1
+        self.calls += 1
+        return 0
+
+    def acquire(self):
+        """
+        Wait until a call is allowed. Must be followed by :meth:`release`.
+        """
+        with self._cond:
+            self._waiting += 1
+            try:
+                while True:
+                    wait = self._try_acquire()
+                    if wait == 0:
+                        return
+                    self._cond.wait(timeout=wait)
+            finally:
+                self._waiting -= 1
+
+    async def acquire_async(self):
+        """
+        Async version of :meth:`acquire`.
+        """
+        # The limiter may be shared with threads and other event loops: wait
+        # on an event of this loop, set by _notify, instead of the condition
+        # (which would block the event loop)
+        loop = asyncio.get_running_loop()
+        waiter = (loop, asyncio.Event())
+        with self._cond:
+            self._waiting += 1
+            self._async_waiters.add(waiter)
+        try:
+            while True:
+                with self._cond:
+                    wait = self._try_acquire()
+                    if wait != 0:
+                        waiter[1].clear()
+                if wait == 0:
+                    return
+                try:
+                    await asyncio.wait_for(waiter[1].wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            with self._cond:
+                self._waiting -= 1
+                self._async_waiters.discard(waiter)
+
+    def _notify(self):
+        # Wake up the callers waiting for a slot. Called with self._cond held.
+        self._cond.notify_all()
+        for loop, event in self._async_waiters:
+            loop.call_soon_threadsafe(event.set)
+
+    def release(self, latency=None, overload=False, retry_after=None):
+        """
+        Free the slot taken by :meth:`acquire`, and adapt the limits.
+
+        :param float latency: Duration of the call, in seconds.
+
+        :param bool overload: The call failed because of the load of the
+            service.
+
+        :param float retry_after: Delay asked by the service, in seconds.
+        """
+        with self._cond:
+            self._in_flight -= 1
+            now = time.monotonic()
+            if retry_after:
+                self._blocked_until = max(self._blocked_until, now + retry_after)
+
+            if self.target_latency is not None and latency is not None and latency > self.target_latency:
+                overload = True
+
+            if overload:
+                if now - self._last_decrease >= self.cooldown:
+                    self._last_decrease = now
+                    self._rate = max(self.min_rate, self._rate * self.decrease_factor)
+                    self._concurrency = max(self.min_concurrency, self._concurrency * self.decrease_factor)
+                    self._tokens = min(self._tokens, self._capacity())
+                    logger.info("%s: overload, rate=%.2f/s, concurrency=%d",
+                                self.__class__.__name__, self._rate, self._concurrency)
+            else:
+                self._rate += self.rate_step
+                if self.max_rate is not None:
+                    self._rate = min(self.max_rate, self._rate)
+                self._concurrency = min(self.max_concurrency, self._concurrency + 1 / self._concurrency)
+            self._notify()
+
+    # Calls
+
+    def _classify(self, error):
+        # Return (retry, retry_after) for an exception raised by a call
+        if isinstance(error, GeocoderRateLimited):
+            return True, error.retry_after
+        if isinstance(error, (GeocoderUnavailable, GeocoderTimedOut)):
+            return True, None
+        if type(error) is GeocoderServiceError: # Other 5xx errors in geopy
+            return True, None
+        if isinstance(error, requests.HTTPError) and error.response is not None:
+            status = error.response.status_code
+            if status == 429 or status >= 500:
+                return True, get_retry_after(error.response.headers)
+            return False, None
+        if isinstance(error, (requests.ConnectionError, requests.Timeout, asyncio.TimeoutError, ConnectionError)):
+            return True, None
+        return False, None
+
+    def _on_error(self, error, attempt, latency):
+        # Release the slot after a failed call, and return the delay before
+        # retrying it (or re-raise the error)
+        retry, retry_after = self._classify(error)
+        self.release(latency, overload=retry, retry_after=retry_after)
+        with self._cond:
+            self.errors += 1
+            if isinstance(error, GeocoderRateLimited) or retry_after is not None:
+                self.throttled += 1
+        if not retry or attempt >= self.max_retries:
+            raise error
+
+        with self._cond:
+            self.retries += 1
+        delay = random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        logger.debug("%s: retry %d in %.2fs after %r", self.__class__.__name__, attempt + 1, delay, error)
+        return delay
+
+    def call(self, func, *args, **kwargs):
+        """
+        Call ``func(*args, **kwargs)`` when allowed, retrying on transient
+        errors.
+        """
+        attempt = 0
+        while True:
+            self.acquire()
+            start = time.monotonic()
+            try:
+                res = func(*args, **kwargs)
+            except Exception as e:
+                delay = self._on_error(e, attempt, time.monotonic() - start)
+            else:
+                self.release(time.monotonic() - start)
+                return res
+            time.sleep(delay)
+            attempt += 1
+
+    async def acall(self, func, *args, **kwargs):
+        """
+        Async version of :meth:`call`: ``func(*args, **kwargs)`` returns an
+        awaitable.
+        """
+        attempt = 0
+        while True:
+            await self.acquire_async()
+            start = time.monotonic()
+            try:
+                res = await func(*args, **kwargs)
+            except asyncio.CancelledError:
+                with self._cond:
+                    self._in_flight -= 1
+                    self._notify()
+                raise
+            except Exception as e:
+                delay = self._on_error(e, attempt, time.monotonic() - start)
+            else:
+                self.release(time.monotonic() - start)
+                return res
+            await asyncio.sleep(delay)
+            attempt += 1
+
+
+def limited_call(rate_limiter, run_async, func, *args, **kwargs):
+    """
+    Call `func` through `rate_limiter` if there is one (with
+    :meth:`AdaptiveRateLimiter.acall` if `run_async`), directly otherwise.
+    """
+    if rate_limiter is None:
+        return func(*args, **kwargs)
+    if run_async:
+        return rate_limiter.acall(func, *args, **kwargs)
+    return rate_limiter.call(func, *args, **kwargs)
@@ -0,0 +1,234 @@
+import json
+
+import numpy as np
+from geopy.adapters import GeocoderParseError, RequestsAdapter
+from geopy.location import Location
+from geopy.point import Point
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    from geopy.adapters import AioHTTPAdapter
+except ImportError:
+    AioHTTPAdapter = None
+
+__all__ = ("LazyLocation", "json_loads", "FastJSONRequestsAdapter", "FastJSONAioHTTPAdapter",
+           "ResultColumns", "result_precision", "result_id", "location_with_raw")
+
+
+def json_loads(data):
+    """
+    Decode JSON (str or bytes) with orjson if it is installed, with the
+    standard library otherwise.
+    """
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+class FastJSONRequestsAdapter(RequestsAdapter):
+    """
+    geopy requests adapter decoding the answers with :func:`json_loads`.
+    Use with ``adapter_factory=FastJSONRequestsAdapter``.
+    """
+
+    def get_json(self, url, *, timeout, headers):
+        resp = self._request(url, timeout=timeout, headers=headers)
+        try:
+            return json_loads(resp.content)
+        except ValueError:
+            raise GeocoderParseError("Could not deserialize using deserializer:\n%s" % resp.text)
+
+
+if AioHTTPAdapter is not None:
+    class FastJSONAioHTTPAdapter(AioHTTPAdapter):
+        """
+        geopy aiohttp adapter decoding the answers with :func:`json_loads`.
+        """
+
+        async def get_json(self, url, *, timeout, headers):
+            with self._normalize_exceptions():
+                async with self._request(url, timeout=timeout, headers=headers) as resp:
+                    await self._raise_for_status(resp)
+                    try:
+                        return json_loads(await resp.read())
+                    except ValueError:
+                        raise GeocoderParseError("Could not deserialize using deserializer:\n%s"
+                                                 % (await resp.text()))
+else:
+    FastJSONAioHTTPAdapter = None
+
+
+class LazyLocation(Location):
+    """
+    A :class:`geopy.location.Location` whose address and point are only
+    decoded from the raw answer when they are accessed, by
+    ``address_of(raw)`` and ``point_of(raw)`` (which returns
+    ``(latitude, longitude)``).
+
+    Accessing ``raw`` (precision, ids...) or only the coordinates never
+    builds the address string.
+    """
+
+    __slots__ = ("_address_of", "_point_of")
+
+    def __init__(self, raw, address_of, point_of):
+        if raw is None:
+            raise TypeError("`raw` must not be None")
+        self._raw = raw
+        self._address_of = address_of
+        self._point_of = point_of
+
+    @property
+    def address(self):
+        address_of = self._address_of
+        if address_of is not None:
+            self._address = address_of(self._raw)
+            self._address_of = None
+        return self._address
+
+    @property
+    def point(self):
+        point_of = self._point_of
+        if point_of is not None:
+            self._point = Point(point_of(self._raw))
+            self._point_of = None
+        return self._point
+
+    @property
+    def latitude(self):
+        return self.point[0]
+
+    @property
+    def longitude(self):
+        return self.point[1]
+
+    @property
+    def altitude(self):
+        return self.point[2]
+
+    def _as_tuple(self):
+        point = self.point
+        return self.address, (point[0], point[1])
+
+    def __getitem__(self, index):
+        return self._as_tuple()[index]
+
+    def __iter__(self):
+        return iter(self._as_tuple())
+
+    def __len__(self):
+        return 2
+
+    def __str__(self):
+        return self.address
+
+    def __repr__(self):
+        return "Location(%s, (%s, %s, %s))" % (self.address, self.latitude, self.longitude, self.altitude)
+
+    def __eq__(self, other):
+        return (isinstance(other, Location) and
+                self.address == other.address and
+                self.point == other.point and
+                self.raw == other.raw)
+
+    def __getstate__(self):
+        return self.address, self.point, self._raw
+
+    def __setstate__(self, state):
+        super().__setstate__(state)
+        self._address_of = None
+        self._point_of = None
+
+
+def location_with_raw(location, raw):
+    """
+    Copy of a :class:`geopy.location.Location` with another raw answer
+    (e.g. a tagged copy of the original one, which may be cached or shared).
+    The address and point of a :class:`LazyLocation` are still only decoded
+    when they are accessed.
+    """
+    if isinstance(location, LazyLocation):
+        res = LazyLocation(raw, location._address_of, location._point_of)
+        if location._address_of is None:
+            res._address = location._address
+        if location._point_of is None:
+            res._point = location._point
+        return res
+    return Location(location.address, location.point, raw)
+
+
+def result_precision(raw):
+    """
+    Precision of a result, from its raw answer: BeST ``precision`` (set by
+    the cascade) or Pelias ``layer``.
+    """
+    if "precision" in raw:
+        return raw["precision"]
+    if "properties" in raw:
+        return raw["properties"].get("layer")
+    return None
+
+
+def result_id(raw):
+    """
+    Identifier of a result in the provider data (BeST id, Pelias gid, OSM
+    place id of NominatimWrapper).
+    """
+    if "id" in raw:
+        return raw["id"]
+    if "properties" in raw:
+        return raw["properties"].get("gid", raw["properties"].get("id"))
+    if "output" in raw:
+        return raw["output"].get("place_id")
+    return None
+
+
+class ResultColumns:
+    """
+    Preallocated columns (lat, lon, precision, id, error) for the results
+    of `n` queries, filled by :meth:`set` in any order.
+
+    One result per query: lists (``exactly_one=False``) and raw answers
+    (``return_raw=True``) are rejected.
+    """
+
+    def __init__(self, n):
+        self.lat = np.full(n, np.nan)
+        self.lon = np.full(n, np.nan)
+        self.precision = np.full(n, None, dtype=object)
+        self.id = np.full(n, None, dtype=object)
+        self.error = np.full(n, None, dtype=object)
+
+    def set(self, index, location, error=None):
+        if error is not None:
+            self.error[index] = repr(error)
+            return
+        if location is None:
+            return
+        if not isinstance(location, Location):
+            raise TypeError(f"ResultColumns expects one Location per query, got {type(location).__name__} "
+                            f"(exactly_one=False and return_raw=True are not supported)")
+        point = location.point
+        self.lat[index] = point[0]
+        self.lon[index] = point[1]
+        raw = location.raw
+        self.precision[index] = result_precision(raw)
+        self.id[index] = result_id(raw)
+
+    def to_dict(self):
+        return {"lat": self.lat, "lon": self.lon, "precision": self.precision, "id": self.id,
+                "error": self.error}
+
+    def to_arrow(self):
+        """
+        The columns as a :class:`pyarrow.Table` (precision dictionary-encoded).
+        """
+        import pyarrow as pa
+        return pa.table({"lat": self.lat, "lon": self.lon,
+                         "precision": pa.array(self.precision, type=pa.string()).dictionary_encode(),
+                         "id": pa.array(self.id, type=pa.string()),
+                         "error": pa.array(self.error, type=pa.string())})
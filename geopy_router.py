@@ -0,0 +1,339 @@
+import collections
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import numpy as np
+from geopy.adapters import BaseAsyncAdapter
+from geopy.exc import ConfigurationError
+from geopy.util import logger
+
+from geopy_batch import BatchGeocoder
+from geopy_results import location_with_raw
+
+__all__ = ("GeocoderRouter", "ProviderStats")
+
+
+class ProviderStats:
+    """
+    Online statistics of one provider: number of calls, results found,
+    empty results and errors, and a window of the latest latencies (for the
+    percentiles).
+    """
+
+    def __init__(self, window=200):
+        self.calls = 0
+        self.found = 0
+        self.empty = 0
+        self.errors = 0
+        self.wins = 0
+        self.latencies = collections.deque(maxlen=window)
+        self._p95 = None
+        self._lock = threading.Lock()
+
+    def record(self, latency, found, error):
+        with self._lock:
+            self.calls += 1
+            if error:
+                self.errors += 1
+            elif found:
+                self.found += 1
+            else:
+                self.empty += 1
+            self.latencies.append(latency)
+            self._p95 = None
+
+    def win(self):
+        with self._lock:
+            self.wins += 1
+
+    def percentile(self, q):
+        with self._lock:
+            latencies = list(self.latencies)
+        return float(np.percentile(latencies, q)) if latencies else None
+
+    @property
+    def p95(self):
+        p95 = self._p95
+        if p95 is None:
+            p95 = self._p95 = self.percentile(95)
+        return p95
+
+    @property
+    def success_rate(self):
+        return self.found / self.calls if self.calls else None
+
+    def expected_latency(self):
+        """
+        Expected time to get a result from this provider: mean latency
+        divided by the success rate (None without observations).
+        """
+        with self._lock:
+            if not self.calls:
+                return None
+            mean = sum(self.latencies) / len(self.latencies)
+            return mean / max(self.found / self.calls, 0.01)
+
+    def as_dict(self):
+        p50, p95 = self.percentile(50), self.percentile(95)
+        return {"calls": self.calls, "found": self.found, "empty": self.empty, "errors": self.errors,
+                "wins": self.wins, "success_rate": self.success_rate,
+                "latency_p50": p50, "latency_p95": p95}
+
+
+class GeocoderRouter(BatchGeocoder):
+    """
+    Route queries to several geocoders (BestAddress, Pelias,
+    NominatimWrapper, CachedGeocoder...), with one of the policies:
+
+    - ``"fallback"``: call the providers one after the other, until one
+      returns a result (an empty result or an error moves to the next one);
+    - ``"hedged"``: as "fallback", but if a provider has not answered within
+      its p95 latency, also call the next one, and return the first result
+      found;
+    - ``"fastest"``: call all the providers at once, and return the first
+      result found.
+
+    The latency and success rate of each provider are tracked online
+    (:meth:`stats`). With ``adaptive=True``, the providers are tried by
+    increasing expected time to a result (mean latency / success rate);
+    providers with less than ``min_samples`` observations are tried first,
+    so that every provider gets observed. Otherwise, they are tried in the
+    given order.
+
+    The name of the provider is added to the raw data of the results
+    (``location.raw["provider"]``), in copies of the locations returned by
+    the provider.
+
+    Usage::
+
+        router = GeocoderRouter({"best": BestAddress(...), "pelias": Pelias(...)}, policy="hedged")
+        location = router.geocode({"street": ..., "housenumber": ..., ...})
+        location.raw["provider"]
+        router.stats()
+
+    Only synchronous geocoders are supported.
+    """
+
+    policies = ("fallback", "hedged", "fastest")
+
+    # Not a geopy Geocoder: no HTTP adapter (used by BatchGeocoder)
+    adapter = None
+
+    def __init__(self, geocoders, policy="fallback", *, adaptive=False, min_samples=20,
+                 hedge_delay=None, default_hedge_delay=1.0, min_hedge_delay=0.01, window=200,
+                 max_threads=32):
+        """
+        :param geocoders: Dict of geocoders, by provider name (in the order
+            of preference), or list of geocoders (named after their class).
+
+        :param str policy: "fallback", "hedged" or "fastest".
+
+        :param bool adaptive: Reorder the providers according to their
+            observed latency and success rate.
+
+        :param int min_samples: Number of calls of each provider before
+            adapting the order.
+
+        :param float hedge_delay: Fixed delay (in seconds) before hedging. If
+            None, the p95 latency of the provider being waited for
+            (`default_hedge_delay` until it has `min_samples` calls), at
+            least `min_hedge_delay`.
+
+        :param int window: Number of latest latencies kept per provider.
+
+        :param int max_threads: Size of the thread pool calling the
+            providers ("hedged" and "fastest").
+        """
+        if policy not in self.policies:
+            raise ConfigurationError(f"Unknown policy '{policy}'. Valid values are {', '.join(self.policies)}")
+        if not isinstance(geocoders, dict):
+            geocoders = {type(g).__name__: g for g in geocoders}
+        if not geocoders:
+            raise ConfigurationError("At least one geocoder is required")
+        for name, geocoder in geocoders.items():
+            if isinstance(getattr(geocoder, "adapter", None), BaseAsyncAdapter):
+                raise ConfigurationError(f"Geocoder '{name}' has an async adapter: not supported by GeocoderRouter")
+
+        self.geocoders = geocoders
+        self.policy = policy
+        self.adaptive = adaptive
+        self.min_samples = min_samples
+        self.hedge_delay = hedge_delay
+        self.default_hedge_delay = default_hedge_delay
+        self.min_hedge_delay = min_hedge_delay
+        self.provider_stats = {name: ProviderStats(window) for name in geocoders}
+        self.hedges = 0
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_threads) if policy != "fallback" else None
+
+    @property
+    def max_workers_cap(self):
+        caps = [getattr(g, "max_workers_cap", None) for g in self.geocoders.values()]
+        caps = [cap for cap in caps if cap is not None]
+        return min(caps) if caps else None
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def order(self):
+        """
+        Names of the providers, in the order they are tried.
+        """
+        names = list(self.geocoders)
+        if not self.adaptive:
+            return names
+
+        def key(name):
+            stats = self.provider_stats[name]
+            if stats.calls < self.min_samples:
+                return 0, 0.0
+            return 1, stats.expected_latency()
+        # Stable sort: ties keep the configured order
+        return sorted(names, key=key)
+
+    def _delay(self, name):
+        if self.hedge_delay is not None:
+            return self.hedge_delay
+        stats = self.provider_stats[name]
+        if stats.calls < self.min_samples:
+            return self.default_hedge_delay
+        return max(stats.p95, self.min_hedge_delay)
+
+    def _call(self, name, method, query, kwargs):
+        # Call one provider and record its latency and outcome
+        start = time.perf_counter()
+        try:
+            res = getattr(self.geocoders[name], method)(query, **kwargs)
+        except Exception:
+            self.provider_stats[name].record(time.perf_counter() - start, False, True)
+            raise
+        self.provider_stats[name].record(time.perf_counter() - start, _is_found(res), False)
+        return res
+
+    def _result(self, name, res):
+        self.provider_stats[name].win()
+        # Tagged copies: the locations of the provider may be cached or shared
+        if isinstance(res, list):
+            return [_with_provider(loc, name) for loc in res]
+        return _with_provider(res, name)
+
+    def _route(self, method, query, kwargs):
+        if self.policy == "fallback":
+            return self._route_fallback(method, query, kwargs)
+        return self._route_concurrent(method, query, kwargs, hedged=self.policy == "hedged")
+
+    def _route_fallback(self, method, query, kwargs):
+        error, answered = None, False
+        for name in self.order():
+            try:
+                res = self._call(name, method, query, kwargs)
+            except Exception as e:
+                logger.info("GeocoderRouter: %s failed: %r", name, e)
+                error = e
+                continue
+            answered = True
+            if _is_found(res):
+                return self._result(name, res)
+        return self._no_result(None if answered else error)
+
+    def _route_concurrent(self, method, query, kwargs, hedged):
+        names = iter(self.order())
+        pending = {}
+        error, answered = None, False
+        deadline = None # Hedging: time to call the next provider
+
+        def start(name):
+            nonlocal deadline
+            pending[self._executor.submit(self._call, name, method, query, kwargs)] = name
+            deadline = time.monotonic() + self._delay(name)
+
+        for name in names:
+            start(name)
+            if hedged:
+                break
+
+        while pending:
+            # The delay runs from the start of the last provider, not from
+            # the last answer (of an earlier provider, without result)
+            timeout = max(0.0, deadline - time.monotonic()) if hedged else None
+            done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            if not done:
+                # Slow provider: also ask the next one
+                name = next(names, None)
+                if name is not None:
+                    with self._lock:
+                        self.hedges += 1
+                    start(name)
+                else:
+                    hedged = False # Nothing left to start: wait for the running calls
+                continue
+            for future in done:
+                name = pending.pop(future)
+                try:
+                    res = future.result()
+                except Exception as e:
+                    logger.info("GeocoderRouter: %s failed: %r", name, e)
+                    error = e
+                    res = None
+                else:
+                    answered = True
+                if _is_found(res):
+                    # The other calls finish in the background (and are
+                    # still recorded in the statistics)
+                    return self._result(name, res)
+            if hedged and not pending:
+                name = next(names, None)
+                if name is not None:
+                    start(name)
+        return self._no_result(None if answered else error)
+
+    def _no_result(self, error):
+        # Every provider had no result: raise only if none of them answered
+        if error is not None:
+            raise error
+        return None
+
+    def geocode(self, query, **kwargs):
+        """
+        Geocode `query` with the providers, according to the policy.
+
+        :param kwargs: Passed to the ``geocode`` method of every provider.
+
+        :return: The first result found, or None. If every provider raised
+            an exception, the last one is raised.
+        """
+        return self._route("geocode", query, kwargs)
+
+    def reverse(self, query, **kwargs):
+        """
+        Reverse geocode `query` with the providers (see :meth:`geocode`).
+        """
+        return self._route("reverse", query, kwargs)
+
+    def stats(self):
+        """
+        Statistics of each provider (calls, found, empty, errors, wins,
+        success rate, p50 and p95 latency in seconds), the current order
+        and the number of hedged calls.
+        """
+        return {"providers": {name: stats.as_dict() for name, stats in self.provider_stats.items()},
+                "order": self.order(),
+                "hedges": self.hedges}
+
+
+def _is_found(res):
+    return res is not None and (not isinstance(res, list) or len(res) > 0)
+
+
+def _with_provider(loc, name):
+    if not isinstance(loc.raw, dict):
+        return loc
+    return location_with_raw(loc, dict(loc.raw, provider=name))
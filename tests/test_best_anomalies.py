@@ -0,0 +1,286 @@
+from functools import reduce
+
+import numpy as np
+import pandas as pd
+import pytest
+
+gpd = pytest.importorskip("geopandas")
+from shapely.geometry import LineString
+
+from best_anomalies import aggregate_addresses, compute_street_metrics, consolidate_metrics, coordinate_keys
+
+ADDRESS_COLUMNS = ["streetname", "house_number", "house_number_num", "postcode", "postname", "municipality",
+                   "municipality_id"]
+
+
+def _addresses(n=2000, seed=0):
+    # Random addresses, with boxes (rows sharing address and point),
+    # addresses at several points, several addresses at the same point and
+    # missing names
+    rng = np.random.default_rng(seed)
+    streets = rng.integers(0, 20, n)
+    house_number_num = rng.integers(1, 60, n)
+    df = pd.DataFrame({
+        "streetname": [f"Rue {s}" for s in streets],
+        "house_number": [f"{h}{'b' if h % 7 == 0 else ''}" for h in house_number_num],
+        "house_number_num": house_number_num,
+        "postcode": [str(1000 + s % 3) for s in streets],
+        "postname": [f"Ville {s % 3}" for s in streets],
+        "municipality": [f"Commune {s % 2}" for s in streets],
+        "municipality_id": [str(21000 + s % 2) for s in streets],
+        "address_id": [f"id{i}" for i in range(n)],
+        "x": 150000.0 + streets * 1000 + house_number_num * 10,
+        "y": 170000.0 + streets * 500.0,
+    })
+    boxes = df.sample(600, replace=True, random_state=1).assign(
+        address_id=lambda d: d.address_id + "/box" + pd.Series(np.arange(len(d)).astype(str), index=d.index))
+    moved = df.sample(100, random_state=2).assign(x=lambda d: d.x + 5,
+                                                  address_id=lambda d: d.address_id + "/moved")
+    df = pd.concat([df, boxes, moved], ignore_index=True).sample(frac=1, random_state=3).reset_index(drop=True)
+    df["streetname"] = df.streetname.astype(object)
+    df["postname"] = df.postname.astype(object)
+    df.loc[df.sample(100, random_state=4).index, "streetname"] = np.nan
+    df.loc[df.sample(100, random_state=5).index, "postname"] = np.nan
+    return gpd.GeoDataFrame(df.drop(columns=["x", "y"]), geometry=gpd.points_from_xy(df.x, df.y), crs="epsg:31370")
+
+
+def _aggregate_by_wkb(full_region):
+    # Former version (BestAddressAnomalies notebook): groupby on the WKB
+    full_region_wkb = full_region.assign(geometry_wkb=full_region.geometry.apply(lambda geom: geom.wkb))
+    region = full_region_wkb.fillna("[na]").groupby(ADDRESS_COLUMNS + ["geometry_wkb"]).address_id.apply(list)\
+        .reset_index()
+    region = region.merge(full_region_wkb[["geometry_wkb", "geometry"]].drop_duplicates())\
+        .drop("geometry_wkb", axis=1)
+    return gpd.GeoDataFrame(region)
+
+
+def _comparable(region):
+    region = pd.DataFrame(region).assign(geometry=region.geometry.to_wkb(hex=True),
+                                         address_id=region.address_id.apply(tuple))
+    return region.astype(str).sort_values(list(region.columns)).reset_index(drop=True)
+
+
+def test_aggregate_addresses_as_wkb_groupby():
+    addresses = _addresses()
+    expected = _aggregate_by_wkb(addresses)
+    res = aggregate_addresses(addresses)
+
+    assert list(res.columns) == list(expected.columns)
+    assert res.crs == addresses.crs
+    assert len(res) < len(addresses)
+    pd.testing.assert_frame_equal(_comparable(res), _comparable(expected))
+
+
+def test_aggregate_addresses_na_and_shared_points():
+    addresses = gpd.GeoDataFrame({
+        "streetname": ["Rue A", "Rue A", None, "Rue A", "Rue B"],
+        "house_number": ["1", "1", "1", "1", "1"],
+        "house_number_num": [1, 1, 1, 1, 1],
+        "postcode": ["1000"] * 5,
+        "postname": [None, None, None, None, None],
+        "municipality": ["Bruxelles"] * 5,
+        "municipality_id": ["21004"] * 5,
+        "address_id": ["a", "b", "c", "d", "e"],
+    }, geometry=gpd.points_from_xy([0.0, 0.0, 0.0, 1.0, 0.0], [0.0] * 5), crs="epsg:31370")
+
+    res = aggregate_addresses(addresses)
+
+    # Boxes a and b share address and point; d is at another point; c (no
+    # street name) and e are other addresses at the same point
+    assert res.address_id.tolist() == [["a", "b"], ["d"], ["e"], ["c"]]
+    assert res.streetname.tolist() == ["Rue A", "Rue A", "Rue B", "[na]"]
+    assert (res.postname == "[na]").all()
+
+
+def test_coordinate_keys_resolution():
+    points = gpd.GeoSeries(gpd.points_from_xy([0.0, 0.004, 0.02], [1.0, 1.0, 1.0]))
+    x, y = coordinate_keys(points)
+    assert len(set(x)) == 3 and len(set(y)) == 1
+    x, y = coordinate_keys(points, resolution=0.01)
+    assert x.tolist() == [0, 0, 2]
+
+
+def _street_addresses(n_streets=150, seed=0):
+    # Addresses along straight streets, sorted as in the notebook, with
+    # outliers, addresses at the start of the street and duplicated numbers
+    rng = np.random.default_rng(seed)
+    rows = []
+    for s in range(n_streets):
+        postcode = str(rng.choice([1000, 1050, 1060]))
+        x0, y0 = rng.uniform(0, 1e5, 2)
+        angle = rng.uniform(0, 2 * np.pi)
+        for _ in range(rng.integers(1, 40)):
+            house_number_num = int(rng.integers(1, 120))
+            t = house_number_num * 5 + rng.normal(0, 3)
+            if rng.random() < 0.05:
+                t += rng.uniform(200, 2000)
+            x, y = x0 + t * np.cos(angle), y0 + t * np.sin(angle)
+            if rng.random() < 0.1:
+                x, y = x0, y0
+            rows.append({"streetname": f"Street {s % 100}", "postcode": postcode,
+                         "house_number": f"{house_number_num}{'A' if rng.random() < 0.1 else ''}",
+                         "house_number_num": house_number_num, "address_id": [str(len(rows))],
+                         "x": round(x, 2), "y": round(y, 2)})
+    df = pd.DataFrame(rows)
+    region = gpd.GeoDataFrame(df.drop(columns=["x", "y"]), geometry=gpd.points_from_xy(df.x, df.y), crs="epsg:3857")
+    region = region.sort_values(["postcode", "streetname", "house_number_num"], kind="stable")
+    region.index = rng.permutation(len(region))
+    return region
+
+
+def _line_sinuosity(geom):
+    straight_dist = geom.interpolate(0).distance(geom.interpolate(1, normalized=True))
+    if straight_dist == 0.0:
+        return 0.0 if geom.length == 0.0 else float("inf")
+    return geom.length / straight_dist
+
+
+def _bloc_sinuosity(street_side):
+    if street_side.geometry.nunique() < 3:
+        return pd.NA
+    return _line_sinuosity(LineString(street_side.reset_index().geometry))
+
+
+def _sliding_sinuosity(street_side, windows_size=5):
+    if street_side.geometry.nunique() < 3:
+        return pd.NA
+    geometry = street_side.geometry
+    return np.mean([_line_sinuosity(LineString(geometry.iloc[i:i + windows_size].reset_index(drop=True)))
+                    for i in range(0, max(1, geometry.shape[0] - windows_size))])
+
+
+def _bloc_length(street_side):
+    if street_side.geometry.nunique() < 3:
+        return pd.NA
+    return LineString(street_side.reset_index().geometry).length
+
+
+def _street_metrics_by_parity(region):
+    # Former version (BestAddressAnomalies notebook): one groupby per parity
+    # and metric
+    keys = ["streetname", "postcode", "parity"]
+
+    def per_parity(fn, name, ascending=True):
+        res = []
+        for parity in [0, 1]:
+            values = region[region.house_number_num.mod(2) == parity].groupby(["streetname", "postcode"]).apply(fn)
+            values = values.sort_values(na_position="first", ascending=ascending).rename(name).reset_index()
+            res.append(values.assign(parity=parity))
+        return pd.concat(res)
+
+    def ranked(table, name):
+        return table.sort_values(name, ascending=False).reset_index(drop=True)
+
+    sinuosity = per_parity(_bloc_sinuosity, "sinuosity")
+    sinuosity = ranked(sinuosity[sinuosity.sinuosity.notnull() & (sinuosity.sinuosity < 10**10)], "sinuosity")
+    sw_sinuosity = per_parity(_sliding_sinuosity, "sw_sinuosity")
+    sw_sinuosity = ranked(sw_sinuosity[sw_sinuosity.sw_sinuosity.notnull() & (sw_sinuosity.sw_sinuosity < 10**10)],
+                          "sw_sinuosity")
+    length = ranked(per_parity(_bloc_length, "length", ascending=False), "length")
+
+    region_pars = []
+    for parity in [0, 1]:
+        region_par = region[region.house_number_num.mod(2) == parity].copy()
+        region_par["dist_to_prev"] = region_par.distance(region_par.shift(1))
+        region_par["dist_to_prev2"] = region_par.distance(region_par.shift(2))
+        is_new_bloc = (region_par[["streetname", "postcode"]] != region_par[["streetname", "postcode"]].shift(1))\
+            .any(axis=1)
+        region_par.dist_to_prev = region_par.dist_to_prev.where(~is_new_bloc, pd.NA)
+        region_par.dist_to_prev2 = region_par.dist_to_prev2.where(~is_new_bloc, pd.NA)
+        region_par.dist_to_prev2 = region_par.dist_to_prev2.where(~is_new_bloc.shift(1).astype(bool), pd.NA)
+        region_pars.append(region_par.assign(parity=parity))
+    region_pars = pd.concat(region_pars)
+    region_pars["prev_to_prev2_ratio"] = region_pars.dist_to_prev / region_pars[["dist_to_prev2"]].assign(m=10)\
+        .max(axis=1, skipna=False)
+
+    def idxmax(col):
+        # Recent pandas versions raise on groups without values
+        return region_pars[region_pars[col].notnull()].groupby(keys)[col].idxmax()
+
+    idx_max = idxmax("dist_to_prev")
+    dist_to_prev = ranked(region_pars.loc[idx_max.values], "dist_to_prev")\
+        [keys + ["dist_to_prev", "house_number", "house_number_num"]]
+
+    delta = region_pars.loc[idx_max.values].rename(columns={"dist_to_prev": "max_dist_to_prev"})
+    delta = delta.merge(region_pars.groupby(keys).dist_to_prev.median().rename("median_dist_to_prev").reset_index())
+    delta["median_dist_to_prev"] = delta.median_dist_to_prev.where(delta.median_dist_to_prev > 5, 0)
+    delta["delta_dist_to_prev"] = delta.max_dist_to_prev / delta.median_dist_to_prev
+    delta = ranked(delta[delta.delta_dist_to_prev.notnull() & (delta.delta_dist_to_prev < np.inf)],
+                   "delta_dist_to_prev")[keys + ["house_number", "delta_dist_to_prev"]]
+
+    idx_max = idxmax("prev_to_prev2_ratio")
+    prev_to_prev2_ratio = ranked(region_pars.loc[idx_max.values], "prev_to_prev2_ratio")\
+        [keys + ["prev_to_prev2_ratio", "house_number"]]
+
+    return {"dist_to_prev": dist_to_prev, "delta_dist_to_prev": delta, "sinuosity": sinuosity,
+            "sw_sinuosity": sw_sinuosity, "length": length, "prev_to_prev2_ratio": prev_to_prev2_ratio}
+
+
+def _ranked_metrics(metrics):
+    # As the notebook, before consolidating: ranking, and house_number
+    # renamed after the metric
+    res = {}
+    for name, table in metrics.items():
+        table = table.reset_index(drop=True).assign(**{f"{name}_ranking": lambda t: t.index + 1})
+        res[name] = table.rename(columns={"house_number": f"{name}_house_number"})
+    return res
+
+
+@pytest.fixture(scope="module")
+def street_metrics():
+    region = _street_addresses()
+    return compute_street_metrics(region), _street_metrics_by_parity(region)
+
+
+def test_street_metrics_as_per_parity_groupby(street_metrics):
+    metrics, expected = street_metrics
+    keys = ["streetname", "postcode", "parity"]
+
+    assert list(metrics) == list(expected)
+    for name, table in metrics.items():
+        assert list(table.columns) == list(expected[name].columns)
+        assert len(table) == len(expected[name]) > 0
+        # Same values, in the same (decreasing) order
+        np.testing.assert_allclose(table[name].astype(float), pd.to_numeric(expected[name][name]).astype(float),
+                                   rtol=1e-9)
+        merged = table.merge(expected[name], on=keys, how="outer", suffixes=("", "_expected"), indicator=True)
+        assert (merged._merge == "both").all()
+        np.testing.assert_allclose(merged[name].astype(float),
+                                   pd.to_numeric(merged[f"{name}_expected"]).astype(float), rtol=1e-9)
+        if "house_number" in table:
+            assert (merged.house_number == merged.house_number_expected).all()
+
+
+def test_consolidate_metrics_as_merges(street_metrics):
+    metrics, expected = street_metrics
+    keys = ["streetname", "postcode", "parity"]
+
+    res = consolidate_metrics(_ranked_metrics(metrics))
+    expected = reduce(lambda x, y: x.merge(y, how="outer"), _ranked_metrics(expected).values())\
+        .sort_values(keys).reset_index(drop=True)
+
+    assert list(res.columns) == list(expected.columns)
+    assert len(res) == len(expected)
+    for col in res.columns:
+        if col.endswith("_ranking"):
+            continue  # Ties may be ranked in another order
+        if pd.api.types.is_numeric_dtype(res[col]):
+            np.testing.assert_allclose(res[col].astype(float), pd.to_numeric(expected[col]).astype(float),
+                                       rtol=1e-9, equal_nan=True)
+        else:
+            assert (res[col].astype(object).fillna("NA") == expected[col].astype(object).fillna("NA")).all(), col
+
+
+def test_street_metrics_empty(street_metrics):
+    metrics, _ = street_metrics
+    region = _street_addresses().iloc[:0]
+
+    empty, street_points = compute_street_metrics(region, points=True)
+
+    assert len(street_points) == 0
+    for name, table in empty.items():
+        assert len(table) == 0
+        assert list(table.columns) == list(metrics[name].columns)
+    res = consolidate_metrics(_ranked_metrics(empty))
+    assert len(res) == 0
+    assert list(res.columns) == list(consolidate_metrics(_ranked_metrics(metrics)).columns)
@@ -0,0 +1,192 @@
+import hashlib
+import json
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from data_download import download_if_nexist, download_many
+
+
+class _Handler(BaseHTTPRequestHandler):
+    # Static files with an ETag, honouring Range/If-Range and If-None-Match.
+    # server.fail_after: the next response is cut after this number of bytes
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def _empty(self, status, etag=None):
+        self.send_response(status)
+        if etag is not None:
+            self.send_header("ETag", etag)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def do_GET(self):
+        server = self.server
+        server.requests.append(dict(self.headers))
+        body = server.files.get(self.path)
+        if body is None:
+            return self._empty(404)
+        etag = server.etag
+        if self.headers.get("If-None-Match") == etag:
+            return self._empty(304, etag)
+
+        start = 0
+        if self.headers.get("Range") and self.headers.get("If-Range") == etag:
+            start = int(self.headers["Range"].split("=")[1].rstrip("-"))
+            if start >= len(body):
+                return self._empty(416)
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{len(body) - 1}/{len(body)}")
+        else:
+            self.send_response(200)
+        self.send_header("ETag", etag)
+        self.send_header("Content-Length", str(len(body) - start))
+        self.end_headers()
+
+        data = body[start:]
+        if server.fail_after is not None:
+            data, server.fail_after = data[:server.fail_after], None
+            self.wfile.write(data)
+            self.wfile.flush()
+            self.close_connection = True
+            self.connection.shutdown(2)
+            return
+        self.wfile.write(data)
+
+
+@pytest.fixture
+def server():
+    srv = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+    srv.files = {"/a.zip": os.urandom(1_000_000), "/b.zip": os.urandom(100_000)}
+    srv.etag = '"v1"'
+    srv.fail_after = None
+    srv.requests = []
+    srv.url = f"http://127.0.0.1:{srv.server_port}"
+    thread = threading.Thread(target=srv.serve_forever, kwargs={"poll_interval": 0.05}, daemon=True)
+    thread.start()
+    yield srv
+    srv.shutdown()
+    srv.server_close()
+
+
+def _read(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def test_resume_after_drop(server, tmp_path):
+    path = str(tmp_path / "a.zip")
+    body = server.files["/a.zip"]
+    server.fail_after = 300_000
+
+    assert download_if_nexist(f"{server.url}/a.zip", path, sha256=hashlib.sha256(body).hexdigest())
+
+    assert _read(path) == body
+    assert not os.path.exists(path + ".part")
+    # The second request resumes where the first one stopped
+    assert len(server.requests) == 2
+    resumed = server.requests[1]
+    assert int(resumed["Range"].split("=")[1].rstrip("-")) > 0
+    assert resumed["If-Range"] == '"v1"'
+    with open(path + ".meta.json") as f:
+        meta = json.load(f)
+    assert meta["etag"] == '"v1"'
+    assert meta["sha256"] == hashlib.sha256(body).hexdigest()
+
+
+def test_resume_in_next_call(server, tmp_path):
+    path = str(tmp_path / "a.zip")
+    server.fail_after = 300_000
+    with pytest.raises(OSError):
+        download_if_nexist(f"{server.url}/a.zip", path, retries=0)
+    assert not os.path.exists(path)
+    offset = os.path.getsize(path + ".part")
+    assert 0 < offset < len(server.files["/a.zip"])
+
+    assert download_if_nexist(f"{server.url}/a.zip", path)
+    assert _read(path) == server.files["/a.zip"]
+    assert server.requests[-1]["Range"] == f"bytes={offset}-"
+
+
+def test_restart_when_etag_changed(server, tmp_path):
+    path = str(tmp_path / "a.zip")
+    server.fail_after = 300_000
+    with pytest.raises(OSError):
+        download_if_nexist(f"{server.url}/a.zip", path, retries=0)
+
+    # The file changed upstream: If-Range does not match, the whole new file is sent
+    server.files["/a.zip"] = os.urandom(800_000)
+    server.etag = '"v2"'
+    assert download_if_nexist(f"{server.url}/a.zip", path)
+
+    assert _read(path) == server.files["/a.zip"]
+    assert server.requests[-1]["If-Range"] == '"v1"'
+    with open(path + ".meta.json") as f:
+        assert json.load(f)["etag"] == '"v2"'
+
+
+def test_existing_file_not_downloaded(server, tmp_path):
+    path = str(tmp_path / "b.zip")
+    assert download_if_nexist(f"{server.url}/b.zip", path)
+    assert not download_if_nexist(f"{server.url}/b.zip", path)
+    assert len(server.requests) == 1
+
+
+def test_check_updates(server, tmp_path):
+    path = str(tmp_path / "b.zip")
+    assert download_if_nexist(f"{server.url}/b.zip", path)
+
+    # Unchanged: 304
+    assert not download_if_nexist(f"{server.url}/b.zip", path, check_updates=True)
+    assert server.requests[-1]["If-None-Match"] == '"v1"'
+    assert _read(path) == server.files["/b.zip"]
+
+    # Changed: downloaded again
+    server.files["/b.zip"] = os.urandom(50_000)
+    server.etag = '"v2"'
+    assert download_if_nexist(f"{server.url}/b.zip", path, check_updates=True)
+    assert _read(path) == server.files["/b.zip"]
+
+
+@pytest.mark.parametrize("check", [{"size": 1234}, {"sha256": "00" * 32}])
+def test_check_failed(server, tmp_path, check):
+    path = str(tmp_path / "b.zip")
+    with pytest.raises(OSError, match="failed"):
+        download_if_nexist(f"{server.url}/b.zip", path, **check)
+    assert not os.path.exists(path)
+    assert not os.path.exists(path + ".part")
+    assert not os.path.exists(path + ".part.meta.json")
+
+
+def test_range_not_satisfiable(server, tmp_path):
+    # Part left by a previous run, longer than the current file (same ETag)
+    path = str(tmp_path / "b.zip")
+    with open(path + ".part", "wb") as f:
+        f.write(os.urandom(200_000))
+    with open(path + ".part.meta.json", "w") as f:
+        json.dump({"url": f"{server.url}/b.zip", "etag": '"v1"', "last_modified": None}, f)
+
+    assert download_if_nexist(f"{server.url}/b.zip", path)
+
+    assert _read(path) == server.files["/b.zip"]
+    assert server.requests[0]["Range"] == "bytes=200000-"
+    assert "Range" not in server.requests[1]
+
+
+def test_download_many(server, tmp_path):
+    downloads = {str(tmp_path / "a.zip"): f"{server.url}/a.zip",
+                 str(tmp_path / "b.zip"): {"url": f"{server.url}/b.zip", "size": 100_000},
+                 str(tmp_path / "x.zip"): f"{server.url}/x.zip"}
+    res = download_many(downloads, return_exceptions=True)
+
+    assert res[str(tmp_path / "a.zip")] is True
+    assert res[str(tmp_path / "b.zip")] is True
+    assert isinstance(res[str(tmp_path / "x.zip")], Exception)
+    assert _read(tmp_path / "b.zip") == server.files["/b.zip"]
+
+    with pytest.raises(Exception):
+        download_many({str(tmp_path / "x.zip"): f"{server.url}/x.zip"})
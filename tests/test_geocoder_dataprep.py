@@ -0,0 +1,24 @@
+from geocoder_dataprep import canonical_key, harvest_distinct
+
+
+def test_canonical_key_exact():
+    record = {"street": "Rue de la Loi", "housenumber": "16", "postcode": "1000"}
+    assert canonical_key(record) == canonical_key(dict(reversed(list(record.items()))))
+    assert canonical_key(record) != canonical_key(dict(record, street="rue de la loi"))
+    assert canonical_key(record) != canonical_key(dict(record, street="Rue de la  Loi"))
+
+
+def test_harvest_distinct_as_sequential_loop():
+    responses = {i: {"street": ["Rue A", "rue a", "Rue A ", "Rue B"][i % 4], "n": i % 3} if i % 5 else None
+                 for i in range(100)}
+
+    # Former loop: first records not already in the list (dict equality)
+    expected = []
+    for key in range(100):
+        record = responses[key]
+        if record is not None and record not in [r for _, r in expected]:
+            expected.append((key, record))
+        if len(expected) == 10:
+            break
+
+    assert harvest_distinct(range(100), responses.get, lambda r: r, 10, max_workers=3) == expected
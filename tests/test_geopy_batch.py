@@ -0,0 +1,88 @@
+import threading
+import time
+
+import pytest
+
+from geopy_batch import BatchGeocoder
+
+
+class _Geocoder(BatchGeocoder):
+    # Sync geocoder stub: a query is a (delay, answer) pair; answers which
+    # are exceptions are raised
+    adapter = None
+
+    def __init__(self):
+        self.started = []
+        self._lock = threading.Lock()
+
+    def geocode(self, query, **kwargs):
+        delay, answer = query
+        with self._lock:
+            self.started.append(answer)
+        time.sleep(delay)
+        if isinstance(answer, Exception):
+            raise answer
+        return answer, kwargs
+
+
+def test_ordered():
+    geocoder = _Geocoder()
+    queries = [(0.2 - 0.05 * i, i) for i in range(4)]
+    res = list(geocoder.geocode_many(queries, max_workers=4, exactly_one=False))
+    assert [index for index, _, _ in res] == [0, 1, 2, 3]
+    assert [location for _, location, _ in res] == [(i, {"exactly_one": False}) for i in range(4)]
+    assert all(error is None for _, _, error in res)
+
+
+def test_unordered():
+    geocoder = _Geocoder()
+    queries = [(0.3, 0), (0.0, 1), (0.15, 2)]
+    res = list(geocoder.geocode_many(queries, max_workers=3, ordered=False))
+    assert [index for index, _, _ in res] == [1, 2, 0]
+
+
+def test_errors():
+    geocoder = _Geocoder()
+    error = ValueError("bad query")
+    res = list(geocoder.geocode_many([(0, "a"), (0, error), (0, "c")], max_workers=2))
+    assert res[1] == (1, None, error)
+    assert (res[0][1][0], res[2][1][0]) == ("a", "c")
+
+
+@pytest.mark.parametrize("ordered", [True, False])
+def test_window(ordered):
+    # The input is consumed lazily: at most 2 * max_workers queries are
+    # taken while the first one is in flight
+    geocoder = _Geocoder()
+    consumed = []
+
+    def queries():
+        for i in range(100):
+            consumed.append(i)
+            yield (0.2 if i == 0 else 0.0, i)
+
+    results = geocoder.geocode_many(queries(), max_workers=2, ordered=ordered)
+    first = next(results)
+    assert len(consumed) <= 4
+    if ordered:
+        assert first[0] == 0
+    assert len(list(results)) == 99
+
+
+def test_close_early():
+    # Closing the generator neither waits for the calls in flight nor
+    # starts the queued ones
+    geocoder = _Geocoder()
+    results = geocoder.geocode_many([(0.0, 0)] + [(0.5, i) for i in range(1, 20)], max_workers=2, ordered=False)
+    assert next(results)[0] == 0
+    start = time.monotonic()
+    results.close()
+    assert time.monotonic() - start < 0.3
+    time.sleep(0.6)
+    assert len(geocoder.started) <= 3
+
+
+@pytest.mark.parametrize("kwargs", [{"exactly_one": False}, {"return_raw": True}])
+def test_geocode_columns_one_location_per_query(kwargs):
+    with pytest.raises(ValueError, match="one Location per query"):
+        _Geocoder().geocode_columns([(0, "a")], **kwargs)
@@ -0,0 +1,447 @@
+import asyncio
+import threading
+import time
+
+import pytest
+from geopy.adapters import AioHTTPAdapter
+from geopy.location import Location
+
+from geopy_bestaddress import BestAddress
+from geopy_instrumentation import CallbackObserver
+from geopy_ratelimit import AdaptiveRateLimiter
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+needs_fcntl = pytest.mark.skipif(fcntl is None, reason="no fcntl")
+
+
+def _geocoder(**kwargs):
+    return BestAddress(domain="localhost", client_id="id", client_secret="secret", **kwargs)
+
+
+@needs_fcntl
+def test_shared_token_lock_async_does_not_block_loop(tmp_path):
+    # Another process (here: another file description) holds the shared
+    # token lock: waiting for it must let the other tasks of the loop run
+    geocoder = _geocoder(token_cache_path=str(tmp_path / "token.json"))
+    holder = open(geocoder.token_cache_path + ".lock", "a")
+    fcntl.flock(holder, fcntl.LOCK_EX)
+
+    ticks = []
+
+    async def ticker():
+        for i in range(5):
+            ticks.append(i)
+            await asyncio.sleep(0.01)
+        fcntl.flock(holder, fcntl.LOCK_UN)
+
+    async def waiter():
+        async with geocoder._shared_token_lock_async(poll_interval=0.005):
+            return len(ticks)
+
+    async def main():
+        return (await asyncio.gather(waiter(), ticker()))[0]
+
+    try:
+        assert asyncio.run(asyncio.wait_for(main(), timeout=5)) == 5
+    finally:
+        holder.close()
+
+
+@needs_fcntl
+def test_shared_token_lock_async_serializes_coroutines(tmp_path):
+    # Two instances sharing the token cache in the same event loop
+    path = str(tmp_path / "token.json")
+    geocoders = [_geocoder(token_cache_path=path) for _ in range(2)]
+    events = []
+
+    async def hold(geocoder, name):
+        async with geocoder._shared_token_lock_async(poll_interval=0.005):
+            events.append(f"{name} in")
+            await asyncio.sleep(0.05)
+            events.append(f"{name} out")
+
+    async def main():
+        await asyncio.gather(hold(geocoders[0], "a"), hold(geocoders[1], "b"))
+
+    asyncio.run(asyncio.wait_for(main(), timeout=5))
+    assert events == ["a in", "a out", "b in", "b out"]
+
+
+class _TokenFetch:
+    # _fetch_token stub: counts the token requests of all the instances
+    def __init__(self, delay=0.05):
+        self.delay = delay
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def __call__(self):
+        time.sleep(self.delay)
+        with self._lock:
+            self.calls += 1
+            return {"access_token": f"token-{self.calls}", "expires_in": 3600}
+
+
+def _expired_token():
+    return {"access_token": "expired", "expires_at": time.time() - 1}
+
+
+def _ensure_token_in_threads(geocoders, n=8):
+    barrier = threading.Barrier(n)
+
+    def ensure(geocoder):
+        barrier.wait()
+        geocoder._ensure_token()
+
+    threads = [threading.Thread(target=ensure, args=(geocoders[i % len(geocoders)], )) for i in range(n)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def test_refresh_token_single_flight():
+    # Threads sharing an expired token: only one of them asks for a new one
+    geocoder = _geocoder()
+    geocoder.token = _expired_token()
+    geocoder._fetch_token = fetch = _TokenFetch()
+
+    _ensure_token_in_threads([geocoder])
+
+    assert fetch.calls == 1
+    assert geocoder.token["access_token"] == "token-1" and geocoder._token_is_valid()
+
+
+@needs_fcntl
+def test_refresh_token_shared_between_processes(tmp_path):
+    # Instances sharing the token cache (as worker processes would): the
+    # token fetched by one of them is reused by the others
+    path = str(tmp_path / "token.json")
+    fetch = _TokenFetch()
+    geocoders = [_geocoder(token_cache_path=path) for _ in range(3)]
+    for geocoder in geocoders:
+        geocoder.token = _expired_token()
+        geocoder._fetch_token = fetch
+
+    _ensure_token_in_threads(geocoders, n=9)
+
+    assert fetch.calls == 1
+    assert [geocoder.token["access_token"] for geocoder in geocoders] == ["token-1"] * 3
+
+    # A new instance starts with the shared token
+    geocoder = _geocoder(token_cache_path=path)
+    geocoder._fetch_token = fetch
+    geocoder._ensure_token()
+    assert fetch.calls == 1 and geocoder.token["access_token"] == "token-1"
+
+
+class _ById:
+    # get_by_id stub: counts the calls per id; ids starting with "error"
+    # raise, ids starting with "missing" are not found
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.calls = []
+        self._lock = threading.Lock()
+
+    def _answer(self, id):
+        with self._lock:
+            self.calls.append(id)
+        if id.startswith("error"):
+            raise ValueError(id)
+        if id.startswith("missing"):
+            return None
+        return {"id": id}
+
+    def __call__(self, id, object_type="address", timeout=None):
+        time.sleep(self.delay)
+        return self._answer(id)
+
+    async def call_async(self, id, object_type="address", timeout=None):
+        await asyncio.sleep(self.delay)
+        return self._answer(id)
+
+
+def test_get_many_by_id_single_flight():
+    geocoder = _geocoder()
+    geocoder.get_by_id = by_id = _ById(delay=0.05)
+
+    # Two threads asking for overlapping ids at the same time
+    results = [None, None]
+
+    def fetch(i, ids):
+        results[i] = geocoder.get_many_by_id(ids, max_workers=4)
+
+    threads = [threading.Thread(target=fetch, args=(0, ["a", "b", "c", "a"])),
+               threading.Thread(target=fetch, args=(1, ["c", "b", "d"]))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert list(results[0]) == ["a", "b", "c"] and list(results[1]) == ["c", "b", "d"]
+    assert results[1]["b"] == {"id": "b"}
+    assert sorted(by_id.calls) == ["a", "b", "c", "d"]
+    assert not geocoder._inflight
+
+    # Then from the cache
+    assert geocoder.get_many_by_id(["d", "a"]) == {"d": {"id": "d"}, "a": {"id": "a"}}
+    assert len(by_id.calls) == 4
+
+
+def test_get_many_by_id_errors_and_missing():
+    geocoder = _geocoder()
+    geocoder.get_by_id = by_id = _ById()
+
+    res = geocoder.get_many_by_id(["a", "error1", "missing1"], return_exceptions=True)
+    assert res["a"] == {"id": "a"} and res["missing1"] is None
+    assert isinstance(res["error1"], ValueError)
+    with pytest.raises(ValueError):
+        geocoder.get_many_by_id(["a", "error1"])
+
+    # Errors and missing objects are not cached
+    geocoder.get_many_by_id(["missing1"])
+    assert by_id.calls.count("error1") == 2 and by_id.calls.count("missing1") == 2
+
+
+def test_get_many_by_id_async_single_flight():
+    async def main():
+        geocoder = _geocoder(adapter_factory=AioHTTPAdapter)
+        by_id = _ById(delay=0.05)
+        geocoder.get_by_id = by_id.call_async
+        first, second = await asyncio.gather(geocoder.get_many_by_id(["a", "b", "error1"], return_exceptions=True),
+                                             geocoder.get_many_by_id(["b", "c", "error1"], return_exceptions=True))
+        assert first["a"] == {"id": "a"} and second["b"] == {"id": "b"}
+        assert isinstance(first["error1"], ValueError) and isinstance(second["error1"], ValueError)
+        assert sorted(by_id.calls) == ["a", "b", "c", "error1"]
+        assert not geocoder._inflight_async
+
+    asyncio.run(asyncio.wait_for(main(), timeout=5))
+
+
+def test_get_many_by_id_async_cancelled():
+    async def main():
+        geocoder = _geocoder(adapter_factory=AioHTTPAdapter)
+        by_id = _ById(delay=0.1)
+        geocoder.get_by_id = by_id.call_async
+
+        owner = asyncio.ensure_future(geocoder.get_many_by_id(["a", "b"]))
+        await asyncio.sleep(0.01)
+        # Shares the fetch of "a" with owner, which is then cancelled
+        sharer = asyncio.ensure_future(geocoder.get_many_by_id(["a"]))
+        await asyncio.sleep(0.01)
+        owner.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await owner
+
+        assert await sharer == {"a": {"id": "a"}}
+        assert not geocoder._inflight_async
+        # Later calls are not blocked by the cancelled fetch either
+        assert await geocoder.get_many_by_id(["b"]) == {"b": {"id": "b"}}
+
+        # Cancelling a task sharing a fetch does not cancel the fetch
+        owner = asyncio.ensure_future(geocoder.get_many_by_id(["c"]))
+        await asyncio.sleep(0.01)
+        sharer = asyncio.ensure_future(geocoder.get_many_by_id(["c"]))
+        await asyncio.sleep(0.01)
+        sharer.cancel()
+        assert await owner == {"c": {"id": "c"}}
+
+    asyncio.run(asyncio.wait_for(main(), timeout=5))
+
+
+_QUERY = {"street": "Rue de la Loi", "housenumber": "16", "postcode": "1000", "city": "Bruxelles"}
+
+
+class _Cascade:
+    # _call_api stub: answers[level] is (delay, found) for each level of the
+    # cascade of _QUERY
+    def __init__(self, geocoder, answers):
+        self.geocoder = geocoder
+        self.answers = answers
+        self.calls = []
+        self._lock = threading.Lock()
+
+    def _level(self, api_base, params):
+        if api_base == self.geocoder.api_address:
+            return 0 if "houseNumber" in params else 1
+        if api_base == self.geocoder.api_postalinfo:
+            return 2 if "postCode" in params else 3
+        return 4
+
+    def _answer(self, level):
+        with self._lock:
+            self.calls.append(level)
+        if self.answers[level][1]:
+            return Location(f"level {level}", (50.8, 4.3), {"level": level})
+        return None
+
+    def __call__(self, api_base, params, timeout, exactly_one=True, return_raw=False):
+        level = self._level(api_base, params)
+        time.sleep(self.answers[level][0])
+        return self._answer(level)
+
+    async def call_async(self, api_base, params, timeout, exactly_one=True, return_raw=False):
+        level = self._level(api_base, params)
+        await asyncio.sleep(self.answers[level][0])
+        return self._answer(level)
+
+
+@pytest.mark.parametrize("found_level", [0, 1, 2, 3, 4, None])
+def test_speculative_cascade_level(found_level):
+    # Each level is found if it is found_level or below, and answers faster
+    # than the more precise ones
+    answers = [(0.05 * (4 - level), found_level is not None and level >= found_level) for level in range(5)]
+    with _geocoder(token="token") as geocoder:
+        geocoder._call_api = _Cascade(geocoder, answers)
+        sequential = geocoder.geocode(_QUERY)
+        speculative = geocoder.geocode(_QUERY, speculative=True)
+    if found_level is None:
+        assert sequential is None and speculative is None
+        return
+    assert speculative.raw == sequential.raw == {"level": found_level, "cascade_level": found_level,
+                                                 "precision": "building" if found_level == 0 else
+                                                 "street" if found_level == 1 else "city"}
+
+
+def test_speculative_waves():
+    # The second wave is only sent if the first one has no answer
+    answers = [(0.05, False), (0.0, True), (0.0, True), (0.0, True), (0.0, True)]
+    with _geocoder(token="token") as geocoder:
+        geocoder._call_api = cascade = _Cascade(geocoder, answers)
+        assert geocoder.geocode(_QUERY, speculative=True, wave_size=2).raw["cascade_level"] == 1
+        assert sorted(cascade.calls) == [0, 1]
+
+
+def test_speculative_shared_executor():
+    # All calls share the threads of the geocoder; the levels still waiting
+    # for a thread when the answer is known are not sent (but the next one
+    # may be started by the thread in the meantime)
+    answers = [(0.05, True)] + [(0.0, True)] * 4
+    geocoder = _geocoder(token="token")
+    geocoder.speculative_max_workers = 1
+    geocoder._call_api = cascade = _Cascade(geocoder, answers)
+    for _ in range(3):
+        assert geocoder.geocode(_QUERY, speculative=True).raw["cascade_level"] == 0
+    executor = geocoder._executor
+    assert executor is not None and len(executor._threads) == 1
+    assert cascade.calls.count(0) == 3 and set(cascade.calls) <= {0, 1}
+
+    geocoder.close()
+    assert geocoder._executor is None and executor._shutdown
+
+
+def test_speculative_async_cancels_less_precise_levels():
+    async def main():
+        geocoder = _geocoder(token="token", adapter_factory=AioHTTPAdapter)
+        answers = [(0.0, False), (0.05, True), (0.01, True), (0.5, True), (0.5, True)]
+        cascade = _Cascade(geocoder, answers)
+        geocoder._call_api = cascade.call_async
+        start = time.monotonic()
+        location = await geocoder.geocode(_QUERY, speculative=True)
+        assert location.raw["cascade_level"] == 1 and location.raw["precision"] == "street"
+        # Levels 3 and 4 were cancelled, not waited for
+        assert time.monotonic() - start < 0.4
+        await asyncio.sleep(0)
+        assert sorted(cascade.calls) == [0, 1, 2]
+
+    asyncio.run(asyncio.wait_for(main(), timeout=5))
+
+
+class _Pages:
+    # _call_api stub answering the pages of a search: url -> page
+    def __init__(self, pages):
+        self.pages = pages
+        self.calls = []
+
+    def __call__(self, url, params, timeout, exactly_one=True, return_raw=False, endpoint=None):
+        self.calls.append((url, endpoint))
+        return self.pages[url]
+
+    async def call_async(self, url, params, timeout, exactly_one=True, return_raw=False, endpoint=None):
+        await asyncio.sleep(0)
+        return self(url, params, timeout, exactly_one, return_raw, endpoint)
+
+
+def _item(id):
+    return {"id": id, "addressPosition": {"wgs84": {"lat": 50.8, "long": 4.3}}}
+
+
+def _two_pages(first_url, last):
+    # First page linking to the second one as {"href": ...}, second page
+    # either the last one (no link) or linking to an empty page
+    second = {"items": [_item("c")]}
+    pages = {first_url: {"items": [_item("a"), _item("b")], "next": {"href": "page2"}}, "page2": second}
+    if not last:
+        second["next"] = "page3"
+        pages["page3"] = {"items": []}
+    return pages
+
+
+@pytest.mark.parametrize("last", [True, False])
+@pytest.mark.parametrize("method, api, endpoint", [("iter_addresses", "api_address", "addresses"),
+                                                   ("iter_streets", "api_street", "streets"),
+                                                   ("iter_postalinfos", "api_postalinfo", "postalInfos"),
+                                                   ("iter_municipalities", "api_municipality", "municipalities")])
+def test_iter_pages(method, api, endpoint, last):
+    geocoder = _geocoder(token="token")
+    first_url = geocoder._construct_url(getattr(geocoder, api), {"postCode": "1000", "pageSize": 2})
+    geocoder._call_api = pages = _Pages(_two_pages(first_url, last))
+
+    items = list(getattr(geocoder, method)(page_size=2, raw=True, postCode="1000"))
+    assert [item["id"] for item in items] == ["a", "b", "c"]
+    assert pages.calls == [(first_url, endpoint), ("page2", endpoint)] + ([] if last else [("page3", endpoint)])
+
+    locations = list(getattr(geocoder, method)(page_size=2, postCode="1000"))
+    assert [location.raw["id"] for location in locations] == ["a", "b", "c"]
+    assert locations[0].latitude == pytest.approx(50.8)
+
+
+def test_iter_pages_empty():
+    geocoder = _geocoder(token="token")
+    geocoder._call_api = pages = _Pages({geocoder._construct_url(geocoder.api_address, {"pageSize": 100}):
+                                         {"items": [], "next": "page2"}})
+    assert list(geocoder.iter_addresses()) == []
+    assert len(pages.calls) == 1
+
+
+@pytest.mark.parametrize("last", [True, False])
+def test_iter_pages_async(last):
+    async def main():
+        geocoder = _geocoder(token="token", adapter_factory=AioHTTPAdapter)
+        first_url = geocoder._construct_url(geocoder.api_street, {"pageSize": 2})
+        pages = _Pages(_two_pages(first_url, last))
+        geocoder._call_api = pages.call_async
+        items = [item async for item in geocoder.iter_streets(page_size=2, raw=True)]
+        assert [item["id"] for item in items] == ["a", "b", "c"]
+        assert len(pages.calls) == (2 if last else 3)
+
+        # Stopped early: the prefetched page is not used
+        async for item in geocoder.iter_streets(page_size=2, raw=True):
+            break
+        assert item["id"] == "a"
+
+    asyncio.run(asyncio.wait_for(main(), timeout=5))
+
+
+def test_http_span_excludes_rate_limiter_wait():
+    spans = []
+    limiter = AdaptiveRateLimiter(rate=1000, concurrency=1)
+    geocoder = _geocoder(token="token", rate_limiter=limiter,
+                         observer=CallbackObserver(lambda kind, name, value, attributes: spans.append((name, value))))
+
+    def call_geocoder(url, callback, **kwargs):
+        time.sleep(0.05)
+        return callback({"items": [_item("a")]})
+    geocoder._call_geocoder = call_geocoder
+
+    # The only slot is taken for 0.2s
+    limiter.acquire()
+    threading.Timer(0.2, limiter.release).start()
+    start = time.monotonic()
+    assert geocoder._call_api(geocoder.api_address, {"postCode": "1000"}, None).raw["id"] == "a"
+    assert time.monotonic() - start > 0.2
+    http, = [duration for name, duration in spans if name == "geocoder.http"]
+    assert 0.05 <= http < 0.15
@@ -0,0 +1,189 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import geopy_bestaddress_local
+from geopy_bestaddress_local import LocalBestAddress
+
+# (id, postcode, house number, box, street fr/nl/de, municipality id and names fr/nl/de, postal names fr/nl,
+#  lat, lon, x, y, status)
+_ROWS = [
+    ("loi16", "1000", "16", None, "Rue de la Loi", "Wetstraat", None, "21004", "Bruxelles", "Brussel", None,
+     "Bruxelles", "Brussel", 50.8466, 4.37, 150087.88, 170688.44, "current"),
+    ("loi16b1", "1000", "16", "1", "Rue de la Loi", "Wetstraat", None, "21004", "Bruxelles", "Brussel", None,
+     "Bruxelles", "Brussel", 50.8466, 4.37, 150087.88, 170688.44, "current"),
+    ("loi16b2", "1000", "16", "2", "Rue de la Loi", "Wetstraat", None, "21004", "Bruxelles", "Brussel", None,
+     "Bruxelles", "Brussel", 50.8466, 4.37, 150087.88, 170688.44, "current"),
+    ("loi18", "1000", "18", None, "Rue de la Loi", "Wetstraat", None, "21004", "Bruxelles", "Brussel", None,
+     "Bruxelles", "Brussel", 50.8466, 4.3703, 150109.0, 170688.44, "current"),
+    ("loi2a", "1000", "2 A", None, "Rue de la Loi", "Wetstraat", None, "21004", "Bruxelles", "Brussel", None,
+     "Bruxelles", "Brussel", 50.8464, 4.369, 150017.45, 170666.19, "current"),
+    ("loi20", "1000", "20", None, "Rue de la Loi", "Wetstraat", None, "21004", "Bruxelles", "Brussel", None,
+     "Bruxelles", "Brussel", 50.8466, 4.3706, 150130.0, 170688.44, "proposed"),
+    ("fonsny47", "1060", "47", None, "Avenue Fonsny", "Fonsnylaan", None, "21013", "Saint-Gilles", "Sint-Gillis",
+     None, "Saint-Gilles", "Sint-Gillis", 50.8358, 4.3358, 147678.78, 169487.53, "current"),
+    ("fer1", "5000", "1", None, "Rue de Fer", None, None, "92094", "Namur", "Namen", None, "Namur", None,
+     50.4645, 4.865, 185232.93, 128303.35, "current"),
+]
+
+
+@pytest.fixture(scope="module")
+def index_dir(tmp_path_factory):
+    # Tiny openaddress dump, in two files as the regional ones
+    tmp_path = tmp_path_factory.mktemp("best")
+    df = pd.DataFrame(_ROWS, columns=["address_id", "postcode", "house_number", "box_number",
+                                      "streetname_fr", "streetname_nl", "streetname_de",
+                                      "municipality_id", "municipality_name_fr", "municipality_name_nl",
+                                      "municipality_name_de", "postname_fr", "postname_nl",
+                                      "EPSG:4326_lat", "EPSG:4326_lon", "EPSG:31370_x", "EPSG:31370_y", "status"])
+    filenames = [str(tmp_path / "openaddress-bebru.zip"), str(tmp_path / "openaddress-bewal.zip")]
+    df.iloc[:-1].to_csv(filenames[0], index=False, compression="zip")
+    df.iloc[-1:].to_csv(filenames[1], index=False, compression="zip")
+    LocalBestAddress.build(filenames, str(tmp_path / "index"), chunksize=3)
+    return str(tmp_path / "index")
+
+
+@pytest.fixture(scope="module")
+def geocoder(index_dir):
+    return LocalBestAddress(index_dir)
+
+
+def _query(street, housenumber, postcode, city, **kwargs):
+    return dict(street=street, housenumber=housenumber, postcode=postcode, city=city, **kwargs)
+
+
+def test_build_and_load(geocoder):
+    # The "proposed" address is not indexed
+    assert len(geocoder) == 7
+    assert geocoder.get_by_id("fonsny47")["hasStreetName"]["name"] == {"fr": "Avenue Fonsny", "nl": "Fonsnylaan"}
+    assert geocoder.get_by_id("loi16b1")["boxNumber"] == "1"
+    assert geocoder.get_by_id("loi20") is None
+    assert geocoder.get_by_id("unknown") is None
+
+
+@pytest.mark.parametrize("query, address_id, precision", [
+    (_query("Rue de la Loi", "16", "1000", "Bruxelles"), "loi16", "building"),
+    (_query("WETSTRAAT", 16, 1000, "Brussel"), "loi16", "building"),
+    (_query("rue de la loi", "16", "1000", None, box="2"), "loi16b2", "building"),
+    (_query("Rue  de la   Loi", "2a", "1000", None), "loi2a", "building"),
+    (_query("Avenue Fonsny", "47", "1060", "Saint-Gilles"), "fonsny47", "building"),
+    (_query("Rue de Fer", "1", "5000", "Namur"), "fer1", "building"),
+    # Street level: lowest house number of the street
+    (_query("Rue de la Loi", "99", "1000", "Bruxelles"), "loi2a", "street"),
+    (_query("Rue de la Loi", "16", "1000", None, box="9"), "loi2a", "street"),
+])
+def test_geocode(geocoder, query, address_id, precision):
+    location = geocoder.geocode(query)
+    assert location.raw["id"] == address_id
+    assert location.raw["precision"] == precision
+    assert location.raw["cascade_level"] == (0 if precision == "building" else 1)
+
+
+def test_geocode_cascade(geocoder):
+    location = geocoder.geocode(_query("Rue Inconnue", "1", "1060", "Saint-Gilles"))
+    assert location.raw["precision"] == "city" and location.raw["cascade_level"] == 2
+    location = geocoder.geocode(_query("Rue Inconnue", "1", "9999", "Namen"))
+    assert location.raw["precision"] == "city" and location.raw["cascade_level"] == 4
+    assert geocoder.geocode(_query("Rue Inconnue", "1", "9999", "Nowhere")) is None
+
+    raw = geocoder.geocode(_query("Rue de la Loi", "16", "1000", None), return_raw=True)
+    assert [item["id"] for item in raw["items"]] == ["loi16"]
+    locations = geocoder.geocode(_query("Rue de la Loi", "16", "1000", None), exactly_one=False)
+    assert [location.raw["id"] for location in locations] == ["loi16"]
+    assert locations[0].latitude == pytest.approx(50.8466)
+
+
+def test_geocode_batch_as_geocode(geocoder):
+    df = pd.DataFrame([_query("Rue de la Loi", "16", "1000", "Bruxelles"),
+                       _query("Wetstraat", "16", "1000", "Brussel", box="1"),
+                       _query("Rue de la Loi", "99", "1000", "Bruxelles"),
+                       _query("Rue Inconnue", "1", "1060", "Saint-Gilles"),
+                       _query("Rue Inconnue", "1", "9999", "Nowhere"),
+                       _query("Rue de Fer", 1, 5000, "Namur")], index=list("abcdef"))
+    res = geocoder.geocode_batch(df)
+
+    assert list(res.index) == list(df.index)
+    for i, query in zip(df.index, df.to_dict("records")):
+        location = geocoder.geocode(query)
+        if location is None:
+            assert pd.isnull(res.precision[i]) and np.isnan(res.cascade_level[i])
+            continue
+        assert res.precision[i] == location.raw["precision"]
+        assert res.cascade_level[i] == location.raw["cascade_level"]
+        if location.raw["precision"] != "city":
+            assert res.address_id[i] == location.raw["id"]
+            assert res.address[i] == location.address
+            assert (res.lat[i], res.lon[i]) == pytest.approx((location.latitude, location.longitude))
+
+
+def test_hash_collision_not_returned(geocoder, monkeypatch):
+    # A key colliding with the one of Rue de la Loi 16 (and of its street)
+    # must not be answered with that address
+    aliases = {"1000|rue inconnue|16|": "1000|rue de la loi|16|", "1000|rue inconnue||": "1000|rue de la loi||"}
+    hash_key, hash_keys = geopy_bestaddress_local._hash_key, geopy_bestaddress_local._hash_keys
+    monkeypatch.setattr(geopy_bestaddress_local, "_hash_key", lambda key: hash_key(aliases.get(key, key)))
+    monkeypatch.setattr(geopy_bestaddress_local, "_hash_keys",
+                        lambda keys: hash_keys([aliases.get(key, key) for key in keys]))
+
+    query = _query("Rue Inconnue", "16", "1000", "Bruxelles")
+    assert geocoder.geocode(query).raw["precision"] == "city"
+    assert geocoder.geocode_batch(pd.DataFrame([query])).precision[0] == "city"
+    assert geocoder.geocode(_query("Rue de la Loi", "16", "1000", None)).raw["id"] == "loi16"
+
+
+@pytest.fixture
+def spatial(geocoder):
+    pytest.importorskip("scipy")
+    pytest.importorskip("pyproj")
+    return geocoder
+
+
+def test_project_to_lambert72(spatial):
+    # Coordinates of the fixture, and the central meridian of EPSG:31370
+    # (x = 150000 m, up to the datum shift)
+    x, y = spatial._project([50.8466, 50.4645], [4.37, 4.865])
+    np.testing.assert_allclose(x, [150087.88, 185232.93], atol=0.05)
+    np.testing.assert_allclose(y, [170688.44, 128303.35], atol=0.05)
+    x, _ = spatial._project(50.8, 4.367486666666667)
+    assert abs(x - 150000) < 150
+
+
+def test_reverse_radius(spatial):
+    # Rue de la Loi 16 (3 rows at the same point), 18 at 21 m, 2A at 74 m
+    res = spatial.reverse((50.8466, 4.37), radius=15, exactly_one=False)
+    assert sorted(location.raw["id"] for location in res) == ["loi16", "loi16b1", "loi16b2"]
+    res = spatial.reverse((50.8466, 4.37), radius=25, exactly_one=False)
+    assert [location.raw["id"] for location in res][3:] == ["loi18"]
+    assert spatial.reverse((50.8466, 4.3703), radius=15).raw["id"] == "loi18"
+    assert spatial.reverse((50.8466, 4.3703), radius=15, return_raw=True)["items"][0]["id"] == "loi18"
+    assert spatial.reverse((50.0, 3.0), radius=15) is None
+    with pytest.raises(ValueError):
+        spatial.reverse((50.8466, 4.37), radius=None)
+
+
+def test_reverse_nearest(spatial):
+    res = spatial.reverse((50.8466, 4.37), radius=None, k=5, exactly_one=False)
+    ids = [location.raw["id"] for location in res]
+    assert sorted(ids[:3]) == ["loi16", "loi16b1", "loi16b2"]
+    assert ids[3:] == ["loi18", "loi2a"]
+    # k nearest within the radius
+    res = spatial.reverse((50.8466, 4.37), radius=50, k=5, exactly_one=False)
+    assert len(res) == 4
+
+
+def test_reverse_many(spatial):
+    ids, distances = spatial.reverse_many(np.array([50.8466, 50.8358, 50.0]), np.array([4.3703, 4.3358, 3.0]),
+                                          radius=100)
+    assert ids.tolist() == ["loi18", "fonsny47", None]
+    np.testing.assert_allclose(distances[:2], 0, atol=0.1)
+    assert np.isinf(distances[2])
+
+    ids, distances = spatial.reverse_many([50.8464], [4.369], k=2)
+    assert ids.shape == (1, 2) and ids[0, 0] == "loi2a"
+    assert distances[0, 1] == pytest.approx(np.hypot(150087.88 - 150017.45, 170688.44 - 170666.19), abs=0.1)
+
+
+def test_street_aliases(geocoder):
+    assert geocoder.street_aliases() == {"1000|rue de la loi": "rue de la loi", "1000|wetstraat": "rue de la loi",
+                                         "1060|avenue fonsny": "avenue fonsny", "1060|fonsnylaan": "avenue fonsny",
+                                         "5000|rue de fer": "rue de fer"}
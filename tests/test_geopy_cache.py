@@ -0,0 +1,122 @@
+import threading
+
+import pytest
+from geopy.location import Location
+
+import geopy_cache
+from geopy_cache import CachedGeocoder, LRUCache, ResultStore
+
+
+def test_result_store_counts_writes_of_all_threads(tmp_path):
+    store = ResultStore(str(tmp_path / "results.sqlite"), max_entries=10)
+    store.evict_every = 50
+    evictions = []
+    evict = store.evict
+    store.evict = lambda: (evictions.append(1), evict())
+
+    def write(i):
+        for j in range(100):
+            store.set(f"{i}-{j}", {"i": i, "j": j})
+
+    threads = [threading.Thread(target=write, args=(i, )) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert store._writes == 800
+    assert len(evictions) == 16
+    assert len(store) <= 10 + 50
+
+
+class _Clock:
+    # Fake time module for the entry timestamps
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = _Clock()
+    monkeypatch.setattr(geopy_cache, "time", clock)
+    return clock
+
+
+class _Geocoder:
+    # Geocoder stub: queries containing "nowhere" are not found
+    adapter = None
+    domain = "stub"
+
+    def __init__(self):
+        self.calls = []
+
+    def geocode(self, query, *, exactly_one=True, timeout=None, language=None):
+        self.calls.append(query)
+        if "nowhere" in str(query).lower():
+            return None if exactly_one else []
+        location = Location(str(query), (50.8466, 4.37), {"query": query, "language": language})
+        return location if exactly_one else [location]
+
+
+@pytest.fixture(params=["sqlite", "memory"])
+def store(request, tmp_path):
+    if request.param == "memory":
+        return LRUCache()
+    return ResultStore(str(tmp_path / "results.sqlite"))
+
+
+def test_hit_and_miss(store):
+    geocoder = CachedGeocoder(_Geocoder(), store)
+    first = geocoder.geocode("Rue de la Loi 16, Bruxelles")
+    second = geocoder.geocode("Rue de la Loi 16, Bruxelles")
+    assert (second.address, second.point, second.raw) == (first.address, first.point, first.raw)
+    assert geocoder.stats() == {"hits": 1, "misses": 1, "hit_rate": 0.5, "entries": 1}
+
+    # Other arguments are other entries
+    assert geocoder.geocode("Rue de la Loi 16, Bruxelles", language="nl").raw["language"] == "nl"
+    assert len(geocoder.geocoder.calls) == 2
+
+
+def test_key_normalization(store):
+    geocoder = CachedGeocoder(_Geocoder(), store)
+    geocoder.geocode({"street": "Rue de la Loi", "housenumber": 16, "postcode": "1000"})
+    # Same query up to case, spaces, key order and type; default and ignored arguments
+    geocoder.geocode({"postcode": 1000, "housenumber": "16", "street": "rue  DE la loi "}, exactly_one=True)
+    geocoder.geocode({"street": "Rue de la Loi", "housenumber": "16", "postcode": "1000"}, timeout=5,
+                     language=None)
+    assert len(geocoder.geocoder.calls) == 1
+
+    locations = geocoder.geocode({"street": "Rue de la Loi", "housenumber": "16", "postcode": "1000"},
+                                 exactly_one=False)
+    assert isinstance(locations, list) and len(geocoder.geocoder.calls) == 2
+
+
+def test_ttl(tmp_path, clock):
+    geocoder = CachedGeocoder(_Geocoder(), path=str(tmp_path / "results.sqlite"), ttl=60)
+    geocoder.geocode("Rue de la Loi 16")
+    clock.now += 59
+    geocoder.geocode("Rue de la Loi 16")
+    assert len(geocoder.geocoder.calls) == 1
+    clock.now += 2
+    geocoder.geocode("Rue de la Loi 16")
+    assert len(geocoder.geocoder.calls) == 2
+
+
+def test_negative_ttl(store, clock):
+    geocoder = CachedGeocoder(_Geocoder(), store, negative_ttl=10)
+    assert geocoder.geocode("Nowhere") is None
+    assert geocoder.geocode("Nowhere", exactly_one=False) == []
+    geocoder.geocode("Rue de la Loi 16")
+    clock.now += 5
+    assert geocoder.geocode("Nowhere") is None
+    assert geocoder.geocode("Nowhere", exactly_one=False) == []
+    assert len(geocoder.geocoder.calls) == 3
+
+    # Empty results expire, the others are kept
+    clock.now += 6
+    assert geocoder.geocode("Nowhere") is None
+    assert geocoder.geocode("Rue de la Loi 16").address == "Rue de la Loi 16"
+    assert geocoder.geocoder.calls == ["Nowhere", "Nowhere", "Rue de la Loi 16", "Nowhere"]
@@ -0,0 +1,100 @@
+import threading
+
+import numpy as np
+import pandas as pd
+import pytest
+from geopy.location import Location
+
+from geopy_batch import BatchGeocoder
+from geopy_dataframe import geocode_dataframe, normalize_streets, query_keys
+
+
+class _Geocoder(BatchGeocoder):
+    # Geocoder stub: streets containing "inconnue" are not found, "error"
+    # raises
+    adapter = None
+
+    def __init__(self):
+        self.calls = []
+        self._lock = threading.Lock()
+
+    def geocode(self, query, **kwargs):
+        with self._lock:
+            self.calls.append((query, kwargs))
+        if "error" in query["street"]:
+            raise ValueError(query["street"])
+        if "inconnue" in query["street"].lower():
+            return None
+        address = f"{query['street']} {query['housenumber']}, {query['postcode']} {query['city']}"
+        return Location(address, (50.8, 4.3), {"id": address, "precision": "building"})
+
+
+class _BatchGeocoder:
+    # geocode_batch stub (as LocalBestAddress)
+    def __init__(self):
+        self.calls = []
+
+    def geocode_batch(self, df, street="street", housenumber="housenumber", postcode="postcode", city="city",
+                      box="box"):
+        self.calls.append((df.copy(), box))
+        return pd.DataFrame({"lat": np.arange(len(df), dtype=float), "lon": np.zeros(len(df)),
+                             "precision": "street", "cascade_level": 1, "address_id": df[street].values,
+                             "address": df[street].values})
+
+
+def _addresses():
+    return pd.DataFrame({"street": ["Rue de la Loi", "R. de la  Loi", "rue de la loi", "Rue Inconnue", "error",
+                                    None],
+                         "housenumber": ["16", "16", "18", "1", "1", None],
+                         "postcode": ["1000", 1000, "1000", "1060", "1060", None],
+                         "city": ["Bruxelles", "BRUXELLES", "Bruxelles", "Saint-Gilles", "Saint-Gilles", None]},
+                        index=list("abcdef"))
+
+
+def test_normalize_streets():
+    streets = pd.Series(["R. Haute", "Av  Louise", "bd. Anspach", "Chée de Wavre", "Kerkstr.", "Ch. de la Hulpe",
+                         None])
+    assert normalize_streets(streets).tolist() == ["rue Haute", "avenue Louise", "boulevard Anspach",
+                                                   "chaussée de Wavre", "Kerkstraat", "Ch. de la Hulpe", ""]
+
+
+def test_query_keys():
+    keys = query_keys(_addresses())
+    assert keys["a"] == keys["b"] != keys["c"]
+    keys = query_keys(pd.DataFrame({"street": ["Wetstraat", "Rue de la Loi"], "postcode": ["1000", "1000"]}),
+                      columns={"street": "street", "postcode": "postcode"},
+                      aliases={"1000|wetstraat": "rue de la loi"})
+    assert keys[0] == keys[1]
+
+
+@pytest.mark.parametrize("max_workers", [1, 3])
+def test_geocode_dataframe(max_workers):
+    geocoder = _Geocoder()
+    res = geocode_dataframe(_addresses(), geocoder, max_workers=max_workers, language="fr")
+
+    # One call per distinct address, none for the empty row
+    assert len(geocoder.calls) == 4
+    assert all(kwargs == {"language": "fr"} for _, kwargs in geocoder.calls)
+    assert list(res.index) == list("abcdef")
+    assert res.matched_address["a"] == res.matched_address["b"] == "Rue de la Loi 16, 1000 Bruxelles"
+    assert res.provider_id["c"] == "rue de la loi 18, 1000 Bruxelles"
+    assert res.precision["a"] == "building" and res.lat["a"] == 50.8
+    assert pd.isnull(res.matched_address["d"]) and np.isnan(res.lat["d"]) and pd.isnull(res.error["d"])
+    assert res.error["e"] == "ValueError('error')" and np.isnan(res.lat["e"])
+    assert np.isnan(res.lat["f"]) and pd.isnull(res.error["f"])
+
+
+def test_geocode_dataframe_batch():
+    geocoder = _BatchGeocoder()
+    res = geocode_dataframe(_addresses(), geocoder, box="box_number")
+
+    (queries, box), = geocoder.calls
+    assert box == "box_number"
+    assert len(queries) == 5
+    assert res.lat["a"] == res.lat["b"] != res.lat["c"]
+    assert res.provider_id["b"] == "Rue de la Loi"
+
+
+def test_geocode_dataframe_exactly_one():
+    with pytest.raises(ValueError, match="exactly_one"):
+        geocode_dataframe(_addresses(), _Geocoder(), exactly_one=False)
@@ -0,0 +1,117 @@
+import multiprocessing
+import os
+import time
+
+import pandas as pd
+
+from geopy_jobs import GeocodingJob
+
+
+def _claim_at(job, start):
+    # Worker: wait for the common start time, then try to claim chunk 0
+    while time.time() < start:
+        pass
+    return job._claim(0)
+
+
+def _stale_claim(job):
+    path = job._claim_path(0)
+    with open(path, "w") as f:
+        f.write('{"host": "crashed", "pid": 1}')
+    old = time.time() - 2 * job.stale_after
+    os.utime(path, (old, old))
+    return path
+
+
+def test_stale_claim_taken_over_by_one_process(tmp_path):
+    job = GeocodingJob(str(tmp_path / "input.csv"), str(tmp_path / "out"), None, stale_after=60)
+    ctx = multiprocessing.get_context("spawn")
+    with ctx.Pool(4) as pool:
+        for _ in range(10):
+            path = _stale_claim(job)
+            start = time.time() + 0.5
+            claimed = pool.starmap(_claim_at, [(job, start)] * 4)
+            assert sum(claimed) == 1
+            assert time.time() - os.path.getmtime(path) < job.stale_after
+            os.remove(path)
+
+
+def test_fresh_claim_not_taken_over(tmp_path):
+    job = GeocodingJob(str(tmp_path / "input.csv"), str(tmp_path / "out"), None, stale_after=60)
+    assert job._claim(0)
+    assert not job._claim(0)
+    job._release(0)
+    assert job._claim(0)
+
+
+def test_fresh_claim_put_back(tmp_path, monkeypatch):
+    # The stale claim was replaced by a fresh one between its inspection
+    # and its move: the fresh claim is put back, and not taken over
+    job = GeocodingJob(str(tmp_path / "input.csv"), str(tmp_path / "out"), None, stale_after=60)
+    path = _stale_claim(job)
+    rename = os.rename
+
+    def replacing_rename(src, dst):
+        if src == path:
+            os.remove(path)
+            with open(path, "w") as f:
+                f.write('{"host": "other", "pid": 2}')
+        return rename(src, dst)
+
+    monkeypatch.setattr(os, "rename", replacing_rename)
+    assert not job._claim(0)
+    monkeypatch.undo()
+    with open(path) as f:
+        assert '"other"' in f.read()
+
+
+class _Geocoder:
+    # Geocoder stub recording its queries, and whether it was closed
+    instances = []
+
+    def __init__(self):
+        self.queries = []
+        self.closed = False
+        _Geocoder.instances.append(self)
+
+    def geocode(self, query, **kwargs):
+        self.queries.append(query["street"])
+        return None
+
+    def close(self):
+        self.closed = True
+
+
+def _input(tmp_path, n=25):
+    path = str(tmp_path / "input.csv")
+    pd.DataFrame({"street": [f"Rue {i}" for i in range(n)], "housenumber": [str(i) for i in range(n)],
+                  "postcode": "1000", "city": "Bruxelles"}).to_csv(path, index=False)
+    return path
+
+
+def test_resume_skips_done_chunks(tmp_path):
+    _Geocoder.instances = []
+    job = GeocodingJob(_input(tmp_path), str(tmp_path / "out"), _Geocoder, chunksize=10, max_workers=1)
+    assert job.run()["chunks_done"] == 3
+    geocoder, = _Geocoder.instances
+    assert len(geocoder.queries) == 25 and geocoder.closed
+
+    # Chunk 1 is lost: only its rows are parsed and geocoded again
+    os.remove(job._done_path(1))
+    chunks = list(job._chunks())
+    assert [chunk for chunk, _ in chunks] == [1]
+    assert chunks[0][1].street.tolist() == [f"Rue {i}" for i in range(10, 20)]
+
+    status = job.run()
+    assert status["chunks_done"] == 3 and status["rows_done"] == 25
+    assert _Geocoder.instances[-1].queries == [f"Rue {i}" for i in range(10, 20)]
+    assert _Geocoder.instances[-1].closed
+    res = job.results()
+    assert res.row.tolist() == list(range(25))
+    assert res.street.tolist() == [f"Rue {i}" for i in range(25)]
+
+    # Last (shorter) chunk lost
+    os.remove(job._done_path(2))
+    assert [(chunk, len(df)) for chunk, df in job._chunks()] == [(2, 5)]
+    os.remove(job._done_path(0))
+    assert [(chunk, df.street.iloc[0]) for chunk, df in job._chunks()] == [(0, "Rue 0"), (2, "Rue 20")]
@@ -0,0 +1,111 @@
+import asyncio
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+from geopy.adapters import AioHTTPAdapter
+from geopy.exc import GeocoderTimedOut, GeocoderUnavailable
+
+from geopy_nominatim_wrapper import NominatimWrapper
+
+
+class _Handler(BaseHTTPRequestHandler):
+    # Answers each POST with one match, recording the client port (i.e. the
+    # connection), the headers and the body of the request
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        self.server.requests.append((self.client_address[1], dict(self.headers), body))
+        time.sleep(self.server.delay)
+        data = json.dumps([{"match": [{"output": {"lat": "50.8466", "lon": "4.37",
+                                                  "displayName": body.get("fullAddress", "structured")}}]}]).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+@pytest.fixture
+def server():
+    srv = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+    srv.requests = []
+    srv.delay = 0
+    thread = threading.Thread(target=srv.serve_forever, kwargs={"poll_interval": 0.05}, daemon=True)
+    thread.start()
+    yield srv
+    srv.shutdown()
+    srv.server_close()
+
+
+def _geocoder(server, **kwargs):
+    return NominatimWrapper(domain=f"127.0.0.1:{server.server_port}", **kwargs)
+
+
+def test_pooled_session(server):
+    with _geocoder(server, pool_maxsize=2) as geocoder:
+        assert geocoder.session.get_adapter("http://")._pool_maxsize == 2
+        for i in range(5):
+            location = geocoder.geocode(f"Rue de la Loi {i}, Bruxelles")
+            assert location.address == f"Rue de la Loi {i}, Bruxelles"
+            assert location.point.latitude == pytest.approx(50.8466)
+
+    # All the calls went through one kept-alive connection
+    assert len(server.requests) == 5
+    assert len({port for port, _, _ in server.requests}) == 1
+    assert server.requests[0][1]["Connection"] == "keep-alive"
+    assert server.requests[0][2]["fullAddress"] == "Rue de la Loi 0, Bruxelles"
+
+
+class _Session(requests.Session):
+    closed = False
+
+    def close(self):
+        self.closed = True
+        super().close()
+
+
+def test_session_injection(server):
+    session = _Session()
+    session.headers["X-Test"] = "injected"
+    with _geocoder(server, session=session) as geocoder:
+        assert geocoder.session is session
+        geocoder.geocode({"street": "Rue de la Loi", "housenumber": "16", "postcode": "1000"})
+    assert session.closed
+
+    _, headers, body = server.requests[0]
+    assert headers["X-Test"] == "injected"
+    assert (body["streetName"], body["houseNumber"], body["postCode"]) == ("Rue de la Loi", "16", "1000")
+
+
+def test_async_exit_closes_session():
+    session = _Session()
+
+    async def main():
+        async with NominatimWrapper(adapter_factory=AioHTTPAdapter, session=session):
+            pass
+
+    asyncio.run(main())
+    assert session.closed
+
+
+def test_errors_translated(server):
+    server.delay = 0.5
+    with _geocoder(server, timeout=0.1) as geocoder:
+        with pytest.raises(GeocoderTimedOut):
+            geocoder.geocode("Rue de la Loi 16, Bruxelles")
+
+    # Nothing listens on this port any more
+    port = server.server_port
+    server.shutdown()
+    server.server_close()
+    with NominatimWrapper(domain=f"127.0.0.1:{port}") as geocoder:
+        with pytest.raises(GeocoderUnavailable):
+            geocoder.geocode("Rue de la Loi 16, Bruxelles")
@@ -0,0 +1,167 @@
+import asyncio
+import threading
+import time
+
+import pytest
+import requests
+from geopy.exc import GeocoderRateLimited, GeocoderServiceError, GeocoderUnavailable
+
+import geopy_ratelimit
+from geopy_ratelimit import AdaptiveRateLimiter
+
+
+class _Clock:
+    # Fake time module: sleep() advances monotonic() and records the delays
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, delay):
+        self.sleeps.append(delay)
+        self.now += delay
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = _Clock()
+    monkeypatch.setattr(geopy_ratelimit, "time", clock)
+    # Backoff without jitter: the upper bound of the interval
+    monkeypatch.setattr(geopy_ratelimit.random, "uniform", lambda a, b: b)
+    return clock
+
+
+def _http_error(status, headers=None):
+    response = requests.Response()
+    response.status_code = status
+    response.headers.update(headers or {})
+    return requests.HTTPError(f"{status}", response=response)
+
+
+def _failing(*errors, latency=0.0, clock=None):
+    # Function raising the given errors in turn, then returning "ok"
+    errors = list(errors)
+
+    def func():
+        func.calls += 1
+        if clock is not None:
+            clock.now += latency
+        if errors:
+            raise errors.pop(0)
+        return "ok"
+    func.calls = 0
+    return func
+
+
+@pytest.mark.parametrize("error", [GeocoderRateLimited("429"), GeocoderServiceError("502"),
+                                   GeocoderUnavailable("503"), _http_error(429), _http_error(503)])
+def test_decrease_on_overload(clock, error):
+    limiter = AdaptiveRateLimiter(rate=8, concurrency=4, cooldown=1.0, max_retries=0)
+    with pytest.raises(type(error)):
+        limiter.call(_failing(error))
+    assert (limiter.rate, limiter.concurrency) == (4, 2)
+    assert limiter.stats()["errors"] == 1 and limiter.in_flight == 0
+
+    # Within the cooldown, other failures do not decrease the limits again
+    clock.now += 0.5
+    with pytest.raises(type(error)):
+        limiter.call(_failing(error))
+    assert (limiter.rate, limiter.concurrency) == (4, 2)
+
+    clock.now += 0.5
+    with pytest.raises(type(error)):
+        limiter.call(_failing(error))
+    assert (limiter.rate, limiter.concurrency) == (2, 1)
+
+
+@pytest.mark.parametrize("error", [ValueError("bug"), _http_error(400)])
+def test_other_errors_not_retried(clock, error):
+    limiter = AdaptiveRateLimiter(rate=8, concurrency=4)
+    func = _failing(error)
+    with pytest.raises(type(error)):
+        limiter.call(func)
+    assert func.calls == 1 and not clock.sleeps
+    assert limiter.stats()["retries"] == 0 and limiter.in_flight == 0
+
+
+def test_increase_under_target_latency(clock):
+    limiter = AdaptiveRateLimiter(rate=4, concurrency=2, rate_step=0.5, target_latency=0.5)
+    for _ in range(4):
+        assert limiter.call(_failing(latency=0.1, clock=clock)) == "ok"
+    assert limiter.rate == pytest.approx(6)
+    assert limiter.concurrency == 3
+    assert not clock.sleeps
+
+    # A slow (but successful) answer is a sign of overload
+    assert limiter.call(_failing(latency=1.0, clock=clock)) == "ok"
+    assert limiter.rate == pytest.approx(3)
+    assert limiter.concurrency == 1
+
+
+def test_token_bucket(clock):
+    limiter = AdaptiveRateLimiter(rate=2, burst=2, concurrency=10)
+    with limiter._cond:
+        assert [limiter._try_acquire() for _ in range(3)] == [0, 0, pytest.approx(0.5)]
+        clock.now += 0.5
+        assert limiter._try_acquire() == 0
+
+
+@pytest.mark.parametrize("error, retry_after", [(GeocoderRateLimited("429", retry_after=7), 7),
+                                                (_http_error(503, {"Retry-After": "3"}), 3)])
+def test_retry_after(clock, error, retry_after):
+    limiter = AdaptiveRateLimiter(rate=8, concurrency=4, backoff=0.5)
+    func = _failing(error)
+    assert limiter.call(func) == "ok"
+    assert func.calls == 2
+    # The retry waited for the delay asked by the service, not the backoff
+    assert clock.sleeps == [retry_after]
+    assert limiter.stats()["throttled"] == 1 and limiter.stats()["retries"] == 1
+
+    # Other callers are paused as well
+    limiter.acquire()
+    limiter.release(retry_after=retry_after)
+    with limiter._cond:
+        assert limiter._try_acquire() == pytest.approx(retry_after)
+        clock.now += retry_after
+        assert limiter._try_acquire() == 0
+
+
+def test_max_retries_exhausted(clock):
+    limiter = AdaptiveRateLimiter(rate=100, concurrency=4, max_retries=3, backoff=0.5, max_backoff=1.5,
+                                  cooldown=0)
+    func = _failing(*[GeocoderUnavailable(str(i)) for i in range(10)])
+    with pytest.raises(GeocoderUnavailable, match="3"):
+        limiter.call(func)
+    assert func.calls == 4
+    # Exponential backoff, capped at max_backoff
+    assert clock.sleeps == [0.5, 1.0, 1.5]
+    stats = limiter.stats()
+    assert (stats["retries"], stats["errors"], stats["in_flight"]) == (3, 4, 0)
+
+
+def test_acquire_async_waits_for_release(monkeypatch):
+    # The slot is freed by a thread: the waiting task wakes up on release,
+    # without polling the limiter in the meantime
+    limiter = AdaptiveRateLimiter(rate=1000, concurrency=1)
+    attempts = []
+    try_acquire = limiter._try_acquire
+
+    def counting_try_acquire():
+        attempts.append(1)
+        return try_acquire()
+    monkeypatch.setattr(limiter, "_try_acquire", counting_try_acquire)
+
+    async def main():
+        await limiter.acquire_async()
+        threading.Timer(0.2, limiter.release).start()
+        start = time.monotonic()
+        await limiter.acquire_async()
+        limiter.release()
+        return time.monotonic() - start
+
+    waited = asyncio.run(asyncio.wait_for(main(), timeout=5))
+    assert 0.15 < waited < 1
+    assert len(attempts) == 3
+    assert limiter.in_flight == 0 and limiter.queue_depth == 0 and not limiter._async_waiters
@@ -0,0 +1,154 @@
+import asyncio
+import pickle
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import pytest
+from geopy.exc import GeocoderParseError
+from geopy.location import Location
+
+import geopy_results
+from geopy_results import (FastJSONAioHTTPAdapter, FastJSONRequestsAdapter, LazyLocation, ResultColumns,
+                           json_loads, location_with_raw)
+
+
+class _Decoder:
+    # address_of / point_of counting their calls
+    def __init__(self):
+        self.addresses = 0
+        self.points = 0
+
+    def address_of(self, raw):
+        self.addresses += 1
+        return f"{raw['street']} {raw['number']}"
+
+    def point_of(self, raw):
+        self.points += 1
+        return raw["lat"], raw["lon"]
+
+
+_RAW = {"id": "a", "street": "Rue de la Loi", "number": "16", "lat": 50.8466, "lon": 4.37, "precision": "building"}
+
+
+def _lazy(decoder):
+    return LazyLocation(dict(_RAW), decoder.address_of, decoder.point_of)
+
+
+def test_lazy_location():
+    decoder = _Decoder()
+    location = _lazy(decoder)
+    assert location.raw["id"] == "a"
+    assert (location.latitude, location.longitude) == (50.8466, 4.37)
+    assert (decoder.addresses, decoder.points) == (0, 1)
+
+    assert location.address == "Rue de la Loi 16" and location.address == "Rue de la Loi 16"
+    assert (decoder.addresses, decoder.points) == (1, 1)
+    assert location == Location("Rue de la Loi 16", (50.8466, 4.37), _RAW)
+    assert tuple(location) == ("Rue de la Loi 16", (50.8466, 4.37))
+    assert str(location) == "Rue de la Loi 16"
+
+    copy = pickle.loads(pickle.dumps(_lazy(decoder)))
+    assert copy == location and copy._address_of is None
+    with pytest.raises(TypeError):
+        LazyLocation(None, decoder.address_of, decoder.point_of)
+
+
+def test_location_with_raw():
+    decoder = _Decoder()
+    location = _lazy(decoder)
+    copy = location_with_raw(location, dict(location.raw, provider="best"))
+    assert copy.raw["provider"] == "best" and "provider" not in location.raw
+    assert (decoder.addresses, decoder.points) == (0, 0)
+    assert copy.address == location.address
+
+    # Already decoded values are reused
+    location.point
+    copy = location_with_raw(location, {})
+    assert copy.point == location.point and decoder.points == 1
+
+    location = Location("Rue de la Loi 16", (50.8466, 4.37), {"id": "a"})
+    copy = location_with_raw(location, {"id": "b"})
+    assert (copy.address, copy.point, copy.raw) == (location.address, location.point, {"id": "b"})
+
+
+@pytest.mark.parametrize("orjson", [True, False])
+def test_json_loads(monkeypatch, orjson):
+    if not orjson:
+        monkeypatch.setattr(geopy_results, "orjson", None)
+    elif geopy_results.orjson is None:
+        pytest.skip("orjson is not installed")
+    assert json_loads(b'{"items": [{"id": "\\u00e9"}]}') == {"items": [{"id": "é"}]}
+    assert json_loads('[1, 2.5, null]') == [1, 2.5, None]
+    with pytest.raises(ValueError):
+        json_loads(b"<html>")
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        body = b'{"items": [{"id": "a"}]}' if self.path == "/json" else b"<html>oops</html>"
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+@pytest.fixture
+def server():
+    srv = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+    srv.url = f"http://127.0.0.1:{srv.server_port}"
+    thread = threading.Thread(target=srv.serve_forever, kwargs={"poll_interval": 0.05}, daemon=True)
+    thread.start()
+    yield srv
+    srv.shutdown()
+    srv.server_close()
+
+
+def test_requests_adapter(server):
+    adapter = FastJSONRequestsAdapter(proxies=None, ssl_context=None)
+    assert adapter.get_json(f"{server.url}/json", timeout=5, headers={}) == {"items": [{"id": "a"}]}
+    with pytest.raises(GeocoderParseError, match="oops"):
+        adapter.get_json(f"{server.url}/html", timeout=5, headers={})
+
+
+@pytest.mark.skipif(FastJSONAioHTTPAdapter is None, reason="aiohttp is not installed")
+def test_aiohttp_adapter(server):
+    async def main():
+        async with FastJSONAioHTTPAdapter(proxies=None, ssl_context=None) as adapter:
+            assert await adapter.get_json(f"{server.url}/json", timeout=5, headers={}) == {"items": [{"id": "a"}]}
+            with pytest.raises(GeocoderParseError, match="oops"):
+                await adapter.get_json(f"{server.url}/html", timeout=5, headers={})
+
+    asyncio.run(main())
+
+
+def test_result_columns():
+    columns = ResultColumns(4)
+    columns.set(2, Location("x", (50.0, 4.0), {"properties": {"gid": "openaddresses:1", "layer": "address"}}))
+    columns.set(0, _lazy(_Decoder()))
+    columns.set(1, None)
+    columns.set(3, None, ValueError("down"))
+
+    res = columns.to_dict()
+    np.testing.assert_array_equal(res["lat"], [50.8466, np.nan, 50.0, np.nan])
+    assert res["precision"].tolist() == ["building", None, "address", None]
+    assert res["id"].tolist() == ["a", None, "openaddresses:1", None]
+    assert res["error"].tolist() == [None, None, None, "ValueError('down')"]
+
+    pytest.importorskip("pyarrow")
+    table = columns.to_arrow()
+    assert table.column("id").to_pylist() == ["a", None, "openaddresses:1", None]
+    assert table.column("precision").type.value_type == "string"
+
+
+def test_result_columns_reject_lists_and_raw():
+    columns = ResultColumns(1)
+    with pytest.raises(TypeError, match="list"):
+        columns.set(0, [Location("x", (50.0, 4.0), {})])
+    with pytest.raises(TypeError, match="dict"):
+        columns.set(0, {"items": []})
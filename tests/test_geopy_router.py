@@ -0,0 +1,133 @@
+import time
+
+import pytest
+from geopy.location import Location
+
+from geopy_results import LazyLocation
+from geopy_router import GeocoderRouter
+
+
+class _Cached:
+    # Returns the same (cached) locations for every query
+    def __init__(self, result):
+        self.result = result
+
+    def geocode(self, query, **kwargs):
+        return self.result
+
+
+def test_provider_tagged_on_copies():
+    location = Location("Rue de la Loi 16, 1000 Bruxelles", (50.8466, 4.3686), {"id": "a"})
+    lazy = LazyLocation({"id": "b", "lat": 50.0, "lon": 4.0}, lambda raw: raw["id"],
+                        lambda raw: (raw["lat"], raw["lon"]))
+    router = GeocoderRouter({"first": _Cached(location), "second": _Cached([lazy])})
+
+    res = router.geocode("query")
+    assert res.raw == {"id": "a", "provider": "first"}
+    assert res.address == location.address and res.point == location.point
+    assert location.raw == {"id": "a"}
+
+    router = GeocoderRouter({"second": _Cached([lazy]), "first": _Cached(location)})
+    res = router.geocode("query", exactly_one=False)
+    assert res[0].raw["provider"] == "second"
+    assert "provider" not in lazy.raw
+    # Still decoded on access only
+    assert res[0]._address_of is not None
+    assert (res[0].address, res[0].latitude, res[0].longitude) == ("b", 50.0, 4.0)
+
+
+class _Provider:
+    # Answers after `delay` seconds with a location (found=True), None
+    # (found=False) or an exception
+    def __init__(self, name, delay=0.0, found=True):
+        self.name = name
+        self.delay = delay
+        self.found = found
+        self.calls = 0
+
+    def geocode(self, query, **kwargs):
+        self.calls += 1
+        time.sleep(self.delay)
+        if isinstance(self.found, Exception):
+            raise self.found
+        if not self.found:
+            return None
+        return Location(f"{query} ({self.name})", (50.8, 4.3), {"id": self.name})
+
+
+def _router(providers, policy="fallback", **kwargs):
+    return GeocoderRouter({p.name: p for p in providers}, policy, **kwargs)
+
+
+def test_fallback_order():
+    providers = [_Provider("a", found=False), _Provider("b", found=ValueError("down")), _Provider("c"),
+                 _Provider("d")]
+    with _router(providers) as router:
+        assert router.geocode("q").raw == {"id": "c", "provider": "c"}
+    assert [p.calls for p in providers] == [1, 1, 1, 0]
+    stats = router.stats()["providers"]
+    assert (stats["a"]["empty"], stats["b"]["errors"], stats["c"]["wins"]) == (1, 1, 1)
+
+    # No result: None if a provider answered, the last error otherwise
+    assert _router([_Provider("a", found=ValueError("a")), _Provider("b", found=False)]).geocode("q") is None
+    with pytest.raises(KeyError):
+        _router([_Provider("a", found=ValueError("a")), _Provider("b", found=KeyError("b"))]).geocode("q")
+
+
+def test_hedged():
+    # The first provider is slow: the second one is also called after the
+    # hedge delay, and answers first
+    providers = [_Provider("slow", delay=0.5), _Provider("fast")]
+    with _router(providers, "hedged", hedge_delay=0.1) as router:
+        start = time.monotonic()
+        assert router.geocode("q").raw["provider"] == "fast"
+        assert time.monotonic() - start < 0.4
+        assert router.hedges == 1
+
+    # Fast enough: no hedge
+    providers = [_Provider("a", delay=0.01), _Provider("b")]
+    with _router(providers, "hedged", hedge_delay=0.2) as router:
+        assert router.geocode("q").raw["provider"] == "a"
+        assert router.hedges == 0 and providers[1].calls == 0
+
+
+def test_hedge_delay_from_start_of_provider():
+    # "b" is started at 0.2s and answers without result at 0.38s: "c" is
+    # started 0.2s after the start of "b", not after its answer
+    providers = [_Provider("a", delay=1.0), _Provider("b", delay=0.18, found=False), _Provider("c")]
+    with _router(providers, "hedged", hedge_delay=0.2) as router:
+        start = time.monotonic()
+        assert router.geocode("q").raw["provider"] == "c"
+        assert 0.35 < time.monotonic() - start < 0.5
+        assert router.hedges == 2
+
+
+def test_fastest():
+    providers = [_Provider("a", delay=0.3), _Provider("b", delay=0.05, found=False), _Provider("c", delay=0.1)]
+    with _router(providers, "fastest") as router:
+        assert router.geocode("q").raw["provider"] == "c"
+        assert all(p.calls == 1 for p in providers)
+
+
+def test_adaptive_order():
+    providers = [_Provider("slow", delay=0.02), _Provider("fast"), _Provider("empty", delay=0.001, found=False)]
+    router = _router(providers, adaptive=True, min_samples=2)
+    assert router.order() == ["slow", "fast", "empty"]
+    for _ in range(2):
+        assert router.geocode("q").raw["provider"] == "slow"
+    # Providers without enough observations are tried first
+    assert router.order() == ["fast", "empty", "slow"]
+    for _ in range(2):
+        assert router.geocode("q").raw["provider"] == "fast"
+    assert router.order() == ["empty", "fast", "slow"]
+    for _ in range(2):
+        assert router.geocode("q").raw["provider"] == "fast"
+    # By expected time to a result: latency / success rate
+    assert router.order() == ["fast", "slow", "empty"]
+    assert [p.calls for p in providers] == [2, 4, 2]
+
+    # Not adaptive: the configured order is kept
+    router = _router(providers, min_samples=2)
+    for _ in range(3):
+        assert router.geocode("q").raw["provider"] == "slow"
+    assert router.order() == ["slow", "fast", "empty"]